@@ -0,0 +1,83 @@
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from common.metrics import timer
+
+# Clients that cannot set a query string can offer the token as a WebSocket
+# subprotocol pair instead: new WebSocket(url, ["access_token", token])
+TOKEN_SUBPROTOCOL = "access_token"
+
+
+# A deactivated or edited user is dropped from the cache when saved (see
+# accounts.signals); this bounds staleness after bulk updates that skip save()
+TOKEN_USER_CACHE_TIMEOUT = 60
+
+
+def token_user_cache_key(user_id):
+    return f"ws_token_user:{user_id}"
+
+
+def get_user_for_token(token):
+    """
+    Return the active user for a JWT access token. The token is verified on
+    every call; the user is cached by id for a short while so reconnects do
+    not hit the database.
+
+    Raises ``TokenError`` for an invalid or expired token and
+    ``User.DoesNotExist`` if the user no longer exists or is inactive.
+    """
+    with timer("ws.authenticate"):
+        access_token = AccessToken(token)
+        key = token_user_cache_key(access_token["user_id"])
+        user = cache.get(key)
+        if user is None:
+            User = get_user_model()
+            user = User.objects.get(id=access_token["user_id"], is_active=True)
+            cache.set(key, user, TOKEN_USER_CACHE_TIMEOUT)
+        return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticate WebSocket connections once, at the handshake, from a JWT
+    access token passed as ``?token=...`` or as the ``access_token``
+    subprotocol pair.
+
+    On success ``scope["user"]`` is the token's user and
+    ``scope["jwt_authenticated"]`` is True. Otherwise the scope is left alone
+    and consumers fall back to the ``{"type": "auth"}`` first frame.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        token = self.get_token(scope)
+        if token:
+            user = await database_sync_to_async(self.authenticate)(token)
+            if user is not None:
+                scope["user"] = user
+                scope["jwt_authenticated"] = True
+        return await super().__call__(scope, receive, send)
+
+    def get_token(self, scope):
+        subprotocols = scope.get("subprotocols") or []
+        if TOKEN_SUBPROTOCOL in subprotocols:
+            # Browsers drop the connection unless the server echoes the
+            # subprotocol, even if the token turns out to be invalid
+            scope["auth_subprotocol"] = TOKEN_SUBPROTOCOL
+            index = subprotocols.index(TOKEN_SUBPROTOCOL)
+            if index + 1 < len(subprotocols):
+                return subprotocols[index + 1]
+
+        query = parse_qs(scope.get("query_string", b"").decode())
+        tokens = query.get("token")
+        return tokens[0] if tokens else None
+
+    def authenticate(self, token):
+        try:
+            return get_user_for_token(token)
+        except (TokenError, get_user_model().DoesNotExist):
+            return None
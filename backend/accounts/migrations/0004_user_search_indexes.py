@@ -0,0 +1,51 @@
+"""
+Indexes for accounts.search.
+
+PostgreSQL gets pg_trgm GIN indexes on UPPER(display_name) and UPPER(email),
+the expressions Django's icontains and istartswith lookups compare, built
+concurrently so that the user table stays writable. Other databases get no
+index: a B-tree cannot serve the icontains lookups search uses there.
+"""
+
+from django.db import migrations
+from django.db.models.functions import Upper
+
+FIELDS = {
+    "display_name": "accounts_user_display_name_search",
+    "email": "accounts_user_email_search",
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from django.contrib.postgres.indexes import GinIndex, OpClass
+
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for field, name in FIELDS.items():
+        index = GinIndex(OpClass(Upper(field), name="gin_trgm_ops"), name=name)
+        schema_editor.execute(
+            index.create_sql(CustomUser, schema_editor, concurrently=True)
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in FIELDS.values():
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0003_customuser_allow_dms_from"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
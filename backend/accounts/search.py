@@ -0,0 +1,81 @@
+"""
+Indexed user search for typeahead.
+
+On PostgreSQL, display names and emails are matched anywhere in the string
+with ``icontains``, which the pg_trgm GIN indexes from migration 0004 serve
+for queries of three or more characters; shorter queries match prefixes
+only, which the same indexes serve as anchored patterns. Elsewhere, search
+keeps the original ``icontains`` substring match; it is correct but scans
+the table, which is fine for the SQLite databases of local runs and tests.
+
+Either way results are ranked exact match first, then display name prefix,
+then email prefix, then the rest, alphabetically within each group. Ranked
+ids are cached per normalised query (hashed, so any text makes a valid
+cache key) for a few seconds, so the successive
+requests of someone typing, and everyone searching for the same prefix,
+share one index read.
+"""
+
+import hashlib
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Lower
+from accounts.models import CustomUser
+
+USER_SEARCH_LIMIT = 20
+# New users and renames show up in search at most this many seconds late
+USER_SEARCH_CACHE_TIMEOUT = 30
+MIN_SUBSTRING_QUERY_LENGTH = 3
+
+
+def user_search_cache_key(query):
+    digest = hashlib.sha256(query.lower().encode()).hexdigest()
+    return f"user_search:{digest}"
+
+
+def search_users(query, exclude=None, limit=USER_SEARCH_LIMIT):
+    """
+    Return up to ``limit`` users matching ``query``, best match first,
+    leaving out ``exclude`` (typically the user searching).
+    """
+    query = query.strip().lower()
+    key = user_search_cache_key(query)
+    ids = cache.get(key)
+    if ids is None:
+        # One spare row so that leaving out the searching user still fills a page
+        ids = list(ranked_user_matches(query)[: limit + 1])
+        cache.set(key, ids, USER_SEARCH_CACHE_TIMEOUT)
+
+    ids = [pk for pk in ids if exclude is None or pk != exclude.pk][:limit]
+    users = CustomUser.objects.in_bulk(ids)
+    return [users[pk] for pk in ids if pk in users]
+
+
+def ranked_user_matches(query):
+    """Ids of the users matching a lower-cased query, best match first"""
+    users = CustomUser.objects.all()
+    if (
+        connections[users.db].vendor == "postgresql"
+        and len(query) < MIN_SUBSTRING_QUERY_LENGTH
+    ):
+        # Too short for trigrams; anchored patterns still use the indexes
+        matches = Q(display_name__istartswith=query) | Q(email__istartswith=query)
+    else:
+        matches = Q(display_name__icontains=query) | Q(email__icontains=query)
+
+    return (
+        users.filter(matches)
+        .annotate(name_key=Lower("display_name"), email_key=Lower("email"))
+        .annotate(
+            rank=Case(
+                When(Q(name_key=query) | Q(email_key=query), then=Value(0)),
+                When(name_key__startswith=query, then=Value(1)),
+                When(email_key__startswith=query, then=Value(2)),
+                default=Value(3),
+                output_field=IntegerField(),
+            )
+        )
+        .order_by("rank", "name_key", "id")
+        .values_list("id", flat=True)
+    )
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .middleware import token_user_cache_key
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_token_user(sender, instance, **kwargs):
+    """
+    Drop a saved or deleted user from the WebSocket authentication cache, so
+    deactivation and profile changes apply to the next connection
+    """
+    cache.delete(token_user_cache_key(instance.pk))
@@ -0,0 +1,84 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import TokenError
+from accounts.middleware import JWTAuthMiddleware, get_user_for_token
+
+User = get_user_model()
+
+
+class GetUserForTokenTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="test@example.com", password="testpass123", display_name="Test User"
+        )
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_returns_token_user(self):
+        self.assertEqual(get_user_for_token(self.token), self.user)
+
+    def test_user_is_cached_for_token(self):
+        get_user_for_token(self.token)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_for_token(self.token), self.user)
+
+    def test_deactivated_user_not_served_from_cache(self):
+        """Test that deactivating a user takes effect before the token expires"""
+        get_user_for_token(self.token)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(User.DoesNotExist):
+            get_user_for_token(self.token)
+
+    def test_profile_changes_not_served_from_cache(self):
+        """Test that a renamed user is seen by the next connection"""
+        get_user_for_token(self.token)
+        self.user.display_name = "Renamed"
+        self.user.save()
+
+        self.assertEqual(get_user_for_token(self.token).display_name, "Renamed")
+
+    def test_deleted_user_not_served_from_cache(self):
+        """Test that a deleted user can no longer authenticate"""
+        get_user_for_token(self.token)
+        self.user.delete()
+
+        with self.assertRaises(User.DoesNotExist):
+            get_user_for_token(self.token)
+
+    def test_invalid_token(self):
+        with self.assertRaises(TokenError):
+            get_user_for_token("not-a-token")
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(User.DoesNotExist):
+            get_user_for_token(self.token)
+
+
+class JWTAuthMiddlewareTokenTests(TestCase):
+
+    def setUp(self):
+        self.middleware = JWTAuthMiddleware(inner=None)
+
+    def test_token_from_query_string(self):
+        scope = {"query_string": b"token=abc.def.ghi"}
+
+        self.assertEqual(self.middleware.get_token(scope), "abc.def.ghi")
+        self.assertNotIn("auth_subprotocol", scope)
+
+    def test_token_from_subprotocol(self):
+        scope = {"query_string": b"", "subprotocols": ["access_token", "abc.def.ghi"]}
+
+        self.assertEqual(self.middleware.get_token(scope), "abc.def.ghi")
+        self.assertEqual(scope["auth_subprotocol"], "access_token")
+
+    def test_no_token(self):
+        scope = {"query_string": b"", "subprotocols": []}
+
+        self.assertIsNone(self.middleware.get_token(scope))
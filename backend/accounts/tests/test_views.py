@@ -1,9 +1,13 @@
+import warnings
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
 from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.search import user_search_cache_key
 
 User = get_user_model()
 
@@ -364,3 +368,87 @@ class ProfileViewTests(APITestCase):
         self.assertIn("display_name", user_data)
         # Ensure password is not in response
         self.assertNotIn("password", user_data)
+
+
+class UserSearchViewTests(APITestCase):
+
+    def setUp(self):
+        self.search_url = reverse("user_search")
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.user = User.objects.create_user(
+            email="searcher@example.com", password="testpass123", display_name="Ali"
+        )
+        self.exact = User.objects.create_user(
+            email="zed@example.com", password="testpass123", display_name="Ali"
+        )
+        self.name_prefix = User.objects.create_user(
+            email="yan@example.com", password="testpass123", display_name="Alice"
+        )
+        self.email_prefix = User.objects.create_user(
+            email="alison@example.com", password="testpass123", display_name="Bob"
+        )
+        User.objects.create_user(
+            email="carol@example.com", password="testpass123", display_name="Carol"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def result_ids(self, response):
+        return [result["id"] for result in response.data]
+
+    def test_search_ranks_matches(self):
+        """Test exact matches first, then name prefixes, then email prefixes"""
+        response = self.client.get(self.search_url, {"q": "ali"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.result_ids(response),
+            [str(self.exact.id), str(self.name_prefix.id), str(self.email_prefix.id)],
+        )
+
+    def test_search_is_case_insensitive(self):
+        response = self.client.get(self.search_url, {"q": "ALIS"})
+
+        self.assertEqual(self.result_ids(response), [str(self.email_prefix.id)])
+
+    def test_search_matches_inside_names(self):
+        """Test that matches anywhere in the name or email are found, ranked last"""
+        carol = User.objects.get(email="carol@example.com")
+
+        response = self.client.get(self.search_url, {"q": "aro"})
+
+        self.assertEqual(self.result_ids(response), [str(carol.id)])
+
+    def test_search_cache_key_is_safe_for_any_query(self):
+        """Test that spaces, symbols and long queries make valid cache keys"""
+        query = "bob smith " * 30 + "\u00e9\u00e8 \x00"
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            response = self.client.get(self.search_url, {"q": query})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(user_search_cache_key("Bob"), user_search_cache_key("bob"))
+
+    def test_search_excludes_searching_user(self):
+        response = self.client.get(self.search_url, {"q": "searcher"})
+
+        self.assertEqual(response.data, [])
+
+    def test_search_results_are_cached_per_query(self):
+        """Test that a repeated query only loads the cached users by id"""
+        self.client.get(self.search_url, {"q": "ali"})
+        User.objects.create_user(
+            email="alina@example.com", password="testpass123", display_name="Alina"
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.search_url, {"q": "Ali "})
+
+        self.assertEqual(len(response.data), 3)
+
+    def test_search_query_too_short(self):
+        response = self.client.get(self.search_url, {"q": "a"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
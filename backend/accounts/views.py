@@ -7,7 +7,6 @@ from .serializers import (
     UserLoginSerializer,
 )
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 
@@ -88,7 +87,7 @@ from .serializers import (
     UserProfileSerializer,
     UserSearchSerializer,
 )
-from .models import CustomUser
+from .search import search_users
 from django.db import models
 
 
@@ -110,9 +109,7 @@ class UserSearchView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        users = CustomUser.objects.filter(
-            Q(display_name__icontains=query) | Q(email__icontains=query)
-        ).exclude(id=request.user.id)[:20]
+        users = search_users(query, exclude=request.user)
 
         serializer = UserSearchSerializer(
             users, many=True, context={"request": request}
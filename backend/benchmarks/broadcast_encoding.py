@@ -0,0 +1,99 @@
+"""
+Per-recipient cost of encoding chat broadcasts.
+
+Compares encoding the frame in every recipient's handler (the old
+chat_message_broadcast) with encoding it once at the sender
+(pingo_channels.encoding.chat_message_event), for the standard library and,
+if installed, orjson.
+
+Run from backend/:
+
+    python -m benchmarks.broadcast_encoding --recipients 5000
+"""
+
+import argparse
+import json
+import timeit
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from pingo_channels import encoding
+
+
+def sample_message_data():
+    """A MessageSerializer payload of typical size."""
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 3,
+        "is_deleted": False,
+        "author": {
+            "id": str(uuid.uuid4()),
+            "email": "someone@example.com",
+            "display_name": "Someone",
+            "bio": "Just a regular chatter.",
+            "phone": None,
+            "avatar": None,
+            "is_email_verified": True,
+            "date_joined": now,
+            "allow_dms_from": "everyone",
+        },
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def per_recipient(recipients, message_data):
+    """The old handler: every recipient encodes its own copy of the frame."""
+    for _ in range(recipients):
+        json.dumps({"type": "chat_message", "message": message_data})
+
+
+def encode_once(recipients, message_data):
+    """The new path: one encode at the sender, recipients reuse the text."""
+    event = encoding.chat_message_event(uuid.uuid4(), uuid.uuid4(), message_data)
+    for _ in range(recipients):
+        event["text"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--recipients", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    message_data = sample_message_data()
+    backends = [("json", None)]
+    if encoding.orjson is not None:
+        backends.append(("orjson", encoding.orjson))
+
+    print(f"Broadcast to {args.recipients} recipients (best of {args.repeat})")
+    baseline = min(
+        timeit.repeat(
+            lambda: per_recipient(args.recipients, message_data),
+            number=1,
+            repeat=args.repeat,
+        )
+    )
+    print(
+        f"  per-recipient json.dumps: {baseline * 1000:8.2f} ms total, "
+        f"{baseline / args.recipients * 1e6:6.2f} us/recipient"
+    )
+    for name, module in backends:
+        with patch.object(encoding, "orjson", module):
+            elapsed = min(
+                timeit.repeat(
+                    lambda: encode_once(args.recipients, message_data),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+        print(
+            f"  encode once ({name:6}):     {elapsed * 1000:8.2f} ms total, "
+            f"{elapsed / args.recipients * 1e6:6.2f} us/recipient"
+        )
+
+
+if __name__ == "__main__":
+    main()
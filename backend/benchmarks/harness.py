@@ -0,0 +1,61 @@
+"""
+Shared plumbing for the Django-backed benchmarks.
+
+Importing this module configures Django from DJANGO_SETTINGS_MODULE
+(default: the project settings), so benchmark modules import it before any
+models.
+"""
+
+import os
+import subprocess
+from contextlib import contextmanager
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pingo_project.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+
+@contextmanager
+def benchmark_database(**settings):
+    """
+    Run the block against a throwaway test database created from the
+    configured DATABASES, with fast password hashing and any extra settings.
+    """
+    with override_settings(
+        PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+        **settings,
+    ):
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def percentiles(samples):
+    """Return p50/p90/p99/max of a list of seconds, in milliseconds."""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def at(quantile):
+        return samples[min(int(quantile * len(samples)), len(samples) - 1)] * 1000
+
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": samples[-1] * 1000}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,301 @@
+"""
+REST API benchmark and query budget check.
+
+Seeds a realistic dataset with bulk factories, then measures query counts
+and latency for the list endpoints clients hit most: ServerListView (own
+servers and discovery pages), ServerMembershipListView, ChannelListView,
+MessageListView (first page and a cursor page), message search and the DM
+inbox, message list and search, and user search.
+
+Query counts are compared with benchmarks/rest_query_budgets.json and must
+not go up; they do not depend on dataset size, so the budgets hold for every
+scale. Latency depends on the machine, so it is compared with a baseline
+saved earlier on the same machine with --save-baseline:
+
+    python -m benchmarks.rest_api --scale small --save-baseline /tmp/before.json
+    # ... change code ...
+    python -m benchmarks.rest_api --scale small --baseline /tmp/before.json
+
+The process exits with status 1 if any endpoint is over its query budget or
+its p50 latency regressed by more than --threshold (default 25%).
+
+Scales (servers / channels per server / members per server / messages per
+channel): small 200/5/20/200, medium 2000/10/50/100 (2M messages),
+large 5000/10/100/100 (5M messages).
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from benchmarks.harness import benchmark_database, git_revision, percentiles
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pingo_channels.models import (
+    Channel,
+    DirectMessage,
+    DirectMessageConversation,
+    Message,
+)
+from servers.models import POPULARITY_MEMBER_WEIGHT, Server, ServerMembership
+
+User = get_user_model()
+
+BUDGETS_PATH = Path(__file__).with_name("rest_query_budgets.json")
+
+SCALES = {
+    "small": dict(servers=200, channels=5, members=20, messages=200),
+    "medium": dict(servers=2000, channels=10, members=50, messages=100),
+    "large": dict(servers=5000, channels=10, members=100, messages=100),
+}
+
+BATCH_SIZE = 5000
+
+
+def seed(servers, channels, members, messages, viewer_servers=100, dms=50):
+    """
+    Bulk-create the dataset and return the viewer user plus the ids the
+    endpoints need. The viewer belongs to `viewer_servers` servers and has
+    `dms` DM conversations.
+    """
+    password = make_password("benchmark")
+    user_count = max(members * 10, viewer_servers + dms + 1)
+    users = User.objects.bulk_create(
+        (
+            User(email=f"bench{i}@example.com", password=password)
+            for i in range(user_count)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    viewer = users[0]
+
+    server_objs = Server.objects.bulk_create(
+        (
+            Server(
+                name=f"Server {i}",
+                owner=users[1 + i % (user_count - 1)],
+                visibility="public" if i % 2 else "private",
+                member_count=members,
+                popularity=members * POPULARITY_MEMBER_WEIGHT + i % 97,
+            )
+            for i in range(servers)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    def memberships():
+        for i, server in enumerate(server_objs):
+            owner_index = 1 + i % (user_count - 1)
+            yield ServerMembership(user=server.owner, server=server, role="owner")
+            for j in range(1, members):
+                index = 1 + (owner_index + j - 1) % (user_count - 1)
+                if index != owner_index:
+                    yield ServerMembership(user=users[index], server=server)
+            if i < viewer_servers:
+                yield ServerMembership(user=viewer, server=server)
+
+    ServerMembership.objects.bulk_create(
+        memberships(), batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+    channel_objs = Channel.objects.bulk_create(
+        (
+            Channel(name=f"channel-{j}", server=server, created_by=server.owner)
+            for server in server_objs
+            for j in range(channels)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    start = timezone.now() - timedelta(days=30)
+    for offset in range(0, len(channel_objs), 50):
+        Message.objects.bulk_create(
+            (
+                Message(
+                    content=f"Message {k}",
+                    channel=channel,
+                    author=users[1 + k % (user_count - 1)],
+                    created_at=start + timedelta(seconds=k),
+                )
+                for channel in channel_objs[offset : offset + 50]
+                for k in range(messages)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+    conversations = [
+        DirectMessageConversation.get_or_create_conversation(viewer, users[-1 - i])[0]
+        for i in range(dms)
+    ]
+    DirectMessage.objects.bulk_create(
+        (
+            DirectMessage(
+                conversation=conversation,
+                sender=viewer if k % 2 else conversation.get_other_participant(viewer),
+                content=f"DM {k}",
+            )
+            for conversation in conversations
+            for k in range(20)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    server = server_objs[0]
+    channel = channel_objs[0]
+    middle = Message.objects.filter(channel=channel).order_by("created_at")[
+        messages // 2
+    ]
+    return viewer, {
+        "server": server.id,
+        "channel": channel.id,
+        "cursor": middle.id,
+        "conversation": conversations[0].id,
+        # A public server the viewer has not joined
+        "discovery_cursor": server_objs[viewer_servers | 1].id,
+    }
+
+
+def endpoints(ids):
+    server, channel = ids["server"], ids["channel"]
+    messages = f"/api/servers/{server}/channels/{channel}/messages/"
+    return {
+        "server_list": ("/api/servers/", {}),
+        "server_discovery": ("/api/servers/", {"discovery": "true"}),
+        "server_discovery_cursor": (
+            "/api/servers/",
+            {"discovery": "true", "after": ids["discovery_cursor"]},
+        ),
+        "server_memberships": (f"/api/servers/{server}/memberships/", {}),
+        "channel_list": (f"/api/servers/{server}/channels/", {}),
+        "message_list": (messages, {}),
+        "message_list_cursor": (messages, {"before": ids["cursor"]}),
+        "message_search": (
+            f"/api/servers/{server}/channels/search/",
+            {"q": "message 150"},
+        ),
+        "dm_conversation_list": ("/api/dm/conversations/", {}),
+        "dm_message_search": ("/api/dm/conversations/search/", {"q": "DM 7"}),
+        "user_search": ("/api/auth/users/search/", {"q": "bench12"}),
+        "dm_message_list": (
+            f"/api/dm/conversations/{ids['conversation']}/messages/",
+            {},
+        ),
+    }
+
+
+def measure(client, url, params, iterations):
+    # Each request clears the query log when it starts; start from empty so
+    # the captured slice is the whole request
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, params)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+    # Read the count now: the captured slice is of the live log
+    query_count = len(queries)
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        client.get(url, params)
+        timings.append(time.perf_counter() - start)
+    return {"queries": query_count, "latency_ms": percentiles(timings)}
+
+
+def check(results, budgets, baseline, threshold):
+    failures = []
+    for name, result in results.items():
+        budget = budgets.get(name)
+        if budget is not None and result["queries"] > budget:
+            failures.append(f"{name}: {result['queries']} queries, budget is {budget}")
+        if baseline and name in baseline:
+            before = baseline[name]["latency_ms"]["p50"]
+            after = result["latency_ms"]["p50"]
+            if after > before * (1 + threshold):
+                failures.append(
+                    f"{name}: p50 {after:.2f} ms, baseline {before:.2f} ms "
+                    f"(+{(after / before - 1) * 100:.0f}%)"
+                )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--baseline", help="compare latency with this saved run")
+    parser.add_argument("--save-baseline", help="save this run's results here")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed p50 latency regression (fraction)",
+    )
+    parser.add_argument(
+        "--update-budgets",
+        action="store_true",
+        help="write the measured query counts as the new budgets",
+    )
+    args = parser.parse_args()
+
+    with benchmark_database(ALLOWED_HOSTS=["testserver"]):
+        started = time.perf_counter()
+        viewer, ids = seed(**SCALES[args.scale])
+        print(
+            f"Seeded {args.scale} dataset in {time.perf_counter() - started:.1f} s "
+            f"({Message.objects.count()} messages)"
+        )
+
+        client = APIClient()
+        client.force_authenticate(user=viewer)
+        results = {
+            name: measure(client, url, params, args.iterations)
+            for name, (url, params) in endpoints(ids).items()
+        }
+
+    print(f"{'endpoint':24} {'queries':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, result in results.items():
+        latency = result["latency_ms"]
+        print(
+            f"{name:24} {result['queries']:7} {latency['p50']:9.2f} "
+            f"{latency['p99']:9.2f}"
+        )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(
+                {"revision": git_revision(), "scale": args.scale, "results": results},
+                f,
+                indent=2,
+            )
+    if args.update_budgets:
+        budgets = {name: result["queries"] for name, result in results.items()}
+        BUDGETS_PATH.write_text(json.dumps(budgets, indent=2) + "\n")
+        print(f"Updated {BUDGETS_PATH.name}")
+        return
+
+    budgets = json.loads(BUDGETS_PATH.read_text())
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    failures = check(results, budgets, baseline, args.threshold)
+    if failures:
+        print("FAILED")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
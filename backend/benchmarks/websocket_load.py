@@ -0,0 +1,308 @@
+"""
+WebSocket load benchmark for ChatConsumer and DirectMessageConsumer.
+
+Runs N simulated clients against the real ASGI application (JWT middleware,
+routing and consumers) in a single event loop, i.e. one Daphne worker's
+worth of capacity. Each client authenticates with a token at the handshake,
+joins a channel (or DM conversation) and sends messages; the harness
+reports:
+
+  * connect + auth latency percentiles
+  * traced Python memory per open connection
+  * messages/s sent and frames/s delivered
+  * send-to-echo latency percentiles (time until the sender receives its own
+    broadcast, which includes the DB write and the group fan-out)
+
+Clients talk through Channels' in-memory layer by default or a Redis layer
+with --redis, fanning out per worker (pub/sub) or per socket as chosen with
+--fanout; with Redis the report includes the commands Redis processed per
+message sent. The database is a throwaway test database created from the
+configured settings, so runs are reproducible and comparable across commits;
+pass --output to save the numbers as JSON alongside the git revision.
+
+Run from backend/:
+
+    python -m benchmarks.websocket_load --clients 200 --channels 10 --messages 20
+    python -m benchmarks.websocket_load --mode dm --clients 200
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from benchmarks.harness import benchmark_database, git_revision, percentiles
+
+import redis.asyncio
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from rest_framework_simplejwt.tokens import AccessToken
+
+from pingo_channels.models import Channel, DirectMessageConversation
+from servers.models import Server, ServerMembership
+
+User = get_user_model()
+
+RECEIVE_TIMEOUT = 30
+
+
+def seed_chat(clients, channels):
+    """One server with `channels` channels and `clients` members."""
+    password = make_password("benchmark")
+    users = User.objects.bulk_create(
+        User(
+            email=f"bench{i}@example.com", password=password, display_name=f"Bench {i}"
+        )
+        for i in range(clients)
+    )
+    server = Server.objects.create(name="Benchmark", owner=users[0])
+    ServerMembership.objects.bulk_create(
+        ServerMembership(user=user, server=server, role="member") for user in users[1:]
+    )
+    targets = [server.channels.get(name="general")]
+    targets += [
+        Channel.objects.create(name=f"bench-{i}", server=server)
+        for i in range(1, channels)
+    ]
+    return [
+        (
+            user,
+            f"/ws/chat/{server.id}/{targets[i % len(targets)].id}/",
+            targets[i % len(targets)].id,
+        )
+        for i, user in enumerate(users)
+    ]
+
+
+def seed_dm(clients):
+    """`clients` users paired off into DM conversations."""
+    password = make_password("benchmark")
+    users = User.objects.bulk_create(
+        User(
+            email=f"bench{i}@example.com", password=password, display_name=f"Bench {i}"
+        )
+        for i in range(clients - clients % 2)
+    )
+    plan = []
+    for first, second in zip(users[::2], users[1::2]):
+        conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            first, second
+        )
+        path = f"/ws/chat/direct/{conversation.id}/"
+        plan += [(first, path, conversation.id), (second, path, conversation.id)]
+    return plan
+
+
+class Client:
+    """One simulated socket."""
+
+    def __init__(self, application, user, path, group):
+        self.token = str(AccessToken.for_user(user))
+        self.communicator = WebsocketCommunicator(
+            application, f"{path}?token={self.token}"
+        )
+        self.user_id = str(user.id)
+        self.group = group
+        self.sent_at = {}
+        self.latencies = []
+        self.received = 0
+
+    async def connect(self):
+        start = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout=RECEIVE_TIMEOUT)
+        response = await self.communicator.receive_json_from(timeout=RECEIVE_TIMEOUT)
+        if not connected or response["type"] != "auth_success":
+            raise RuntimeError(f"Client failed to authenticate: {response}")
+        return time.perf_counter() - start
+
+    async def send(self, frame_type, index):
+        content = f"{self.user_id}:{index}"
+        self.sent_at[content] = time.perf_counter()
+        await self.communicator.send_json_to({"type": frame_type, "content": content})
+
+    async def receive(self, expected):
+        while self.received < expected:
+            frame = await self.communicator.receive_json_from(timeout=RECEIVE_TIMEOUT)
+            if frame["type"] == "error":
+                raise RuntimeError(f"Server error: {frame['message']}")
+            if "message" not in frame:
+                continue
+            self.received += 1
+            sent_at = self.sent_at.pop(frame["message"]["content"], None)
+            if sent_at is not None:
+                self.latencies.append(time.perf_counter() - sent_at)
+
+
+async def run(args, plan):
+    from pingo_project.asgi import application
+
+    clients = [Client(application, user, path, group) for user, path, group in plan]
+    frame_type = "chat_message" if args.mode == "chat" else "direct_message"
+
+    # Tracing allocations slows connects down; --no-trace-memory for clean latencies
+    if args.trace_memory:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    connect_times = []
+    for start in range(0, len(clients), args.connect_batch):
+        batch = clients[start : start + args.connect_batch]
+        connect_times += await asyncio.gather(*(client.connect() for client in batch))
+    memory = None
+    if args.trace_memory:
+        memory = (tracemalloc.get_traced_memory()[0] - baseline) / len(clients) / 1024
+        tracemalloc.stop()
+
+    # Every client receives every message sent to its group, its own included
+    group_sizes = {}
+    for client in clients:
+        group_sizes[client.group] = group_sizes.get(client.group, 0) + 1
+
+    async def chat(client):
+        receiver = asyncio.ensure_future(
+            client.receive(group_sizes[client.group] * args.messages)
+        )
+        for index in range(args.messages):
+            await client.send(frame_type, index)
+            if args.interval:
+                await asyncio.sleep(args.interval)
+        await receiver
+
+    commands = await redis_commands(args.redis)
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    if commands is not None:
+        commands = await redis_commands(args.redis) - commands
+
+    for client in clients:
+        await client.communicator.disconnect()
+
+    sent = len(clients) * args.messages
+    delivered = sum(client.received for client in clients)
+    return {
+        "clients": len(clients),
+        "groups": len(group_sizes),
+        "connect_ms": percentiles(connect_times),
+        "memory_per_connection_kib": memory,
+        "elapsed_s": elapsed,
+        "messages_sent": sent,
+        "messages_per_s": sent / elapsed,
+        "frames_delivered": delivered,
+        "frames_per_s": delivered / elapsed,
+        "redis_commands_per_message": None if commands is None else commands / sent,
+        "latency_ms": percentiles(
+            [latency for client in clients for latency in client.latencies]
+        ),
+    }
+
+
+async def redis_commands(url):
+    """Commands the Redis server has processed, or None without Redis"""
+    if not url:
+        return None
+    client = redis.asyncio.Redis.from_url(url)
+    try:
+        return (await client.info("stats"))["total_commands_processed"]
+    finally:
+        await client.aclose()
+
+
+def print_report(args, results):
+    print(
+        f"{args.mode}: {results['clients']} clients in {results['groups']} groups, "
+        f"{args.messages} messages each"
+    )
+    connect = results["connect_ms"]
+    print(
+        f"  connect+auth   p50 {connect['p50']:8.2f} ms   p99 {connect['p99']:8.2f} ms"
+    )
+    if results["memory_per_connection_kib"] is not None:
+        print(
+            f"  memory         {results['memory_per_connection_kib']:8.1f} "
+            "KiB/connection (connect times include tracing overhead)"
+        )
+    print(
+        f"  throughput     {results['messages_per_s']:8.0f} messages/s sent, "
+        f"{results['frames_per_s']:8.0f} frames/s delivered"
+    )
+    if results["redis_commands_per_message"] is not None:
+        print(
+            f"  redis          {results['redis_commands_per_message']:8.1f} "
+            f"commands/message ({args.fanout} fan-out)"
+        )
+    latency = results["latency_ms"]
+    print(
+        f"  send-to-echo   p50 {latency['p50']:8.2f} ms   p90 {latency['p90']:8.2f} ms"
+        f"   p99 {latency['p99']:8.2f} ms   max {latency['max']:8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=["chat", "dm"], default="chat")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--channels", type=int, default=5, help="chat mode only")
+    parser.add_argument("--messages", type=int, default=10, help="per client")
+    parser.add_argument(
+        "--interval", type=float, default=0, help="seconds between a client's sends"
+    )
+    parser.add_argument("--connect-batch", type=int, default=50)
+    parser.add_argument("--redis", help="use a Redis channel layer at this URL")
+    parser.add_argument(
+        "--fanout",
+        choices=["socket", "worker"],
+        default="socket",
+        help="Redis layer: pub/sub per worker or a queue per socket",
+    )
+    parser.add_argument(
+        "--write-behind", action="store_true", help="enable write-behind persistence"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="skip memory tracing while connecting",
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.redis and args.fanout == "worker":
+        layer = {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {"hosts": [args.redis]},
+        }
+    elif args.redis:
+        layer = {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [args.redis], "capacity": 10000},
+        }
+    else:
+        layer = {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": {"capacity": 10000},
+        }
+
+    with benchmark_database(
+        CHANNEL_LAYERS={"default": layer},
+        PINGO_WRITE_BEHIND_MESSAGES=args.write_behind,
+    ):
+        if args.mode == "chat":
+            plan = seed_chat(args.clients, args.channels)
+        else:
+            plan = seed_dm(args.clients)
+        results = asyncio.run(run(args, plan))
+
+    print_report(args, results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"revision": git_revision(), "args": vars(args), "results": results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
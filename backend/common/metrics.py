@@ -0,0 +1,174 @@
+"""
+Lightweight instrumentation for hot paths.
+
+Code records timings and counts through the module-level helpers::
+
+    with timer("chat.persist", channel=channel_id):
+        ...
+    increment("chat.frames_sent", channel=channel_id)
+
+and the backend named by ``PINGO_METRICS_BACKEND`` decides what happens to
+them. ``InMemoryMetrics`` keeps per-process series and renders them in the
+Prometheus text format for the ``/metrics/`` endpoint; ``NullMetrics``
+turns instrumentation off. Any class with the same three methods can be
+plugged in instead, e.g. one that forwards to StatsD.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+QUANTILES = (0.5, 0.99)
+
+
+class NullMetrics:
+    """Discards everything"""
+
+    def observe(self, name, seconds, labels):
+        pass
+
+    def increment(self, name, amount, labels):
+        pass
+
+    def render(self):
+        return ""
+
+
+class InMemoryMetrics:
+    """
+    Keeps timings and counters in memory, per process.
+
+    Each timing series keeps its running sum and count plus the most recent
+    ``window`` samples, from which the exported quantiles are computed. At
+    most ``max_series`` label combinations are tracked per metric so that a
+    per-channel label cannot grow memory without bound; samples for further
+    combinations are dropped.
+    """
+
+    def __init__(self, window=1024, max_series=1000):
+        self.window = window
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+
+    def _series(self, store, name, labels, factory):
+        key = tuple(sorted(labels.items()))
+        series = store.setdefault(name, {})
+        if key not in series:
+            if len(series) >= self.max_series:
+                return None
+            series[key] = factory()
+        return series[key]
+
+    def observe(self, name, seconds, labels):
+        with self._lock:
+            series = self._series(
+                self._timings,
+                name,
+                labels,
+                lambda: {"samples": deque(maxlen=self.window), "sum": 0.0, "count": 0},
+            )
+            if series is not None:
+                series["samples"].append(seconds)
+                series["sum"] += seconds
+                series["count"] += 1
+
+    def increment(self, name, amount, labels):
+        with self._lock:
+            series = self._series(self._counters, name, labels, lambda: [0])
+            if series is not None:
+                series[0] += amount
+
+    def render(self):
+        """Render every series in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            timings = {
+                name: {
+                    key: (sorted(s["samples"]), s["sum"], s["count"])
+                    for key, s in series.items()
+                }
+                for name, series in self._timings.items()
+            }
+            counters = {
+                name: {key: value[0] for key, value in series.items()}
+                for name, series in self._counters.items()
+            }
+
+        for name, series in sorted(timings.items()):
+            metric = f"pingo_{_metric_name(name)}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for key, (samples, total, count) in sorted(series.items()):
+                for quantile in QUANTILES:
+                    labels = _format_labels(key + (("quantile", str(quantile)),))
+                    lines.append(f"{metric}{labels} {_quantile(samples, quantile)}")
+                labels = _format_labels(key)
+                lines.append(f"{metric}_sum{labels} {total}")
+                lines.append(f"{metric}_count{labels} {count}")
+
+        for name, series in sorted(counters.items()):
+            metric = f"pingo_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{metric}{_format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _metric_name(name):
+    return name.replace(".", "_").replace("-", "_")
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for label, value in key
+    )
+    return "{" + pairs + "}"
+
+
+def _quantile(samples, quantile):
+    if not samples:
+        return "NaN"
+    index = min(int(quantile * len(samples)), len(samples) - 1)
+    return samples[index]
+
+
+_backend = None
+
+
+def get_metrics():
+    """Return the configured metrics backend, created on first use"""
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.PINGO_METRICS_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_metrics(setting, **kwargs):
+    global _backend
+    if setting == "PINGO_METRICS_BACKEND":
+        _backend = None
+
+
+@contextmanager
+def timer(name, **labels):
+    """Record how long the block takes, in seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_metrics().observe(name, time.perf_counter() - start, labels)
+
+
+def increment(name, amount=1, **labels):
+    get_metrics().increment(name, amount, labels)
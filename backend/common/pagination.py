@@ -0,0 +1,16 @@
+from rest_framework.response import Response
+from rest_framework import status
+
+
+def get_page_limit(request, default, maximum):
+    """Parse the ``limit`` query parameter, returning ``(limit, error_response)``."""
+    try:
+        limit = int(request.query_params.get("limit", default))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= maximum:
+        return None, Response(
+            {"error": f"limit must be between 1 and {maximum}."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return limit, None
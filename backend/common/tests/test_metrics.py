@@ -0,0 +1,125 @@
+# common/tests/test_metrics.py
+
+from django.test import SimpleTestCase, override_settings
+from common import metrics
+from common.metrics import InMemoryMetrics, NullMetrics
+
+
+class InMemoryMetricsTests(SimpleTestCase):
+    """Test the in-memory metrics backend"""
+
+    def test_render_summary_quantiles(self):
+        """Test that timings export p50, p99, sum and count per label set"""
+        backend = InMemoryMetrics()
+        for ms in range(1, 101):
+            backend.observe("chat.db_write", ms / 1000, {"channel": "a"})
+        backend.observe("chat.db_write", 0.5, {"channel": "b"})
+
+        output = backend.render()
+
+        self.assertIn("# TYPE pingo_chat_db_write_seconds summary", output)
+        self.assertIn(
+            'pingo_chat_db_write_seconds{channel="a",quantile="0.5"} 0.051', output
+        )
+        self.assertIn(
+            'pingo_chat_db_write_seconds{channel="a",quantile="0.99"} 0.1', output
+        )
+        self.assertIn('pingo_chat_db_write_seconds_count{channel="a"} 100', output)
+        self.assertIn('pingo_chat_db_write_seconds_count{channel="b"} 1', output)
+
+    def test_render_counters(self):
+        """Test that counters export as totals"""
+        backend = InMemoryMetrics()
+        backend.increment("chat.frames_sent", 3, {"channel": "a"})
+        backend.increment("chat.frames_sent", 2, {"channel": "a"})
+
+        self.assertIn('pingo_chat_frames_sent_total{channel="a"} 5', backend.render())
+
+    def test_window_bounds_samples(self):
+        """Test that quantiles come from the most recent samples only"""
+        backend = InMemoryMetrics(window=10)
+        for _ in range(100):
+            backend.observe("stage", 1.0, {})
+        for _ in range(10):
+            backend.observe("stage", 2.0, {})
+
+        output = backend.render()
+
+        self.assertIn('pingo_stage_seconds{quantile="0.5"} 2.0', output)
+        self.assertIn("pingo_stage_seconds_count 110", output)
+
+    def test_series_limit(self):
+        """Test that label combinations beyond the limit are dropped"""
+        backend = InMemoryMetrics(max_series=2)
+        for channel in ["a", "b", "c"]:
+            backend.increment("chat.frames_sent", 1, {"channel": channel})
+
+        output = backend.render()
+
+        self.assertIn('channel="b"', output)
+        self.assertNotIn('channel="c"', output)
+
+    def test_label_values_are_escaped(self):
+        """Test that quotes in label values cannot break the format"""
+        backend = InMemoryMetrics()
+        backend.increment("events", 1, {"name": 'say "hi"'})
+
+        self.assertIn('pingo_events_total{name="say \\"hi\\""} 1', backend.render())
+
+
+class MetricsHelperTests(SimpleTestCase):
+    """Test the timer and increment helpers"""
+
+    @override_settings(PINGO_METRICS_BACKEND="common.metrics.InMemoryMetrics")
+    def test_timer_records_on_error(self):
+        """Test that a failing block is still timed"""
+        with self.assertRaises(ValueError):
+            with metrics.timer("failing", channel="a"):
+                raise ValueError
+
+        self.assertIn(
+            'pingo_failing_seconds_count{channel="a"} 1', metrics.get_metrics().render()
+        )
+
+    @override_settings(PINGO_METRICS_BACKEND="common.metrics.NullMetrics")
+    def test_backend_is_pluggable(self):
+        """Test that the backend comes from settings"""
+        with metrics.timer("stage"):
+            pass
+        metrics.increment("events")
+
+        self.assertIsInstance(metrics.get_metrics(), NullMetrics)
+        self.assertEqual(metrics.get_metrics().render(), "")
+
+
+@override_settings(
+    PINGO_METRICS_BACKEND="common.metrics.InMemoryMetrics",
+    PINGO_METRICS_TOKEN="scrape-secret",
+)
+class MetricsViewTests(SimpleTestCase):
+    """Test the Prometheus metrics endpoint"""
+
+    def test_scrape(self):
+        """Test that the exposition text is served to the scraper"""
+        metrics.increment("events")
+
+        response = self.client.get(
+            "/metrics/", HTTP_AUTHORIZATION="Bearer scrape-secret"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn("pingo_events_total 1", response.content.decode())
+
+    def test_wrong_token(self):
+        """Test that the token is required"""
+        response = self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer wrong")
+
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(PINGO_METRICS_TOKEN="")
+    def test_disabled_without_token(self):
+        """Test that the endpoint does not exist unless configured"""
+        response = self.client.get("/metrics/")
+
+        self.assertEqual(response.status_code, 404)
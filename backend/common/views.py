@@ -1,3 +1,22 @@
-from django.shortcuts import render
+import hmac
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from .metrics import get_metrics
 
-# Create your views here.
+
+def metrics_view(request):
+    """
+    Export hot-path timings and counters in the Prometheus text format.
+
+    Disabled unless PINGO_METRICS_TOKEN is set; scrapers must send it as
+    ``Authorization: Bearer <token>``.
+    """
+    token = settings.PINGO_METRICS_TOKEN
+    if not token:
+        raise Http404
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization, f"Bearer {token}"):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        get_metrics().render(), content_type="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,154 @@
+"""
+Live access changes for connected sockets.
+
+Sockets look up the user's role and the channel's permissions once, when
+they join a channel, and keep them in memory. Views that change either send
+an access event over the channel layer once their transaction commits:
+
+``membership_changed``
+    to ``member_<server_id>_<user_id>``, which each of the user's sockets in
+    the server joins; ``role`` is the new role, or None once the user has
+    left or been removed
+``channel_roles_changed``
+    to the channel's chat group, with the channel's new minimum roles
+
+Sockets recompute their permissions from the event without querying the
+database. One that can still view the channel is sent a
+``permissions_updated`` frame; one that cannot is sent ``access_revoked``
+and stops receiving the channel (the per-channel socket is closed with code
+4003, the gateway only drops the subscription).
+
+The events are sent once and can be lost, so each socket also re-reads
+the user's roles and its channels' minimum roles from the database on its
+own timer (``AccessRecheck``), about every ``PINGO_ACCESS_RECHECK_SECONDS``.
+A lost event is corrected within that interval. The timer runs beside the
+socket's message handling, so delivering a broadcast never waits on it,
+and its random jitter keeps sockets that connected together from querying
+together.
+"""
+
+import asyncio
+import logging
+import random
+from django.conf import settings
+
+from .encoding import chat_group_name, encode_frame, member_group_name
+from .models import PERMISSION_FIELDS, Channel
+from .utils import broadcast_on_commit
+
+logger = logging.getLogger(__name__)
+
+ACCESS_REVOKED_CLOSE_CODE = 4003
+CHANNEL_ROLE_FIELDS = tuple(PERMISSION_FIELDS.values())
+
+
+def membership_event(server_id, user_id, role):
+    return {
+        "type": "membership_changed",
+        "group": member_group_name(server_id, user_id),
+        "server_id": str(server_id),
+        "role": role,
+    }
+
+
+def channel_roles_event(channel):
+    return {
+        "type": "channel_roles_changed",
+        "group": chat_group_name(channel.server_id, channel.id),
+        "roles": {field: getattr(channel, field) for field in CHANNEL_ROLE_FIELDS},
+    }
+
+
+def broadcast_membership_change(server_id, user_id, role=None):
+    """Tell a user's sockets in a server their new role, None if removed"""
+    event = membership_event(server_id, user_id, role)
+    broadcast_on_commit(event["group"], event)
+
+
+def broadcast_channel_roles(channel):
+    """Tell a channel's sockets its minimum roles changed"""
+    event = channel_roles_event(channel)
+    broadcast_on_commit(event["group"], event)
+
+
+def apply_channel_roles(channel, event):
+    """Update a socket's copy of a channel from a channel_roles_changed event"""
+    for field, role in event["roles"].items():
+        setattr(channel, field, role)
+
+
+def reload_channel_access(user, channels):
+    """
+    Re-read ``user``'s roles and the minimum roles of ``channels`` (a
+    socket's copies) into them, in one query. A removed member, or a
+    deleted channel, leaves no role. Returns the ids of the channels whose
+    access changed.
+    """
+    current = Channel.objects.with_user_role(user).in_bulk(
+        [channel.id for channel in channels]
+    )
+    changed = set()
+    for channel in channels:
+        fresh = current.get(channel.id)
+        role = fresh.user_role if fresh else None
+        roles = {
+            field: getattr(fresh or channel, field) for field in CHANNEL_ROLE_FIELDS
+        }
+        if role != channel.user_role or any(
+            getattr(channel, field) != value for field, value in roles.items()
+        ):
+            changed.add(channel.id)
+        channel.user_role = role
+        apply_channel_roles(channel, {"roles": roles})
+    return changed
+
+
+class AccessRecheck:
+    """
+    Awaits a socket's ``check`` coroutine function every
+    ``PINGO_ACCESS_RECHECK_SECONDS``, give or take half of it at random,
+    until cancelled.
+    """
+
+    def __init__(self, check):
+        self.check = check
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        interval = settings.PINGO_ACCESS_RECHECK_SECONDS
+        while True:
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+            try:
+                await self.check()
+            except Exception:
+                logger.warning("Could not re-check socket access", exc_info=True)
+
+
+def permissions_updated_frame(role, permissions, **target):
+    return encode_frame(
+        {
+            "type": "permissions_updated",
+            "role": role,
+            "permissions": permissions,
+            **target,
+        }
+    )
+
+
+def access_revoked_frame(**target):
+    return encode_frame(
+        {
+            "type": "access_revoked",
+            "message": "You no longer have access to this channel",
+            **target,
+        }
+    )
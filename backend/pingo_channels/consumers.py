@@ -1,12 +1,137 @@
 import json
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+
+from accounts.middleware import get_user_for_token
+from common.metrics import timer
 
 from .models import Channel, Message, DirectMessageConversation, DirectMessage
 from servers.models import Server, ServerMembership
+from .access import (
+    ACCESS_REVOKED_CLOSE_CODE,
+    AccessRecheck,
+    access_revoked_frame,
+    apply_channel_roles,
+    permissions_updated_frame,
+    reload_channel_access,
+)
+from .encoding import chat_message_event, direct_message_event
+from .outbound import OutboundQueue
+from .persistence import get_message_writer
+from .presence import get_presence
+from .replay import broadcast_sequenced, latest_sequence, resume_frames
+from .utils import (
+    chat_group_name,
+    direct_message_group_name,
+    mark_conversation_read,
+    member_group_name,
+    presence_group_name,
+)
 from .serializers import MessageSerializer, DirectMessageSerializer
 
+User = get_user_model()
+
+
+def get_channel_access(user, server_id, channel_id):
+    """
+    Load the channel, its server and the user's membership in one query.
+    Returns ``(channel, error_message)``.
+    """
+    with timer("channel.access_check", channel=channel_id):
+        channel = (
+            Channel.objects.with_user_role(user)
+            .filter(id=channel_id, server_id=server_id)
+            .first()
+        )
+    if channel:
+        if not channel.user_role:
+            return None, "You are not a member of this server"
+        return channel, None
+
+    # Work out which lookup failed only on the error path
+    if not Server.objects.filter(id=server_id).exists():
+        return None, "Server not found"
+    if not ServerMembership.get_role(user, server_id):
+        return None, "You are not a member of this server"
+    return None, "Channel not found in this server"
+
+
+def get_conversation_access(user, conversation_id):
+    """
+    Load the conversation with both participants in one query.
+    Returns ``(conversation, other_participant, error_message)``.
+    """
+    try:
+        conversation = DirectMessageConversation.objects.select_related(
+            "participant1", "participant2"
+        ).get(id=conversation_id)
+    except DirectMessageConversation.DoesNotExist:
+        return None, None, "Conversation not found"
+
+    # Check if user is participant in this conversation
+    if not conversation.is_participant(user):
+        return None, None, "You are not a participant in this conversation"
+
+    # Get the other participant
+    other_participant = conversation.get_other_participant(user)
+    if not other_participant:
+        return None, None, "Could not find other participant"
+
+    return conversation, other_participant, None
+
+
+def create_channel_message(channel, author, content):
+    """
+    Create a channel message and serialize it. Runs as one synchronous unit
+    (via ``database_sync_to_async``) so no ORM access, including lazy
+    relation loads during serialization, happens on the event loop.
+    """
+    with timer("chat.db_write", channel=channel.id):
+        message = Message.objects.create(
+            content=content, channel=channel, author=author
+        )
+    with timer("chat.serialize", channel=channel.id):
+        return MessageSerializer(message).data
+
+
+async def post_channel_message(channel, author, content):
+    """
+    Create a channel message for broadcast. With write-behind enabled the
+    message is only queued, so it can be broadcast before it is stored,
+    unless the queue is full.
+    """
+    writer = get_message_writer()
+    # A full queue means storage is behind or down: store this message
+    # before broadcasting it, so senders are held back rather than the queue
+    # growing without bound
+    if writer is None or writer.is_full():
+        return await database_sync_to_async(create_channel_message)(
+            channel, author, content
+        )
+    message = writer.enqueue(Message(content=content, channel=channel, author=author))
+    with timer("chat.serialize", channel=channel.id):
+        return MessageSerializer(message).data
+
+
+def create_direct_message(conversation, sender, content):
+    """Create a direct message and serialize it in one synchronous unit."""
+    message = DirectMessage.objects.create(
+        content=content, conversation=conversation, sender=sender
+    )
+    return DirectMessageSerializer(message).data
+
+
+def get_last_seq(data):
+    """The ``last_seq`` of a resume frame, or None if it is not valid"""
+    last_seq = data.get("last_seq")
+    if isinstance(last_seq, bool) or not isinstance(last_seq, int) or last_seq < 0:
+        return None
+    return last_seq
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
 
@@ -19,11 +144,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.membership = None
         self.channel_permissions = None
         self.group_name = None
+        self.outbound = OutboundQueue(self.send, self.close)
+        self.access_recheck = AccessRecheck(self._recheck_access)
 
     async def connect(self):
         self.server_id = self.scope["url_route"]["kwargs"]["server_id"]
         self.channel_id = self.scope["url_route"]["kwargs"]["channel_id"]
-        await self.accept()
+        await self.accept(subprotocol=self.scope.get("auth_subprotocol"))
+        if self.scope.get("jwt_authenticated"):
+            # Already authenticated by JWTAuthMiddleware at the handshake
+            await self._authorize(self.scope["user"])
+            return
         await self.send(
             text_data=json.dumps(
                 {
@@ -40,8 +171,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
+        self.outbound.cancel()
+        self.access_recheck.cancel()
         if self.authenticated and self.group_name:
-            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await self._leave()
+
+    async def _leave(self):
+        self.authenticated = False
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self.channel_layer.group_discard(
+            presence_group_name(self.server_id), self.channel_name
+        )
+        await self.channel_layer.group_discard(
+            member_group_name(self.server_id, self.user.id), self.channel_name
+        )
+        await get_presence().disconnect(self.user.id, self.server_id, self.channel_name)
 
     async def receive(self, text_data):
         try:
@@ -70,6 +214,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self._handle_ping()
             elif message_type == "chat_message":
                 await self._handle_chat_message(data)
+            elif message_type == "resume":
+                await self._handle_resume(data)
 
             elif message_type == "test_message":
                 await self._handle_test_message(data)
@@ -83,6 +229,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             "message": f"Unknown message type: {message_type}",
                             "supported_types": [
                                 "ping",
+                                "resume",
                                 "test_message",
                                 "connection_test",
                             ],
@@ -124,19 +271,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 )
                 return
 
-            message = await database_sync_to_async(Message.objects.create)(
-                content=content, channel=self.channel, author=self.user
-            )
-            message_data = self._serialize_message(message)
+            with timer("chat.handle_message", channel=self.channel_id):
+                message_data = await post_channel_message(
+                    self.channel, self.user, content
+                )
 
-            # Broadcast message to all users in this channel group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "chat_message_broadcast",  # Method name (underscores replace dots)
-                    "message_data": message_data,
-                },
-            )
+                # Broadcast message to all users in this channel group
+                with timer("chat.group_send", channel=self.channel_id):
+                    # Handled by chat_message_broadcast; encoded once here
+                    await broadcast_sequenced(
+                        self.group_name,
+                        lambda seq: chat_message_event(
+                            self.server_id, self.channel_id, message_data, seq
+                        ),
+                        self.channel_layer,
+                    )
 
         except Exception as e:
             await self.send(
@@ -146,15 +295,74 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
 
     async def chat_message_broadcast(self, event):
-        await self.send(
-            text_data=json.dumps(
-                {"type": "chat_message", "message": event["message_data"]}
-            )
+        # Already encoded by the sender, see chat_message_event; sent by the
+        # outbound queue so that a slow client cannot hold up this consumer
+        self.outbound.put(event)
+
+    async def message_update_broadcast(self, event):
+        # An edit or deletion made through the REST API, see
+        # message_update_event
+        self.outbound.put(event)
+
+    async def presence_broadcast(self, event):
+        # Coalesced online/offline changes for the server, see presence_event
+        self.outbound.put(event)
+
+    async def membership_changed(self, event):
+        # The user's role in the server changed, or they were removed; see
+        # pingo_channels.access
+        self.channel.user_role = event["role"]
+        await self._refresh_access()
+
+    async def channel_roles_changed(self, event):
+        apply_channel_roles(self.channel, event)
+        await self._refresh_access()
+
+    async def _recheck_access(self):
+        # In case an access event was lost, see pingo_channels.access
+        if self.authenticated and await database_sync_to_async(reload_channel_access)(
+            self.user, [self.channel]
+        ):
+            await self._refresh_access()
+
+    async def _refresh_access(self):
+        if not self.authenticated:
+            return
+        role = self.channel.user_role
+        permissions = self.channel.get_role_permissions(role)
+        target = {"server_id": str(self.server_id), "channel_id": str(self.channel_id)}
+        if not permissions["can_view"]:
+            self.outbound.cancel()
+            await self._leave()
+            await self.send(text_data=access_revoked_frame(**target))
+            await self.close(code=ACCESS_REVOKED_CLOSE_CODE)
+            return
+        self.membership["role"] = role
+        self.channel_permissions = permissions
+        self.outbound.put(
+            {
+                "group": self.group_name,
+                "text": permissions_updated_frame(role, permissions, **target),
+            }
         )
 
-    def _serialize_message(self, message):
-        serializer = MessageSerializer(message)
-        return serializer.data
+    async def _handle_resume(self, data):
+        last_seq = get_last_seq(data)
+        if last_seq is None:
+            await self.send(
+                text_data=json.dumps(
+                    {
+                        "type": "error",
+                        "message": "last_seq must be a non-negative integer",
+                    }
+                )
+            )
+            return
+        # Live broadcasts wait until this handler returns, so they follow
+        # the replayed frames; the ones already queued go first
+        await self.outbound.drain()
+        for frame in await resume_frames(self.group_name, last_seq):
+            await self.send(text_data=frame)
 
     async def _handle_ping(self):
         await self.send(
@@ -201,10 +409,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         "id": str(self.user.id),
                         "username": self.user.username,
                     },
-                    "membership": {
-                        "role": self.membership.role,
-                        "joined_at": self.membership.created_at.isoformat(),
-                    },
+                    "membership": self.membership,
                     "channel": {
                         "id": str(self.channel.id),
                         "name": self.channel.name,
@@ -227,84 +432,74 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def _handle_authentication(self, data):
         try:
-            from rest_framework_simplejwt.tokens import AccessToken
-            from django.contrib.auth import get_user_model
-
             token = data.get("token")
             if not token:
                 await self._send_auth_error("No token provided")
                 return
 
-            # Validate JWT token
+            # Validate JWT token and get the (cached) user
             try:
-                access_token = AccessToken(token)
-                user_id = access_token["user_id"]
-            except Exception as e:
+                user = await database_sync_to_async(get_user_for_token)(token)
+            except TokenError as e:
                 await self._send_auth_error(f"Invalid or expired token: {str(e)}")
                 return
-
-            # Get user from database
-            User = get_user_model()
-            try:
-                user = await database_sync_to_async(User.objects.get)(id=user_id)
             except User.DoesNotExist:
                 await self._send_auth_error("User not found")
                 return
 
-            # Validate server and channel permissions
-            try:
-                # Check if server exists
-                server = await database_sync_to_async(Server.objects.get)(
-                    id=self.server_id
-                )
-
-                # Check server membership
-                membership = await database_sync_to_async(
-                    ServerMembership.objects.filter(server=server, user=user).first
-                )()
+            await self._authorize(user)
 
-                if not membership:
-                    await self._send_auth_error("You are not a member of this server")
-                    return
-
-                # Check if channel exists in this server
-                channel = await database_sync_to_async(
-                    Channel.objects.filter(id=self.channel_id, server=server).first
-                )()
-
-                if not channel:
-                    await self._send_auth_error("Channel not found in this server")
-                    return
-
-                # Check channel permissions
-                permissions = await database_sync_to_async(
-                    channel.get_user_permissions
-                )(user)
+        except Exception as e:
+            await self._send_auth_error("Server error during authentication")
 
-                if not permissions.get("can_view", False):
-                    await self._send_auth_error(
-                        "You do not have permission to view this channel"
+    async def _authorize(self, user):
+        try:
+            # Validate server and channel permissions
+            try:
+                with timer("chat.authorize", channel=self.channel_id):
+                    channel, error = await database_sync_to_async(get_channel_access)(
+                        user, self.server_id, self.channel_id
                     )
-                    return
-
-            except Server.DoesNotExist:
-                await self._send_auth_error("Server not found")
-                return
             except Exception as e:
                 await self._send_auth_error("Server error validating permissions")
                 return
 
+            if error:
+                await self._send_auth_error(error)
+                return
+
+            # Check channel permissions
+            permissions = channel.get_role_permissions(channel.user_role)
+            if not permissions.get("can_view", False):
+                await self._send_auth_error(
+                    "You do not have permission to view this channel"
+                )
+                return
+
             # Authentication and authorization successful
             self.user = user
-            self.server = server
+            self.server = channel.server
             self.channel = channel
-            self.membership = membership
+            self.membership = {
+                "role": channel.user_role,
+                "joined_at": channel.user_joined_at.isoformat(),
+            }
             self.channel_permissions = permissions
             self.authenticated = True
-            self.group_name = f"chat_{self.server_id}_{self.channel_id}"
+            self.access_recheck.start()
+            self.group_name = chat_group_name(self.server_id, self.channel_id)
 
             # Join channel group for broadcasting
             await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.channel_layer.group_add(
+                presence_group_name(self.server_id), self.channel_name
+            )
+            # Role changes and removals, see pingo_channels.access
+            await self.channel_layer.group_add(
+                member_group_name(self.server_id, user.id), self.channel_name
+            )
+            await get_presence().connect(user.id, self.server_id, self.channel_name)
+            seq = await latest_sequence(self.group_name)
 
             # Send success response
             await self.send(
@@ -317,19 +512,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             "username": user.username,
                         },
                         "server": {
-                            "id": str(server.id),
-                            "name": server.name,
+                            "id": str(self.server.id),
+                            "name": self.server.name,
                         },
                         "channel": {
                             "id": str(channel.id),
                             "name": channel.name,
                         },
-                        "membership": {
-                            "role": membership.role,
-                            "joined_at": membership.created_at.isoformat(),
-                        },
+                        "membership": self.membership,
                         "permissions": permissions,
                         "group_name": self.group_name,
+                        # Resume from here after a reconnect
+                        "seq": seq,
                     }
                 )
             )
@@ -354,10 +548,15 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
         self.conversation = None
         self.other_participant = None
         self.group_name = None
+        self.outbound = OutboundQueue(self.send, self.close)
 
     async def connect(self):
         self.conversation_id = self.scope["url_route"]["kwargs"]["conversation_id"]
-        await self.accept()
+        await self.accept(subprotocol=self.scope.get("auth_subprotocol"))
+        if self.scope.get("jwt_authenticated"):
+            # Already authenticated by JWTAuthMiddleware at the handshake
+            await self._authorize(self.scope["user"])
+            return
         await self.send(
             text_data=json.dumps(
                 {
@@ -373,8 +572,10 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
+        self.outbound.cancel()
         if self.authenticated and self.group_name:
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await get_presence().disconnect(self.user.id, None, self.channel_name)
 
     async def receive(self, text_data):
         try:
@@ -401,6 +602,8 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
 
             if message_type == "direct_message":
                 await self._handle_direct_message(data)
+            elif message_type == "mark_read":
+                await self._handle_mark_read(data)
             elif message_type == "connection_test":
                 await self._handle_connection_test()
             else:
@@ -412,6 +615,7 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
                             "supported_types": [
                                 "ping",
                                 "direct_message",
+                                "mark_read",
                                 "test_message",
                                 "connection_test",
                             ],
@@ -457,17 +661,13 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
                 )
                 return
 
-            message = await database_sync_to_async(DirectMessage.objects.create)(
-                content=content, conversation=self.conversation, sender=self.user
+            message_data = await database_sync_to_async(create_direct_message)(
+                self.conversation, self.user, content
             )
-            message_data = self._serialize_direct_message(message)
 
             await self.channel_layer.group_send(
                 self.group_name,
-                {
-                    "type": "direct_message_broadcast",
-                    "message_data": message_data,
-                },
+                direct_message_event(self.conversation_id, message_data),
             )
 
         except Exception as e:
@@ -478,22 +678,20 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             )
 
     async def direct_message_broadcast(self, event):
-        await self.send(
-            text_data=json.dumps(
-                {"type": "direct_message", "message": event["message_data"]}
-            )
-        )
+        # Already encoded by the sender, see direct_message_event
+        self.outbound.put(event)
 
-    def _serialize_direct_message(self, message):
-        # Create mock request for serializer context
-        # class MockRequest:
-        # def __init__(self, user):
-        # self.user = user
+    async def _handle_mark_read(self, data):
+        found = await database_sync_to_async(mark_conversation_read)(
+            self.conversation, self.user, data.get("message_id")
+        )
+        if not found:
+            await self.send(
+                text_data=json.dumps({"type": "error", "message": "Message not found"})
+            )
 
-        serializer = DirectMessageSerializer(message)
-        # message, context={"request": MockRequest(self.user)}
-        # )
-        return serializer.data
+    async def read_receipt_broadcast(self, event):
+        self.outbound.put(event)
 
     async def _handle_connection_test(self):
         await self.send(
@@ -527,73 +725,53 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
 
     async def _handle_authentication(self, data):
         try:
-            from rest_framework_simplejwt.tokens import AccessToken
-            from django.contrib.auth import get_user_model
-
             token = data.get("token")
             if not token:
                 await self._send_auth_error("No token provided")
                 return
 
-            # Validate JWT token
+            # Validate JWT token and get the (cached) user
             try:
-                access_token = AccessToken(token)
-                user_id = access_token["user_id"]
-            except Exception as e:
+                user = await database_sync_to_async(get_user_for_token)(token)
+            except TokenError as e:
                 await self._send_auth_error(f"Invalid or expired token: {str(e)}")
                 return
-
-            # Get user from database
-            User = get_user_model()
-            try:
-                user = await database_sync_to_async(User.objects.get)(id=user_id)
             except User.DoesNotExist:
                 await self._send_auth_error("User not found")
                 return
 
-            # Validate conversation permissions
-            try:
-                # Check if conversation exists
-                conversation = await database_sync_to_async(
-                    DirectMessageConversation.objects.get
-                )(id=self.conversation_id)
-
-                # Check if user is participant in this conversation
-                is_participant = await database_sync_to_async(
-                    conversation.is_participant
-                )(user)
-
-                if not is_participant:
-                    await self._send_auth_error(
-                        "You are not a participant in this conversation"
-                    )
-                    return
-
-                # Get the other participant
-                other_participant = await database_sync_to_async(
-                    conversation.get_other_participant
-                )(user)
+            await self._authorize(user)
 
-                if not other_participant:
-                    await self._send_auth_error("Could not find other participant")
-                    return
+        except Exception as e:
+            await self._send_auth_error("Server error during authentication")
 
-            except DirectMessageConversation.DoesNotExist:
-                await self._send_auth_error("Conversation not found")
-                return
+    async def _authorize(self, user):
+        try:
+            # Validate conversation permissions
+            try:
+                conversation, other_participant, error = await database_sync_to_async(
+                    get_conversation_access
+                )(user, self.conversation_id)
             except Exception as e:
                 await self._send_auth_error("Server error validating conversation")
                 return
 
+            if error:
+                await self._send_auth_error(error)
+                return
+
             # Authentication and authorization successful
             self.user = user
             self.conversation = conversation
             self.other_participant = other_participant
             self.authenticated = True
-            self.group_name = f"direct_message_conversation_{self.conversation_id}"
+            self.group_name = direct_message_group_name(self.conversation_id)
 
             # Join conversation group for broadcasting
             await self.channel_layer.group_add(self.group_name, self.channel_name)
+            presence = get_presence()
+            await presence.connect(user.id, None, self.channel_name)
+            other_online = await presence.online_users([other_participant.id])
 
             # Send success response
             await self.send(
@@ -613,6 +791,7 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
                         "other_participant": {
                             "id": str(other_participant.id),
                             "display_name": other_participant.display_name,
+                            "online": bool(other_online),
                         },
                         "group_name": self.group_name,
                     }
@@ -628,3 +807,450 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             text_data=json.dumps({"type": "auth_error", "message": message})
         )
         await self.close(code=4001)  # Authentication failure
+
+
+class GatewayConsumer(AsyncWebsocketConsumer):
+    """
+    One socket per client for every channel and DM conversation.
+
+    The client authenticates once (at the handshake or with an ``auth``
+    frame), then sends ``subscribe``/``unsubscribe`` frames naming either
+    ``server_id`` + ``channel_id`` or ``conversation_id``. Access is checked
+    on subscribe and the socket joins the same groups the per-channel and
+    per-conversation consumers use, so it receives the same broadcasts,
+    tagged with the channel or conversation they belong to.
+    """
+
+    MAX_SUBSCRIPTIONS = 200
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.authenticated = False
+        self.user = AnonymousUser()
+        # group name -> {"target": ..., "channel"/"conversation": ..., ...}
+        self.subscriptions = {}
+        self.outbound = OutboundQueue(self.send, self.close)
+        self.access_recheck = AccessRecheck(self._recheck_access)
+
+    async def connect(self):
+        await self.accept(subprotocol=self.scope.get("auth_subprotocol"))
+        if self.scope.get("jwt_authenticated"):
+            # Already authenticated by JWTAuthMiddleware at the handshake
+            await self._authorize(self.scope["user"])
+            return
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "auth_required",
+                    "message": "Authentication required. Please send your JWT token.",
+                    "expected_format": {
+                        "type": "auth",
+                        "token": "your_jwt_access_token_here",
+                    },
+                }
+            )
+        )
+
+    async def disconnect(self, close_code):
+        self.outbound.cancel()
+        self.access_recheck.cancel()
+        for group_name in list(self.subscriptions):
+            await self._unsubscribe(group_name)
+        if self.authenticated:
+            await get_presence().disconnect(self.user.id, None, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            message_type = data.get("type", "unknown")
+
+            if not self.authenticated:
+                if message_type == "auth":
+                    await self._handle_authentication(data)
+                else:
+                    await self._send_error(
+                        "Authentication required. Send auth message first."
+                    )
+                return
+
+            if message_type == "subscribe":
+                await self._handle_subscribe(data)
+            elif message_type == "unsubscribe":
+                await self._handle_unsubscribe(data)
+            elif message_type == "chat_message":
+                await self._handle_chat_message(data)
+            elif message_type == "direct_message":
+                await self._handle_direct_message(data)
+            elif message_type == "mark_read":
+                await self._handle_mark_read(data)
+            elif message_type == "resume":
+                await self._handle_resume(data)
+            elif message_type == "ping":
+                await self.send(
+                    text_data=json.dumps(
+                        {"type": "pong", "timestamp": self._get_timestamp()}
+                    )
+                )
+            else:
+                await self.send(
+                    text_data=json.dumps(
+                        {
+                            "type": "error",
+                            "message": f"Unknown message type: {message_type}",
+                            "supported_types": [
+                                "subscribe",
+                                "unsubscribe",
+                                "chat_message",
+                                "direct_message",
+                                "mark_read",
+                                "resume",
+                                "ping",
+                            ],
+                        }
+                    )
+                )
+
+        except json.JSONDecodeError:
+            await self._send_error("Invalid JSON format")
+        except Exception as e:
+            await self._send_error("Server error processing message")
+
+    def _get_target(self, data):
+        """
+        Return ``(group_name, target)`` for the channel or conversation named in
+        a frame, or ``(None, None)`` if it names neither.
+        """
+        try:
+            if data.get("conversation_id"):
+                conversation_id = str(uuid.UUID(str(data["conversation_id"])))
+                return direct_message_group_name(conversation_id), {
+                    "conversation_id": conversation_id
+                }
+            if data.get("server_id") and data.get("channel_id"):
+                server_id = str(uuid.UUID(str(data["server_id"])))
+                channel_id = str(uuid.UUID(str(data["channel_id"])))
+                return chat_group_name(server_id, channel_id), {
+                    "server_id": server_id,
+                    "channel_id": channel_id,
+                }
+        except ValueError:
+            pass
+        return None, None
+
+    async def _handle_subscribe(self, data):
+        group_name, target = self._get_target(data)
+        if not group_name:
+            await self._send_error(
+                "Specify server_id and channel_id, or conversation_id, to subscribe"
+            )
+            return
+
+        if group_name not in self.subscriptions:
+            if len(self.subscriptions) >= self.MAX_SUBSCRIPTIONS:
+                await self._send_error(
+                    f"Cannot subscribe to more than {self.MAX_SUBSCRIPTIONS} channels and conversations",
+                    target,
+                )
+                return
+
+            if "conversation_id" in target:
+                conversation, other_participant, error = await database_sync_to_async(
+                    get_conversation_access
+                )(self.user, target["conversation_id"])
+                subscription = {
+                    "target": target,
+                    "conversation": conversation,
+                    "other_participant": other_participant,
+                }
+            else:
+                channel, error = await database_sync_to_async(get_channel_access)(
+                    self.user, target["server_id"], target["channel_id"]
+                )
+                if not error:
+                    permissions = channel.get_role_permissions(channel.user_role)
+                    if not permissions["can_view"]:
+                        error = "You do not have permission to view this channel"
+                    subscription = {
+                        "target": target,
+                        "channel": channel,
+                        "permissions": permissions,
+                    }
+
+            if error:
+                await self._send_error(error, target)
+                return
+
+            server_id = target.get("server_id")
+            if server_id and not self._subscribed_to_server(server_id):
+                await self.channel_layer.group_add(
+                    presence_group_name(server_id), self.channel_name
+                )
+                await self.channel_layer.group_add(
+                    member_group_name(server_id, self.user.id), self.channel_name
+                )
+            self.subscriptions[group_name] = subscription
+            await self.channel_layer.group_add(group_name, self.channel_name)
+            if server_id:
+                await get_presence().connect(self.user.id, server_id, self.channel_name)
+
+        subscription = self.subscriptions[group_name]
+        response = {"type": "subscribed", **target}
+        if "permissions" in subscription:
+            response["permissions"] = subscription["permissions"]
+            response["seq"] = await latest_sequence(group_name)
+        await self.send(text_data=json.dumps(response))
+
+    async def _handle_unsubscribe(self, data):
+        group_name, target = self._get_target(data)
+        if not group_name:
+            await self._send_error(
+                "Specify server_id and channel_id, or conversation_id, to unsubscribe"
+            )
+            return
+
+        await self._unsubscribe(group_name)
+        await self.send(text_data=json.dumps({"type": "unsubscribed", **target}))
+
+    def _subscribed_to_server(self, server_id):
+        return any(
+            subscription["target"].get("server_id") == server_id
+            for subscription in self.subscriptions.values()
+        )
+
+    async def _unsubscribe(self, group_name):
+        subscription = self.subscriptions.pop(group_name, None)
+        if not subscription:
+            return
+        await self.channel_layer.group_discard(group_name, self.channel_name)
+        server_id = subscription["target"].get("server_id")
+        if server_id:
+            # Registered once per subscribed channel of the server
+            await get_presence().disconnect(self.user.id, server_id, self.channel_name)
+            if not self._subscribed_to_server(server_id):
+                await self.channel_layer.group_discard(
+                    presence_group_name(server_id), self.channel_name
+                )
+                await self.channel_layer.group_discard(
+                    member_group_name(server_id, self.user.id), self.channel_name
+                )
+
+    async def _handle_chat_message(self, data):
+        group_name, target = self._get_target(data)
+        subscription = self.subscriptions.get(group_name)
+        if not subscription or "channel" not in subscription:
+            await self._send_error("Subscribe to the channel before posting", target)
+            return
+
+        try:
+            content = data.get("content", "").strip()
+            if not content:
+                await self._send_error("Message content cannot be empty", target)
+                return
+            if not subscription["permissions"].get("can_post", False):
+                await self._send_error(
+                    "You do not have permission to post messages in this channel",
+                    target,
+                )
+                return
+
+            channel_id = target["channel_id"]
+            with timer("chat.handle_message", channel=channel_id):
+                message_data = await post_channel_message(
+                    subscription["channel"], self.user, content
+                )
+
+                with timer("chat.group_send", channel=channel_id):
+                    await broadcast_sequenced(
+                        group_name,
+                        lambda seq: chat_message_event(
+                            target["server_id"], channel_id, message_data, seq
+                        ),
+                        self.channel_layer,
+                    )
+
+        except Exception as e:
+            await self._send_error(f"Failed to send message, {e}", target)
+
+    async def _handle_direct_message(self, data):
+        group_name, target = self._get_target(data)
+        subscription = self.subscriptions.get(group_name)
+        if not subscription or "conversation" not in subscription:
+            await self._send_error(
+                "Subscribe to the conversation before sending", target
+            )
+            return
+
+        try:
+            content = data.get("content", "").strip()
+            if not content:
+                await self._send_error("Message content cannot be empty", target)
+                return
+
+            # Check if other participant still allows DMs from current user
+            if not subscription["other_participant"].can_receive_dm_from(self.user):
+                await self._send_error(
+                    "This user has restricted DM permissions", target
+                )
+                return
+
+            message_data = await database_sync_to_async(create_direct_message)(
+                subscription["conversation"], self.user, content
+            )
+
+            await self.channel_layer.group_send(
+                group_name,
+                direct_message_event(target["conversation_id"], message_data),
+            )
+
+        except Exception as e:
+            await self._send_error(f"Failed to send message: {e}", target)
+
+    async def _handle_resume(self, data):
+        group_name, target = self._get_target(data)
+        subscription = self.subscriptions.get(group_name)
+        if not subscription or "channel" not in subscription:
+            await self._send_error("Subscribe to the channel before resuming", target)
+            return
+        last_seq = get_last_seq(data)
+        if last_seq is None:
+            await self._send_error("last_seq must be a non-negative integer", target)
+            return
+        await self.outbound.drain()
+        for frame in await resume_frames(group_name, last_seq, **target):
+            await self.send(text_data=frame)
+
+    async def _handle_mark_read(self, data):
+        group_name, target = self._get_target(data)
+        subscription = self.subscriptions.get(group_name)
+        if not subscription or "conversation" not in subscription:
+            await self._send_error(
+                "Subscribe to the conversation before marking it read", target
+            )
+            return
+
+        found = await database_sync_to_async(mark_conversation_read)(
+            subscription["conversation"], self.user, data.get("message_id")
+        )
+        if not found:
+            await self._send_error("Message not found", target)
+
+    async def chat_message_broadcast(self, event):
+        # Same pre-encoded frames as ChatConsumer sends, through the same queue
+        self.outbound.put(event)
+
+    async def message_update_broadcast(self, event):
+        self.outbound.put(event)
+
+    async def membership_changed(self, event):
+        # Recompute every subscribed channel of the server, see
+        # pingo_channels.access
+        for group_name, subscription in list(self.subscriptions.items()):
+            if subscription["target"].get("server_id") == event["server_id"]:
+                subscription["channel"].user_role = event["role"]
+                await self._refresh_access(group_name)
+
+    async def channel_roles_changed(self, event):
+        subscription = self.subscriptions.get(event["group"])
+        if subscription:
+            apply_channel_roles(subscription["channel"], event)
+            await self._refresh_access(event["group"])
+
+    async def _recheck_access(self):
+        # In case an access event was lost, see pingo_channels.access
+        channels = {
+            group_name: subscription["channel"]
+            for group_name, subscription in self.subscriptions.items()
+            if "channel" in subscription
+        }
+        if not channels:
+            return
+        changed = await database_sync_to_async(reload_channel_access)(
+            self.user, list(channels.values())
+        )
+        for group_name, channel in channels.items():
+            if channel.id in changed and group_name in self.subscriptions:
+                await self._refresh_access(group_name)
+
+    async def _refresh_access(self, group_name):
+        subscription = self.subscriptions[group_name]
+        channel = subscription["channel"]
+        target = subscription["target"]
+        permissions = channel.get_role_permissions(channel.user_role)
+        if not permissions["can_view"]:
+            # Only this subscription goes; the socket serves others
+            await self._unsubscribe(group_name)
+            frame = access_revoked_frame(**target)
+        else:
+            subscription["permissions"] = permissions
+            frame = permissions_updated_frame(channel.user_role, permissions, **target)
+        self.outbound.put({"group": group_name, "text": frame})
+
+    async def direct_message_broadcast(self, event):
+        self.outbound.put(event)
+
+    async def read_receipt_broadcast(self, event):
+        self.outbound.put(event)
+
+    async def presence_broadcast(self, event):
+        self.outbound.put(event)
+
+    def _get_timestamp(self):
+        from datetime import datetime, timezone
+
+        return datetime.now(timezone.utc).isoformat()
+
+    async def _handle_authentication(self, data):
+        try:
+            token = data.get("token")
+            if not token:
+                await self._send_auth_error("No token provided")
+                return
+
+            try:
+                user = await database_sync_to_async(get_user_for_token)(token)
+            except TokenError as e:
+                await self._send_auth_error(f"Invalid or expired token: {str(e)}")
+                return
+            except User.DoesNotExist:
+                await self._send_auth_error("User not found")
+                return
+
+            await self._authorize(user)
+
+        except Exception as e:
+            await self._send_auth_error("Server error during authentication")
+
+    async def _authorize(self, user):
+        # Access is checked per subscription, so any valid user may connect
+        self.user = user
+        self.authenticated = True
+        self.access_recheck.start()
+        await get_presence().connect(user.id, None, self.channel_name)
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "auth_success",
+                    "message": "Successfully authenticated. Subscribe to channels and conversations.",
+                    "user": {
+                        "id": str(user.id),
+                        "email": user.email,
+                        "display_name": user.display_name,
+                    },
+                    "max_subscriptions": self.MAX_SUBSCRIPTIONS,
+                }
+            )
+        )
+
+    async def _send_error(self, message, target=None):
+        await self.send(
+            text_data=json.dumps(
+                {"type": "error", "message": message, **(target or {})}
+            )
+        )
+
+    async def _send_auth_error(self, message):
+        """Send authentication error and close connection."""
+        await self.send(
+            text_data=json.dumps({"type": "auth_error", "message": message})
+        )
+        await self.close(code=4001)  # Authentication failure
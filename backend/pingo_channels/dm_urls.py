@@ -3,6 +3,8 @@ from .views import (
     DirectMessageConversationListView,
     DirectMessageConversationDetailView,
     DirectMessageListView,
+    DirectMessageReadView,
+    DirectMessageSearchView,
 )
 
 urlpatterns = [
@@ -11,6 +13,11 @@ urlpatterns = [
         DirectMessageConversationListView.as_view(),
         name="dm_conversation_list",
     ),
+    path(
+        "search/",
+        DirectMessageSearchView.as_view(),
+        name="dm_message_search",
+    ),
     path(
         "<uuid:conversation_id>/",
         DirectMessageConversationDetailView.as_view(),
@@ -21,4 +28,9 @@ urlpatterns = [
         DirectMessageListView.as_view(),
         name="dm_message_list",
     ),
+    path(
+        "<uuid:conversation_id>/read/",
+        DirectMessageReadView.as_view(),
+        name="dm_conversation_read",
+    ),
 ]
@@ -0,0 +1,180 @@
+"""
+JSON encoding for outbound WebSocket frames.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. The fallback is set up to write the same text as orjson: compact
+separators, non-ASCII characters as is, and dates and times in ISO 8601.
+Other values that JSON has no type for, such as UUIDs, are written as
+strings by both.
+
+Group events carry the name of the group they are sent to, so recipients
+can queue their frames per group (see pingo_channels.outbound).
+"""
+
+import json
+from datetime import date, datetime, time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def encode_frame(payload):
+    """Encode a frame payload as JSON text, ready for ``send(text_data=...)``."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(
+        payload, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    )
+
+
+def _json_default(value):
+    # orjson writes datetime, date and time natively, in ISO 8601
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def chat_group_name(server_id, channel_id):
+    return f"chat_{server_id}_{channel_id}"
+
+
+def direct_message_group_name(conversation_id):
+    return f"direct_message_conversation_{conversation_id}"
+
+
+def presence_group_name(server_id):
+    return f"presence_{server_id}"
+
+
+def member_group_name(server_id, user_id):
+    return f"member_{server_id}_{user_id}"
+
+
+def sequenced_frame(seq, frame):
+    """
+    ``frame`` numbered with ``seq``, if there is one. The number is encoded
+    first, ahead of any message content (see pingo_channels.replay).
+    """
+    return frame if seq is None else {"seq": seq, **frame}
+
+
+def chat_message_event(server_id, channel_id, message_data, seq=None):
+    """
+    Build the group event for a new channel message. The frame is encoded
+    here, once, and every recipient sends the same text as-is. ``seq`` is
+    the channel's sequence number for the event (see pingo_channels.replay).
+    """
+    frame = {
+        "type": "chat_message",
+        "server_id": str(server_id),
+        "channel_id": str(channel_id),
+        "message": message_data,
+    }
+    return {
+        "type": "chat_message_broadcast",
+        "group": chat_group_name(server_id, channel_id),
+        # Lets recipients label per-channel metrics and resume hints without
+        # decoding the frame
+        "server_id": str(server_id),
+        "channel_id": str(channel_id),
+        "seq": seq,
+        "text": encode_frame(sequenced_frame(seq, frame)),
+    }
+
+
+def message_update_event(server_id, channel_id, message, seq=None):
+    """
+    Build the group event for an edited or deleted channel message. The
+    frame carries only what can change, for clients to patch the message
+    they already have in place; a deleted message's content is null.
+    """
+    frame = {
+        "type": "message_update",
+        "server_id": str(server_id),
+        "channel_id": str(channel_id),
+        "message": {
+            "id": str(message.id),
+            "content": None if message.is_deleted else message.content,
+            "edited_at": message.updated_at.isoformat(),
+            "is_deleted": message.is_deleted,
+        },
+    }
+    return {
+        "type": "message_update_broadcast",
+        "group": chat_group_name(server_id, channel_id),
+        "server_id": str(server_id),
+        "channel_id": str(channel_id),
+        "seq": seq,
+        "text": encode_frame(sequenced_frame(seq, frame)),
+    }
+
+
+def direct_message_event(conversation_id, message_data):
+    """Build the group event for a new direct message, encoded once."""
+    return {
+        "type": "direct_message_broadcast",
+        "group": direct_message_group_name(conversation_id),
+        "text": encode_frame(
+            {
+                "type": "direct_message",
+                "conversation_id": str(conversation_id),
+                "message": message_data,
+            }
+        ),
+    }
+
+
+def read_receipt_event(conversation_id, user_id, last_read_at):
+    """
+    Build the group event for a participant's read watermark moving. Only
+    the latest watermark matters, so a queued one can be replaced.
+    """
+    return {
+        "type": "read_receipt_broadcast",
+        "group": direct_message_group_name(conversation_id),
+        "coalesce": f"read_receipt:{conversation_id}:{user_id}",
+        "text": encode_frame(
+            {
+                "type": "read_receipt",
+                "conversation_id": str(conversation_id),
+                "user_id": str(user_id),
+                "last_read_at": last_read_at.isoformat(),
+            }
+        ),
+    }
+
+
+def presence_event(server_id, changes):
+    """
+    Build the group event for the users who came online or went offline in
+    a server since the last one. ``changes`` maps user ids to whether they
+    are online; queued events for a server merge into one (see
+    ``merge_presence_events``).
+    """
+    server_id = str(server_id)
+    return {
+        "type": "presence_broadcast",
+        "group": presence_group_name(server_id),
+        "coalesce": f"presence:{server_id}",
+        "server_id": server_id,
+        "changes": changes,
+        "text": encode_frame(
+            {
+                "type": "presence",
+                "server_id": server_id,
+                "online": sorted(user for user, online in changes.items() if online),
+                "offline": sorted(
+                    user for user, online in changes.items() if not online
+                ),
+            }
+        ),
+    }
+
+
+def merge_presence_events(earlier, later):
+    """One presence event with the latest state of every user in either"""
+    return presence_event(
+        later["server_id"], {**earlier["changes"], **later["changes"]}
+    )
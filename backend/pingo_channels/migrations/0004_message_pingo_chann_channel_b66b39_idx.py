@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pingo_channels', '0003_directmessageconversation_directmessage_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['channel', '-created_at', 'id'], name='pingo_chann_channel_b66b39_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:22
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_read_watermarks(apps, schema_editor):
+    """
+    Derive each participant's watermark from the per-message is_read flags:
+    the newest read message from the other participant, and the count of
+    their unread ones.
+    """
+    DirectMessageConversation = apps.get_model(
+        "pingo_channels", "DirectMessageConversation"
+    )
+    DirectMessage = apps.get_model("pingo_channels", "DirectMessage")
+
+    for field, other in [
+        ("participant1", "participant2"),
+        ("participant2", "participant1"),
+    ]:
+        received = DirectMessage.objects.filter(
+            conversation=OuterRef("pk"), sender=OuterRef(other)
+        ).order_by()
+        DirectMessageConversation.objects.update(
+            **{
+                f"{field}_last_read_at": Subquery(
+                    received.filter(is_read=True)
+                    .values("conversation")
+                    .annotate(last=Max("created_at"))
+                    .values("last")
+                ),
+                f"{field}_unread_count": Coalesce(
+                    Subquery(
+                        received.filter(is_read=False)
+                        .values("conversation")
+                        .annotate(count=Count("pk"))
+                        .values("count")
+                    ),
+                    0,
+                ),
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pingo_channels", "0005_message_created_at_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="directmessageconversation",
+            name="participant1_last_read_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="directmessageconversation",
+            name="participant1_unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="directmessageconversation",
+            name="participant2_last_read_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="directmessageconversation",
+            name="participant2_unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_read_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="directmessage",
+            name="is_read",
+        ),
+    ]
@@ -0,0 +1,91 @@
+"""
+Full-text search indexes for Message and DirectMessage content.
+
+PostgreSQL gets a GIN index on to_tsvector('english', content), built
+concurrently so that large tables stay writable. The expression must match
+the one pingo_channels.search queries with.
+
+SQLite gets an external-content FTS5 table per model, keyed on the rowid of
+the message table and kept in sync by triggers. SQLite drops triggers when
+Django rebuilds a table, so a later migration that alters one of these
+tables on SQLite must create them again (see install_sqlite_index).
+
+0008 replaces this SQLite index definition with one keyed on the message
+id; the current definition lives in pingo_channels.search.
+
+Other databases get no index; search falls back to icontains there.
+"""
+
+from django.db import migrations
+
+SEARCH_CONFIG = "english"
+MODELS = {
+    "message": "pingo_channels_message_search",
+    "directmessage": "pingo_channels_dm_search",
+}
+
+
+def install_sqlite_index(schema_editor, table):
+    index = f"{table}_fts"
+    for statement in [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{index}" USING fts5(content, '
+        f"content='{table}', content_rowid='rowid', tokenize='porter unicode61')",
+        f'CREATE TRIGGER IF NOT EXISTS "{index}_insert" AFTER INSERT ON "{table}" '
+        f'BEGIN INSERT INTO "{index}"(rowid, content) '
+        f"VALUES (new.rowid, new.content); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{index}_delete" AFTER DELETE ON "{table}" '
+        f'BEGIN INSERT INTO "{index}"("{index}", rowid, content) '
+        f"VALUES ('delete', old.rowid, old.content); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{index}_update" '
+        f'AFTER UPDATE OF content ON "{table}" '
+        f'BEGIN INSERT INTO "{index}"("{index}", rowid, content) '
+        f"VALUES ('delete', old.rowid, old.content); "
+        f'INSERT INTO "{index}"(rowid, content) VALUES (new.rowid, new.content); END',
+        f'INSERT INTO "{index}"("{index}") VALUES (\'rebuild\')',
+    ]:
+        schema_editor.execute(statement)
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model_name, index_name in MODELS.items():
+        model = apps.get_model("pingo_channels", model_name)
+        if vendor == "postgresql":
+            from django.contrib.postgres.indexes import GinIndex
+            from django.contrib.postgres.search import SearchVector
+
+            index = GinIndex(
+                SearchVector("content", config=SEARCH_CONFIG), name=index_name
+            )
+            schema_editor.execute(
+                index.create_sql(model, schema_editor, concurrently=True)
+            )
+        elif vendor == "sqlite":
+            install_sqlite_index(schema_editor, model._meta.db_table)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model_name, index_name in MODELS.items():
+        model = apps.get_model("pingo_channels", model_name)
+        if vendor == "postgresql":
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"')
+        elif vendor == "sqlite":
+            index = f"{model._meta.db_table}_fts"
+            for trigger in ["insert", "delete", "update"]:
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS "{index}_{trigger}"')
+            schema_editor.execute(f'DROP TABLE IF EXISTS "{index}"')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("pingo_channels", "0006_direct_message_read_watermarks"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
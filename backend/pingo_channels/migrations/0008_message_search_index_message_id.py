@@ -0,0 +1,74 @@
+"""
+Key the SQLite FTS5 search tables on the message id.
+
+The tables created by 0007 pointed at the implicit rowid of the message
+tables, which VACUUM and Django's SQLite table rebuilds renumber, so search
+could return the wrong messages. They are replaced with tables that store the
+message id next to the content. PostgreSQL and other databases are untouched.
+
+The DDL is a frozen copy of pingo_channels.search as of this migration, so
+that later changes there do not alter what this migration does.
+"""
+
+from importlib import import_module
+
+from django.db import migrations
+
+TABLES = ["pingo_channels_message", "pingo_channels_directmessage"]
+
+
+def drop_sqlite_index(schema_editor, table):
+    index = f"{table}_fts"
+    for trigger in ["insert", "delete", "update"]:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS "{index}_{trigger}"')
+    schema_editor.execute(f'DROP TABLE IF EXISTS "{index}"')
+
+
+def install_sqlite_index(schema_editor, table):
+    index = f"{table}_fts"
+    for statement in [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{index}" USING fts5('
+        f"message_id UNINDEXED, content, tokenize='porter unicode61')",
+        f'CREATE TRIGGER IF NOT EXISTS "{index}_insert" AFTER INSERT ON "{table}" '
+        f'BEGIN INSERT INTO "{index}"(message_id, content) '
+        f"VALUES (new.id, new.content); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{index}_delete" AFTER DELETE ON "{table}" '
+        f'BEGIN DELETE FROM "{index}" WHERE message_id = old.id; END',
+        f'CREATE TRIGGER IF NOT EXISTS "{index}_update" '
+        f'AFTER UPDATE OF content ON "{table}" '
+        f'BEGIN UPDATE "{index}" SET content = new.content '
+        f"WHERE message_id = old.id; END",
+        f'DELETE FROM "{index}"',
+        f'INSERT INTO "{index}"(message_id, content) SELECT id, content FROM "{table}"',
+    ]:
+        schema_editor.execute(statement)
+
+
+def key_on_message_id(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for table in TABLES:
+        drop_sqlite_index(schema_editor, table)
+        install_sqlite_index(schema_editor, table)
+
+
+def key_on_rowid(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    previous = import_module("pingo_channels.migrations.0007_message_search_indexes")
+    for table in TABLES:
+        drop_sqlite_index(schema_editor, table)
+        previous.install_sqlite_index(schema_editor, table)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("pingo_channels", "0007_message_search_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(key_on_message_id, key_on_rowid),
+    ]
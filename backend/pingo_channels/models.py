@@ -1,7 +1,64 @@
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
+from django.utils import timezone
 from common.models import TimeStampedBaseModel
-from servers.models import Server
+from servers.models import Server, ServerMembership
+
+PERMISSION_FIELDS = {
+    "can_view": "min_view_role",
+    "can_read": "min_read_role",
+    "can_post": "min_message_role",
+}
+
+
+class ChannelQuerySet(models.QuerySet):
+    def with_user_role(self, user):
+        """
+        Load each channel's server and annotate ``user_role`` and
+        ``user_joined_at`` from the user's membership of that server (None if
+        not a member), all in the same query.
+        """
+        membership = ServerMembership.objects.filter(
+            server_id=OuterRef("server_id"), user=user
+        )
+        return self.select_related("server").annotate(
+            user_role=Subquery(membership.values("role")[:1]),
+            user_joined_at=Subquery(membership.values("created_at")[:1]),
+        )
+
+    def with_role_permissions(self, role):
+        """
+        Annotate can_view, can_read and can_post for a member with the given
+        role, so a whole server's channels are evaluated in one query.
+        """
+        allowed_roles = ServerMembership.roles_at_or_below(role)
+        return self.annotate(
+            **{
+                permission: ExpressionWrapper(
+                    (
+                        Q(**{f"{field}__in": allowed_roles})
+                        if allowed_roles
+                        else Value(False)
+                    ),
+                    output_field=models.BooleanField(),
+                )
+                for permission, field in PERMISSION_FIELDS.items()
+            }
+        )
 
 
 class Channel(TimeStampedBaseModel):
@@ -30,6 +87,8 @@ class Channel(TimeStampedBaseModel):
         max_length=20, choices=ROLE_CHOICES, default="member"
     )
 
+    objects = ChannelQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name}"
 
@@ -37,13 +96,17 @@ class Channel(TimeStampedBaseModel):
         unique_together = ["server", "name"]
 
     def get_user_permissions(self, user):
-        membership = self.server.membership.filter(user=user).first()
-        if not membership:
+        role = ServerMembership.get_role(user, self.server_id)
+        return self.get_role_permissions(role)
+
+    def get_role_permissions(self, role):
+        """Return the permissions of a member with the given role (None if not a member)."""
+        if not role:
             return {"can_view": False, "can_read": False, "can_post": False}
 
-        role_hierarchy = {"member": 0, "moderator": 1, "admin": 2, "owner": 3}
+        role_hierarchy = ServerMembership.ROLE_HIERARCHY
 
-        user_level = role_hierarchy.get(membership.role, 0)
+        user_level = role_hierarchy.get(role, 0)
 
         return {
             "can_view": user_level >= role_hierarchy.get(self.min_view_role, 0),
@@ -53,6 +116,9 @@ class Channel(TimeStampedBaseModel):
 
 
 class Message(TimeStampedBaseModel):
+    # Not auto_now_add: the write-behind queue assigns created_at before the
+    # row is stored and bulk_create must keep it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     content = models.TextField(max_length=1000)
     channel = models.ForeignKey(
         Channel, on_delete=models.CASCADE, related_name="messages"
@@ -64,6 +130,9 @@ class Message(TimeStampedBaseModel):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["channel", "-created_at", "id"]),
+        ]
 
     def __str__(self):
         return f"{self.content[:30]}"
@@ -72,6 +141,27 @@ class Message(TimeStampedBaseModel):
 # Add these models to your existing pingo_channels/models.py file
 
 
+class DirectMessageConversationQuerySet(models.QuerySet):
+    def for_participant(self, user):
+        return self.filter(Q(participant1=user) | Q(participant2=user))
+
+    def with_inbox_data(self, user):
+        """
+        Load everything the inbox shows for each conversation in a fixed
+        number of queries: both participants and the latest message with its
+        sender. Unread counts are stored on the conversation itself.
+        """
+        return self.select_related("participant1", "participant2").prefetch_related(
+            Prefetch(
+                "messages",
+                queryset=DirectMessage.objects.select_related("sender").order_by(
+                    "-created_at"
+                )[:1],
+                to_attr="latest_messages",
+            )
+        )
+
+
 class DirectMessageConversation(TimeStampedBaseModel):
     participant1 = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -83,6 +173,15 @@ class DirectMessageConversation(TimeStampedBaseModel):
         on_delete=models.CASCADE,
         related_name="dm_conversations_as_p2",
     )
+    # Read watermarks: everything the other participant sent up to
+    # <participant>_last_read_at is read, and <participant>_unread_count
+    # counts what they sent after it
+    participant1_last_read_at = models.DateTimeField(null=True, blank=True)
+    participant2_last_read_at = models.DateTimeField(null=True, blank=True)
+    participant1_unread_count = models.PositiveIntegerField(default=0)
+    participant2_unread_count = models.PositiveIntegerField(default=0)
+
+    objects = DirectMessageConversationQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -106,7 +205,115 @@ class DirectMessageConversation(TimeStampedBaseModel):
             return None
 
     def is_participant(self, user):
-        return user in [self.participant1, self.participant2]
+        return user.pk in (self.participant1_id, self.participant2_id)
+
+    def _participant_field(self, user):
+        """Return "participant1" or "participant2" for a participant"""
+        if user.pk == self.participant1_id:
+            return "participant1"
+        if user.pk == self.participant2_id:
+            return "participant2"
+        raise ValueError("User is not a participant in this conversation")
+
+    def get_unread_count(self, user):
+        return getattr(self, f"{self._participant_field(user)}_unread_count")
+
+    def get_last_read_at(self, user):
+        return getattr(self, f"{self._participant_field(user)}_last_read_at")
+
+    def is_read(self, message):
+        """Whether the recipient of a message has read it"""
+        field = (
+            "participant2"
+            if message.sender_id == self.participant1_id
+            else "participant1"
+        )
+        last_read_at = getattr(self, f"{field}_last_read_at")
+        return last_read_at is not None and message.created_at <= last_read_at
+
+    @classmethod
+    def record_messages(cls, messages):
+        """
+        Account for newly inserted messages with a single UPDATE per
+        conversation: updated_at moves forward to the newest message (never
+        back) and each participant's unread count grows by the number of
+        messages the other one sent.
+        """
+        batches = defaultdict(list)
+        for message in messages:
+            batches[message.conversation_id].append(message)
+
+        for conversation_id, batch in batches.items():
+            latest = max(message.created_at for message in batch)
+            sent = Counter(message.sender_id for message in batch)
+            updates = {"updated_at": Greatest("updated_at", Value(latest))}
+            for field in ("participant1", "participant2"):
+                unread_field = f"{field}_unread_count"
+                # Senders are only known by id, so let the database decide
+                # which participant received each sender's messages
+                updates[unread_field] = sum(
+                    (
+                        Case(When(**{f"{field}_id": sender_id}, then=0), default=count)
+                        for sender_id, count in sent.items()
+                    ),
+                    start=F(unread_field),
+                )
+            cls.objects.filter(pk=conversation_id).update(**updates)
+
+            # Keep an already loaded conversation in step without reloading it
+            if DirectMessage.conversation.is_cached(batch[0]):
+                conversation = batch[0].conversation
+                conversation.updated_at = max(conversation.updated_at, latest)
+                for field in ("participant1", "participant2"):
+                    unread_field = f"{field}_unread_count"
+                    received = sum(
+                        count
+                        for sender_id, count in sent.items()
+                        if sender_id != getattr(conversation, f"{field}_id")
+                    )
+                    setattr(
+                        conversation,
+                        unread_field,
+                        getattr(conversation, unread_field) + received,
+                    )
+
+    def mark_read(self, user, up_to=None):
+        """
+        Mark everything up to and including the ``up_to`` message (default:
+        everything) as read by ``user``, in a single UPDATE. The watermark
+        only moves forward. Returns True if it moved.
+        """
+        field = self._participant_field(user)
+        last_read_field = f"{field}_last_read_at"
+        unread_field = f"{field}_unread_count"
+        read_at = up_to.created_at if up_to else timezone.now()
+
+        still_unread = (
+            DirectMessage.objects.filter(
+                conversation=OuterRef("pk"), created_at__gt=read_at
+            )
+            .exclude(sender=user)
+            .order_by()
+            .values("conversation")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        updated = (
+            DirectMessageConversation.objects.filter(pk=self.pk)
+            .filter(
+                Q(**{f"{last_read_field}__isnull": True})
+                | Q(**{f"{last_read_field}__lt": read_at})
+            )
+            .update(
+                **{
+                    last_read_field: read_at,
+                    unread_field: Coalesce(Subquery(still_unread), 0),
+                }
+            )
+        )
+        if updated:
+            self.refresh_from_db(fields=[last_read_field, unread_field])
+        return bool(updated)
 
     @classmethod
     def get_or_create_conversation(cls, user1, user2):
@@ -126,6 +333,18 @@ class DirectMessageConversation(TimeStampedBaseModel):
         return conversation, created
 
 
+class DirectMessageQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Insert direct messages and update each affected conversation once for
+        the whole batch, in the same transaction.
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            DirectMessageConversation.record_messages(objs)
+        return objs
+
+
 class DirectMessage(TimeStampedBaseModel):
 
     conversation = models.ForeignKey(
@@ -133,7 +352,8 @@ class DirectMessage(TimeStampedBaseModel):
     )
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
-    is_read = models.BooleanField(default=False)
+
+    objects = DirectMessageQuerySet.as_manager()
 
     class Meta:
         ordering = ["-created_at"]
@@ -146,6 +366,9 @@ class DirectMessage(TimeStampedBaseModel):
         return f"DM from {self.sender.username}: {self.content[:50]}..."
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.conversation.updated_at = self.created_at
-        self.conversation.save(update_fields=["updated_at"])
+        is_new = self._state.adding
+        # The conversation bump commits or rolls back with the message
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if is_new:
+                DirectMessageConversation.record_messages([self])
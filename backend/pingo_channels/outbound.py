@@ -0,0 +1,196 @@
+"""
+Bounded outbound queues for slow sockets.
+
+Broadcast handlers used to ``await self.send`` every frame, so one client
+on a bad network held up its consumer until its channel layer inbox filled
+and the layer started dropping messages silently. Consumers now put
+broadcast frames on their ``OutboundQueue`` and return at once, and a writer
+task per socket sends the frames in order.
+
+A socket may fall at most ``capacity`` frames behind per group, configured
+by group name pattern in ``PINGO_SEND_QUEUES``. Beyond that the pattern's
+policy applies:
+
+``coalesce``
+    a frame about the same thing as a queued one (a server's presence, a
+    read watermark) is merged into it in place, so it never counts against
+    the capacity; other frames beyond it drop the group's oldest frame
+``drop_oldest``
+    the group's oldest queued frame is dropped
+``disconnect``
+    the socket is sent a ``slow_consumer`` frame listing the sequence number
+    to resume each channel from, then closed with code 4008
+
+Coalesced, dropped and delayed frames (those that had to wait behind
+others) and slow-consumer disconnects are counted per pattern.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from common.metrics import increment, timer
+
+from .encoding import encode_frame, merge_presence_events
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("coalesce", "drop_oldest", "disconnect")
+# Used for groups that match no pattern
+DEFAULT_QUEUE = ("*", 1000, "disconnect")
+SLOW_CONSUMER_CLOSE_CODE = 4008
+# How to merge two queued events with the same coalesce key; by default the
+# later one replaces the earlier
+MERGERS = {"presence_broadcast": merge_presence_events}
+
+
+@lru_cache(maxsize=4096)
+def queue_config(group):
+    """``(pattern, capacity, policy)`` for a group name"""
+    for pattern, config in settings.PINGO_SEND_QUEUES.items():
+        if fnmatchcase(group, pattern):
+            if config["policy"] not in POLICIES:
+                raise ImproperlyConfigured(
+                    f"PINGO_SEND_QUEUES[{pattern!r}] policy must be one of {POLICIES}"
+                )
+            return pattern, config["capacity"], config["policy"]
+    return DEFAULT_QUEUE
+
+
+@receiver(setting_changed)
+def reset_queue_config(setting, **kwargs):
+    if setting == "PINGO_SEND_QUEUES":
+        queue_config.cache_clear()
+
+
+class OutboundQueue:
+    """
+    Broadcast frames waiting to be sent to one socket.
+
+    ``send`` and ``close`` are the consumer's. Frames are group events as
+    built in pingo_channels.encoding; chat message frames are timed and
+    counted per channel as they go out, and their sequence numbers recorded
+    for the resume hint.
+    """
+
+    def __init__(self, send, close):
+        self._send = send
+        self._close = close
+        self._events = deque()
+        # group -> number of its events in the queue
+        self._queued = {}
+        # group -> where to resume the channel, from the last frame sent
+        self._delivered = {}
+        self._task = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, event):
+        """Queue a group event's frame, applying its group's policy"""
+        if self._closed:
+            return
+        group = event.get("group", "")
+        pattern, capacity, policy = queue_config(group)
+
+        key = event.get("coalesce")
+        if policy == "coalesce" and key is not None:
+            for index, queued in enumerate(self._events):
+                if queued.get("coalesce") == key:
+                    merge = MERGERS.get(event["type"])
+                    self._events[index] = merge(queued, event) if merge else event
+                    increment("ws.frames_coalesced", group=pattern)
+                    return
+
+        if self._queued.get(group, 0) >= capacity:
+            if policy == "disconnect":
+                self._disconnect(pattern)
+                return
+            self._drop_oldest(group)
+            increment("ws.frames_dropped", group=pattern)
+
+        if self._events:
+            increment("ws.frames_delayed", group=pattern)
+        self._events.append(event)
+        self._queued[group] = self._queued.get(group, 0) + 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def drain(self):
+        """Wait until every queued frame has been sent"""
+        if self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    def cancel(self):
+        """Discard queued frames; the socket is going away"""
+        self._closed = True
+        self._events.clear()
+        self._queued.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+    def resume_hint(self):
+        """Where to resume each channel this socket has been sent frames for"""
+        return list(self._delivered.values())
+
+    def _drop_oldest(self, group):
+        for index, queued in enumerate(self._events):
+            if queued.get("group", "") == group:
+                del self._events[index]
+                self._queued[group] -= 1
+                return
+
+    async def _drain(self):
+        while self._events:
+            event = self._events.popleft()
+            group = event.get("group", "")
+            self._queued[group] -= 1
+            if not self._queued[group]:
+                del self._queued[group]
+            try:
+                await self._deliver(event)
+            except Exception:
+                # The socket is gone; disconnect() will cancel the queue
+                logger.debug("Could not send queued frame", exc_info=True)
+                return
+
+    async def _deliver(self, event):
+        channel_id = event.get("channel_id")
+        if channel_id is None:
+            await self._send(text_data=event["text"])
+            return
+        with timer("chat.send", channel=channel_id):
+            await self._send(text_data=event["text"])
+        increment("chat.frames_sent", channel=channel_id)
+        if event.get("seq") is not None:
+            self._delivered[event["group"]] = {
+                "server_id": event["server_id"],
+                "channel_id": channel_id,
+                "last_seq": event["seq"],
+            }
+
+    def _disconnect(self, pattern):
+        resume = self.resume_hint()
+        self.cancel()
+        increment("ws.slow_consumer_disconnects", group=pattern)
+        logger.info("Closing socket that fell behind on %s", pattern)
+        # In the background, as the socket is by definition slow to take it
+        self._task = asyncio.get_running_loop().create_task(self._farewell(resume))
+
+    async def _farewell(self, resume):
+        await self._send(
+            text_data=encode_frame(
+                {
+                    "type": "slow_consumer",
+                    "message": "Too far behind to keep up; reconnect and resume",
+                    "resume": resume,
+                }
+            )
+        )
+        await self._close(code=SLOW_CONSUMER_CLOSE_CODE)
@@ -0,0 +1,274 @@
+import asyncio
+import atexit
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from datetime import datetime, timedelta
+from pathlib import Path
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+SPILL_SUFFIX = ".jsonl"
+
+
+class MessageWriter:
+    """
+    Write-behind queue for channel messages posted over WebSockets.
+
+    ``enqueue`` assigns the id and timestamp in memory and returns at once so
+    the message can be broadcast before it is stored. A single drain task per
+    process then saves the queue with ``bulk_create``, every
+    ``flush_interval`` seconds or as soon as ``batch_size`` rows are waiting.
+
+    Queued messages have already been broadcast, so they are never given up
+    on: a batch that fails is retried with backoff, capped at
+    ``max_backoff`` seconds, for as long as it takes. A retry skips the rows
+    an earlier attempt stored after all (e.g. its commit succeeded but the
+    connection dropped before the reply). Rows that can never be stored
+    (e.g. the channel was deleted) are logged and skipped one by one instead
+    of blocking the rest of the batch.
+
+    While ``max_pending`` rows are waiting the queue is full and senders
+    store their messages synchronously instead (see post_channel_message),
+    so an outage slows them down rather than growing the queue. Those
+    messages skip the queue and can be stored before earlier queued ones;
+    readers order messages by ``created_at``, not by when they were stored.
+
+    At shutdown ``flush_sync`` stores what it can and writes the rest to
+    ``spill_dir``, from where the next writer to start queues it again.
+    """
+
+    def __init__(
+        self,
+        batch_size=100,
+        flush_interval=0.05,
+        max_pending=10000,
+        max_backoff=5.0,
+        spill_dir=None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self._pending = deque()
+        self._last_created_at = None
+        self._task = None
+        self._batch_ready = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def is_full(self):
+        return len(self._pending) >= self.max_pending
+
+    def enqueue(self, message):
+        """Queue an unsaved ``Message`` and return it with id and timestamps set"""
+        now = timezone.now()
+        # Keep timestamps strictly increasing so (created_at, id) pagination
+        # returns queued messages in the order they were broadcast
+        if self._last_created_at and now <= self._last_created_at:
+            now = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = now
+        message.created_at = message.updated_at = now
+
+        self._pending.append(message)
+        self._start_drain()
+        if len(self._pending) >= self.batch_size and self._batch_ready:
+            self._batch_ready.set()
+        return message
+
+    async def flush(self):
+        """Wait until everything queued so far has been stored"""
+        if self._task is not None and not self._task.done():
+            self._batch_ready.set()
+            await asyncio.shield(self._task)
+
+    def flush_sync(self, attempts=3):
+        """
+        Store everything queued so far from synchronous code, at shutdown.
+        Batches still failing after ``attempts`` tries are spilled to disk.
+        """
+        while self._pending:
+            batch = self._take_batch()
+            for attempt in range(attempts):
+                try:
+                    self._write_batch(batch)
+                    break
+                except Exception:
+                    logger.warning(
+                        "Could not write %d messages", len(batch), exc_info=True
+                    )
+                    if attempt + 1 < attempts:
+                        time.sleep(self._backoff(attempt))
+            else:
+                self.spill()
+                return
+            self._commit_batch(batch)
+
+    def spill(self):
+        """Write every queued message to a file in ``spill_dir``"""
+        if not self._pending:
+            return
+        if self.spill_dir is None:
+            logger.error(
+                "%d messages could not be stored and no spill directory is set",
+                len(self._pending),
+            )
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / f"{uuid.uuid4()}{SPILL_SUFFIX}"
+        with open(path, "w") as f:
+            for message in self._pending:
+                f.write(json.dumps(spill_record(message), default=str) + "\n")
+        logger.error(
+            "Spilled %d unsaved messages to %s; they are stored when a worker "
+            "next starts",
+            len(self._pending),
+            path,
+        )
+        self._pending.clear()
+
+    def restore(self):
+        """
+        Queue the messages spilled by writers that shut down before storing
+        them. Each spill file is claimed by renaming it, so several workers
+        starting together queue every message once.
+        """
+        if self.spill_dir is None or not self.spill_dir.is_dir():
+            return
+        for path in sorted(self.spill_dir.glob(f"*{SPILL_SUFFIX}")):
+            claimed = path.with_suffix(".restoring")
+            try:
+                path.rename(claimed)
+            except OSError:
+                continue  # Claimed by another worker
+            with open(claimed) as f:
+                for line in f:
+                    self._pending.append(message_from_spill_record(json.loads(line)))
+            claimed.unlink()
+        if not self._pending:
+            return
+        logger.info("Restored %d spilled messages", len(self._pending))
+        latest = max(message.created_at for message in self._pending)
+        if self._last_created_at is None or latest > self._last_created_at:
+            self._last_created_at = latest
+        try:
+            self._start_drain()
+        except RuntimeError:
+            pass  # No event loop; the next enqueue or flush_sync stores them
+
+    def _start_drain(self):
+        if self._task is None or self._task.done():
+            self._batch_ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending:
+            if len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(
+                        self._batch_ready.wait(), timeout=self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_ready.clear()
+            await self._write_next_batch()
+
+    def _take_batch(self):
+        return list(islice(self._pending, self.batch_size))
+
+    def _commit_batch(self, batch):
+        # Only remove rows once stored; enqueue may have appended meanwhile
+        for _ in batch:
+            self._pending.popleft()
+
+    def _backoff(self, attempt):
+        return min(self.flush_interval * 2**attempt, self.max_backoff)
+
+    async def _write_next_batch(self):
+        batch = self._take_batch()
+        attempt = 0
+        while True:
+            try:
+                await database_sync_to_async(self._write_batch)(batch)
+                break
+            except Exception:
+                logger.warning(
+                    "Retrying write of %d messages (attempt %d)",
+                    len(batch),
+                    attempt + 1,
+                    exc_info=True,
+                )
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+        self._commit_batch(batch)
+
+    def _write_batch(self, batch):
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+        except (IntegrityError, DataError):
+            # Isolate the rows that can never be stored; connection errors
+            # and the like propagate and the whole batch is retried
+            stored = set(
+                Message.objects.filter(
+                    id__in=[message.id for message in batch]
+                ).values_list("id", flat=True)
+            )
+            for message in batch:
+                if message.id in stored:
+                    continue  # Stored by an attempt that seemed to fail
+                try:
+                    with transaction.atomic():
+                        Message.objects.bulk_create([message])
+                except (IntegrityError, DataError):
+                    logger.exception("Skipping unsavable message %s", message.id)
+
+
+def spill_record(message):
+    return {
+        "id": message.id,
+        "channel_id": message.channel_id,
+        "author_id": message.author_id,
+        "content": message.content,
+        "is_deleted": message.is_deleted,
+        "created_at": message.created_at.isoformat(),
+    }
+
+
+def message_from_spill_record(record):
+    created_at = datetime.fromisoformat(record.pop("created_at"))
+    return Message(**record, created_at=created_at, updated_at=created_at)
+
+
+def get_message_writer():
+    """Return the process-wide writer, or None if write-behind is disabled"""
+    global _message_writer
+    if not settings.PINGO_WRITE_BEHIND_MESSAGES:
+        return None
+    if _message_writer is None:
+        _message_writer = MessageWriter(
+            batch_size=settings.PINGO_WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=settings.PINGO_WRITE_BEHIND_FLUSH_MS / 1000,
+            max_pending=settings.PINGO_WRITE_BEHIND_MAX_PENDING,
+            max_backoff=settings.PINGO_WRITE_BEHIND_MAX_BACKOFF_SECONDS,
+            spill_dir=settings.PINGO_WRITE_BEHIND_SPILL_DIR,
+        )
+        # Queue what a previous worker could not store before it stopped
+        _message_writer.restore()
+        # Save whatever is still queued when the worker shuts down
+        atexit.register(_message_writer.flush_sync)
+    return _message_writer
+
+
+_message_writer = None
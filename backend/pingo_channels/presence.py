@@ -0,0 +1,393 @@
+"""
+Online presence for users with open sockets.
+
+Every authorized ``ChatConsumer`` (and every channel a ``GatewayConsumer``
+subscribes to) marks its user online in that channel's server;
+``DirectMessageConsumer`` marks the user online without a server. Sockets
+register with the process-wide ``PresenceTracker``, which keeps them alive
+in the shared store with one batched heartbeat per worker instead of one
+write per socket, and queues the resulting online/offline changes per
+server. The queue is flushed as a single ``presence`` frame per server at
+most every ``PINGO_PRESENCE_BROADCAST_MS``, however many users come and go
+in between, to the server's presence group.
+
+The store is Redis when the channel layer is, so every worker sees the same
+presence, and per-process memory otherwise. In Redis each entry is a sorted
+set member scored with its expiry time, which gives per-member TTLs in a
+handful of keys:
+
+``presence:server:<server id>``
+    user id -> expiry, for users online in the server
+``presence:user:<user id>``
+    ``<server id>|<connection id>`` -> expiry, for each of the user's sockets
+``presence:online``
+    user id -> expiry, for users online anywhere
+
+Entries left behind by a worker that died expire after
+``PRESENCE_TTL_HEARTBEATS`` missed heartbeats.
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+from .encoding import presence_event
+from .utils import channel_layer_redis_url, presence_group_name
+
+logger = logging.getLogger(__name__)
+
+# Entries outlive this many missed heartbeats
+PRESENCE_TTL_HEARTBEATS = 3
+ONLINE_KEY = "presence:online"
+
+
+def server_presence_key(server_id):
+    return f"presence:server:{server_id}"
+
+
+def user_connections_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+def connection_member(server_id, connection_id):
+    return f"{server_id or ''}|{connection_id}"
+
+
+class InMemoryPresence:
+    """Presence for a single process: local runs and tests"""
+
+    def __init__(self):
+        self._servers = {}
+        self._connections = {}
+        self._online = {}
+
+    @staticmethod
+    def _live(entries, now):
+        for member in [m for m, expires in entries.items() if expires <= now]:
+            del entries[member]
+        return entries
+
+    async def add(self, user_id, server_id, connection_id, ttl):
+        """Record a socket; True if the user just came online in the server"""
+        now = time.time()
+        expires = now + ttl
+        connections = self._connections.setdefault(user_id, {})
+        connections[connection_member(server_id, connection_id)] = expires
+        self._online[user_id] = max(self._online.get(user_id, 0), expires)
+        if not server_id:
+            return False
+        members = self._live(self._servers.setdefault(server_id, {}), now)
+        came_online = user_id not in members
+        members[user_id] = max(members.get(user_id, 0), expires)
+        return came_online
+
+    async def remove(self, user_id, server_id, connection_id):
+        """Forget a socket; True if the user just went offline in the server"""
+        now = time.time()
+        connections = self._live(self._connections.get(user_id, {}), now)
+        connections.pop(connection_member(server_id, connection_id), None)
+        if not connections:
+            self._connections.pop(user_id, None)
+            self._online.pop(user_id, None)
+        if not server_id:
+            return False
+        prefix = connection_member(server_id, "")
+        if any(member.startswith(prefix) for member in connections):
+            return False
+        return self._servers.get(server_id, {}).pop(user_id, None) is not None
+
+    async def refresh(self, connections, ttl):
+        """Push back the expiry of every ``(user, server, connection)``"""
+        expires = time.time() + ttl
+        for user_id, server_id, connection_id in connections:
+            member = connection_member(server_id, connection_id)
+            self._connections.setdefault(user_id, {})[member] = expires
+            self._online[user_id] = expires
+            if server_id:
+                self._servers.setdefault(server_id, {})[user_id] = expires
+
+    def online_in_server(self, server_id):
+        """Ids of the users online in the server"""
+        return list(self._live(self._servers.get(str(server_id), {}), time.time()))
+
+    def online_users(self, user_ids):
+        """The subset of ``user_ids`` that is online anywhere"""
+        now = time.time()
+        return {
+            user_id
+            for user_id in map(str, user_ids)
+            if self._online.get(user_id, 0) > now
+        }
+
+
+# KEYS: user's connections, server set ("" for none), online set
+# ARGV: connection member, now, user id, "<server id>|" prefix
+REMOVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local remaining = redis.call('ZRANGE', KEYS[1], 0, -1)
+if #remaining == 0 then
+    redis.call('ZREM', KEYS[3], ARGV[3])
+end
+if KEYS[2] == '' then
+    return 0
+end
+for _, member in ipairs(remaining) do
+    if string.sub(member, 1, #ARGV[4]) == ARGV[4] then
+        return 0
+    end
+end
+return redis.call('ZREM', KEYS[2], ARGV[3])
+"""
+
+
+class RedisPresence:
+    """
+    Presence shared by every worker through Redis.
+
+    Writes come from consumers on the event loop and use an asyncio client
+    per loop; reads come from views and use a blocking client. Removing a
+    socket runs as one script, so a socket opening on another worker at the
+    same moment cannot be missed when deciding whether the user went offline.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._sync_client = None
+
+    def _client(self):
+        """The asyncio client and removal script for the running loop"""
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            client = redis.asyncio.Redis.from_url(self.url, decode_responses=True)
+            self._async_clients[loop] = (client, client.register_script(REMOVE_SCRIPT))
+        return self._async_clients[loop]
+
+    def _reader(self):
+        if self._sync_client is None:
+            self._sync_client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._sync_client
+
+    async def add(self, user_id, server_id, connection_id, ttl):
+        now = time.time()
+        expires = now + ttl
+        connections = user_connections_key(user_id)
+        client, _ = self._client()
+        async with client.pipeline(transaction=True) as pipe:
+            if server_id:
+                pipe.zscore(server_presence_key(server_id), user_id)
+                pipe.zadd(server_presence_key(server_id), {user_id: expires}, gt=True)
+                pipe.expire(server_presence_key(server_id), ttl)
+            pipe.zadd(
+                connections, {connection_member(server_id, connection_id): expires}
+            )
+            pipe.expire(connections, ttl)
+            pipe.zadd(ONLINE_KEY, {user_id: expires}, gt=True)
+            results = await pipe.execute()
+        if not server_id:
+            return False
+        return results[0] is None or results[0] <= now
+
+    async def remove(self, user_id, server_id, connection_id):
+        _, remove_connection = self._client()
+        went_offline = await remove_connection(
+            keys=[
+                user_connections_key(user_id),
+                server_presence_key(server_id) if server_id else "",
+                ONLINE_KEY,
+            ],
+            args=[
+                connection_member(server_id, connection_id),
+                time.time(),
+                user_id,
+                connection_member(server_id, ""),
+            ],
+        )
+        return bool(went_offline)
+
+    async def refresh(self, connections, ttl):
+        now = time.time()
+        expires = now + ttl
+        servers = set()
+        client, _ = self._client()
+        async with client.pipeline(transaction=False) as pipe:
+            for user_id, server_id, connection_id in connections:
+                key = user_connections_key(user_id)
+                pipe.zadd(key, {connection_member(server_id, connection_id): expires})
+                pipe.expire(key, ttl)
+                pipe.zadd(ONLINE_KEY, {user_id: expires}, gt=True)
+                if server_id:
+                    pipe.zadd(server_presence_key(server_id), {user_id: expires})
+                    servers.add(server_id)
+            for server_id in servers:
+                key = server_presence_key(server_id)
+                pipe.zremrangebyscore(key, "-inf", now)
+                pipe.expire(key, ttl)
+            pipe.zremrangebyscore(ONLINE_KEY, "-inf", now)
+            await pipe.execute()
+
+    def online_in_server(self, server_id):
+        return self._reader().zrangebyscore(
+            server_presence_key(server_id), time.time(), "+inf"
+        )
+
+    def online_users(self, user_ids):
+        user_ids = [str(user_id) for user_id in user_ids]
+        if not user_ids:
+            return set()
+        now = time.time()
+        scores = self._reader().zmscore(ONLINE_KEY, user_ids)
+        return {
+            user_id
+            for user_id, expires in zip(user_ids, scores)
+            if expires is not None and expires > now
+        }
+
+
+class PresenceTracker:
+    """
+    The sockets open in this process and the presence changes they caused.
+
+    A socket may register the same ``(user, server, connection)`` more than
+    once (a gateway subscribed to several channels of one server); it stays
+    online until every registration is released. One heartbeat task per
+    process refreshes all registered sockets in a single batch, and one flush
+    task sends the changes queued during each broadcast interval.
+    """
+
+    def __init__(self, store, heartbeat_interval=30, broadcast_interval=1.0):
+        self.store = store
+        self.heartbeat_interval = heartbeat_interval
+        self.broadcast_interval = broadcast_interval
+        self.ttl = heartbeat_interval * PRESENCE_TTL_HEARTBEATS
+        self._local = {}
+        # server id -> {user id: online?}, latest state wins
+        self._changes = {}
+        self._heartbeat_task = None
+        self._flush_task = None
+
+    async def connect(self, user_id, server_id, connection_id):
+        key = (str(user_id), str(server_id) if server_id else None, connection_id)
+        self._local[key] = self._local.get(key, 0) + 1
+        if self._local[key] > 1:
+            return
+        self._start_heartbeat()
+        try:
+            came_online = await self.store.add(*key, self.ttl)
+        except Exception:
+            logger.warning("Could not record presence for %s", key[0], exc_info=True)
+            return
+        if came_online:
+            self._queue_change(key[1], key[0], True)
+
+    async def disconnect(self, user_id, server_id, connection_id):
+        key = (str(user_id), str(server_id) if server_id else None, connection_id)
+        count = self._local.get(key, 0) - 1
+        if count > 0:
+            self._local[key] = count
+            return
+        if self._local.pop(key, None) is None:
+            return
+        try:
+            went_offline = await self.store.remove(*key)
+        except Exception:
+            logger.warning("Could not clear presence for %s", key[0], exc_info=True)
+            return
+        if went_offline:
+            self._queue_change(key[1], key[0], False)
+
+    async def online_users(self, user_ids):
+        """The subset of ``user_ids`` online anywhere; empty if the store is down"""
+        try:
+            return await sync_to_async(self.store.online_users)(user_ids)
+        except Exception:
+            logger.warning("Could not read presence", exc_info=True)
+            return set()
+
+    async def heartbeat(self):
+        """Refresh every socket registered in this process"""
+        if self._local:
+            await self.store.refresh(list(self._local), self.ttl)
+
+    async def flush(self):
+        """Broadcast the queued changes, one frame per server"""
+        changes, self._changes = self._changes, {}
+        if not changes:
+            return
+        channel_layer = get_channel_layer()
+        for server_id, users in changes.items():
+            await channel_layer.group_send(
+                presence_group_name(server_id), presence_event(server_id, users)
+            )
+
+    def _queue_change(self, server_id, user_id, online):
+        self._changes.setdefault(server_id, {})[user_id] = online
+        if not self._running(self._flush_task):
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._flush_later()
+            )
+
+    def _start_heartbeat(self):
+        if not self._running(self._heartbeat_task):
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._beat())
+
+    @staticmethod
+    def _running(task):
+        # Tasks left over from another event loop (e.g. an earlier test) never finish
+        return (
+            task is not None
+            and not task.done()
+            and task.get_loop() is asyncio.get_running_loop()
+        )
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.broadcast_interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.warning("Could not broadcast presence changes", exc_info=True)
+
+    async def _beat(self):
+        while self._local:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception:
+                logger.warning("Presence heartbeat failed", exc_info=True)
+
+
+def get_presence_store():
+    """Redis when the channel layer uses Redis, this process's memory otherwise"""
+    url = channel_layer_redis_url()
+    return RedisPresence(url) if url else InMemoryPresence()
+
+
+def get_presence():
+    """Return the process-wide tracker, created on first use"""
+    global _tracker
+    if _tracker is None:
+        _tracker = PresenceTracker(
+            get_presence_store(),
+            heartbeat_interval=settings.PINGO_PRESENCE_HEARTBEAT_SECONDS,
+            broadcast_interval=settings.PINGO_PRESENCE_BROADCAST_MS / 1000,
+        )
+    return _tracker
+
+
+@receiver(setting_changed)
+def reset_presence(setting, **kwargs):
+    global _tracker
+    if setting == "CHANNEL_LAYERS" or setting.startswith("PINGO_PRESENCE_"):
+        _tracker = None
+
+
+_tracker = None
@@ -0,0 +1,291 @@
+"""
+Sequence numbers and replay for channel broadcasts.
+
+Every event broadcast to a channel group is numbered from a per-channel
+counter, and its encoded frame carries that number as ``seq``. The last
+``PINGO_REPLAY_BUFFER_SIZE`` frames of each channel are kept in a ring, so
+a client that reconnects can send ``{"type": "resume", "last_seq": N}`` and
+receive only the frames after N instead of reloading the message history.
+When the ring no longer reaches back to N the consumer answers
+``resume_failed`` and the client falls back to the REST history.
+
+Each worker numbers and sends a channel's events one at a time, so its
+frames go out in sequence order, but frames numbered by different workers
+can still arrive out of order. Clients must therefore not drop a frame just
+because its ``seq`` is not above the last one they applied:
+
+- a frame with ``seq`` equal to the last applied one plus one is applied;
+- a frame further ahead leaves a gap; it is buffered until the frames in
+  between arrive, or, if they have not arrived shortly after, the client
+  sends ``resume`` with the last ``seq`` it applied and gets them from the
+  ring;
+- a frame at or below the last applied ``seq`` has been applied already
+  (replayed and live frames overlap around a resume) and is dropped.
+
+As with presence, the ring lives in Redis when the channel layer does and
+in process memory otherwise. In Redis each channel has a counter,
+``replay:seq:<group>``, and a sorted set of frames scored by sequence,
+``replay:ring:<group>``, trimmed to the ring size on every append. Both
+expire together after ``PINGO_REPLAY_BUFFER_TTL_SECONDS`` without traffic,
+so quiet channels leave nothing behind. The counter then starts again from
+1, so a client that has been away for longer than that must reload the
+history instead of resuming; a ``last_seq`` ahead of the new counter is
+answered ``resume_failed``, but a smaller one cannot be told apart. One Lua
+script takes the number and appends the frame, so the ring never holds a
+frame whose predecessor is still being written.
+"""
+
+import asyncio
+import logging
+import weakref
+from collections import deque
+import redis.asyncio
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from common.metrics import increment
+
+from .encoding import encode_frame
+from .utils import channel_layer_redis_url
+
+logger = logging.getLogger(__name__)
+
+
+def sequence_key(stream):
+    return f"replay:seq:{stream}"
+
+
+def ring_key(stream):
+    return f"replay:ring:{stream}"
+
+
+# Placeholder for the sequence number while a frame is built for RedisReplay
+SEQ_PLACEHOLDER = "\x00seq"
+# Takes the next number for KEYS[1] and appends ARGV[1] .. seq .. ARGV[2]
+# (the frame) to the ring KEYS[2], trimmed to ARGV[3] entries; both keys
+# expire after ARGV[4] seconds
+RECORD_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, ARGV[1] .. seq .. ARGV[2])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[3]) + 1))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return seq
+"""
+
+
+def replayable(last_seq, latest, entries):
+    """
+    The frames after ``last_seq`` from ``(frame, seq)`` entries in sequence
+    order, or None unless they run without a gap from ``last_seq + 1`` to
+    ``latest``.
+    """
+    if last_seq > latest:
+        # Ahead of the counter, which was reset; nothing here can be trusted
+        return None
+    seqs = [int(seq) for _, seq in entries]
+    if seqs != list(range(last_seq + 1, latest + 1)):
+        return None
+    return [frame for frame, _ in entries]
+
+
+class InMemoryReplay:
+    """Replay ring for a single process: local runs and tests"""
+
+    def __init__(self, size=500):
+        self.size = size
+        self._sequences = {}
+        self._rings = {}
+
+    async def record(self, stream, build_event):
+        """Number an event, keep its frame and return it ready to broadcast"""
+        seq = self._sequences[stream] = self._sequences.get(stream, 0) + 1
+        event = build_event(seq)
+        ring = self._rings.setdefault(stream, deque(maxlen=self.size))
+        ring.append((event["text"], seq))
+        return event
+
+    async def latest(self, stream):
+        """The sequence number of the stream's last event, 0 if none"""
+        return self._sequences.get(stream, 0)
+
+    async def since(self, stream, last_seq):
+        """Return ``(latest, frames after last_seq or None)``"""
+        latest = self._sequences.get(stream, 0)
+        entries = [
+            entry for entry in self._rings.get(stream, ()) if entry[1] > last_seq
+        ]
+        return latest, replayable(last_seq, latest, entries)
+
+
+class RedisReplay:
+    """Replay ring shared by every worker through Redis"""
+
+    def __init__(self, url, size=500, ttl=3600):
+        self.url = url
+        self.size = size
+        self.ttl = ttl
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            self._clients[loop] = redis.asyncio.Redis.from_url(
+                self.url, decode_responses=True
+            )
+        return self._clients[loop]
+
+    async def record(self, stream, build_event):
+        client = self._client()
+        # The frame is encoded before its number is known, and the script
+        # puts the number in place of the placeholder, which the event
+        # builders encode ahead of any message content
+        event = build_event(SEQ_PLACEHOLDER)
+        head, placeholder, tail = event["text"].partition(encode_frame(SEQ_PLACEHOLDER))
+        if not placeholder:
+            raise ValueError(f"Event for {stream} has no sequence number")
+        seq = await client.register_script(RECORD_SCRIPT)(
+            keys=[sequence_key(stream), ring_key(stream)],
+            args=[head, tail, self.size, self.ttl],
+        )
+        return {**event, "seq": seq, "text": f"{head}{seq}{tail}"}
+
+    async def latest(self, stream):
+        return int(await self._client().get(sequence_key(stream)) or 0)
+
+    async def since(self, stream, last_seq):
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.get(sequence_key(stream))
+            pipe.zrangebyscore(
+                ring_key(stream), f"({last_seq}", "+inf", withscores=True
+            )
+            latest, entries = await pipe.execute()
+        latest = int(latest or 0)
+        return latest, replayable(last_seq, latest, entries)
+
+
+async def sequence_event(stream, build_event):
+    """
+    Number and record an event for ``stream`` (a channel group name).
+    ``build_event`` takes the sequence number and returns the group event.
+
+    If the ring is unavailable the event is built without a number rather
+    than not sent; clients treat a missing ``seq`` as "cannot resume".
+    """
+    try:
+        return await get_replay_buffer().record(stream, build_event)
+    except Exception:
+        logger.warning("Could not sequence event for %s", stream, exc_info=True)
+        return build_event(None)
+
+
+async def broadcast_sequenced(stream, build_event, channel_layer=None):
+    """
+    Number an event with ``sequence_event`` and send it to the group
+    ``stream``. Events for a stream are numbered and sent one at a time in
+    each process, so that a later number never overtakes an earlier one on
+    its way out of the process.
+    """
+    async with _stream_lock(stream):
+        event = await sequence_event(stream, build_event)
+        await (channel_layer or get_channel_layer()).group_send(stream, event)
+    return event
+
+
+def _stream_lock(stream):
+    # Locks belong to an event loop; each lives while something holds it
+    locks = _stream_locks.setdefault(
+        asyncio.get_running_loop(), weakref.WeakValueDictionary()
+    )
+    lock = locks.get(stream)
+    if lock is None:
+        lock = locks[stream] = asyncio.Lock()
+    return lock
+
+
+_stream_locks = weakref.WeakKeyDictionary()
+
+
+def broadcast_sequenced_on_commit(stream, build_event):
+    """
+    ``broadcast_sequenced`` once the current transaction commits, for
+    synchronous code such as views. The number is only taken after the
+    commit, so a rolled-back change never leaves a gap, and a failed send is
+    logged rather than failing the request.
+    """
+
+    async def send():
+        await broadcast_sequenced(stream, build_event)
+
+    transaction.on_commit(async_to_sync(send), robust=True)
+
+
+async def latest_sequence(stream):
+    """The stream's current sequence number, or None if it cannot be read"""
+    try:
+        return await get_replay_buffer().latest(stream)
+    except Exception:
+        logger.warning("Could not read sequence for %s", stream, exc_info=True)
+        return None
+
+
+async def resume_frames(stream, last_seq, **target):
+    """
+    The frames to send a socket resuming ``stream`` after ``last_seq``: the
+    missed frames in order, then a ``resumed`` frame, or only a
+    ``resume_failed`` frame if they cannot all be replayed. ``target`` is
+    added to the final frame (the gateway labels it with the channel).
+    """
+    try:
+        latest, frames = await get_replay_buffer().since(stream, last_seq)
+    except Exception:
+        logger.warning("Could not replay %s", stream, exc_info=True)
+        latest, frames = None, None
+
+    if frames is None:
+        increment("chat.resumes", outcome="failed")
+        return [
+            encode_frame(
+                {
+                    "type": "resume_failed",
+                    "message": "Missed events are no longer available; reload the message history",
+                    "seq": latest,
+                    **target,
+                }
+            )
+        ]
+    increment("chat.resumes", outcome="replayed")
+    increment("chat.frames_replayed", len(frames))
+    return frames + [
+        encode_frame(
+            {"type": "resumed", "seq": latest, "replayed": len(frames), **target}
+        )
+    ]
+
+
+def get_replay_buffer():
+    """Return the process-wide replay ring, created on first use"""
+    global _buffer
+    if _buffer is None:
+        url = channel_layer_redis_url()
+        size = settings.PINGO_REPLAY_BUFFER_SIZE
+        if url:
+            _buffer = RedisReplay(
+                url, size=size, ttl=settings.PINGO_REPLAY_BUFFER_TTL_SECONDS
+            )
+        else:
+            _buffer = InMemoryReplay(size=size)
+    return _buffer
+
+
+@receiver(setting_changed)
+def reset_replay_buffer(setting, **kwargs):
+    global _buffer
+    if setting == "CHANNEL_LAYERS" or setting.startswith("PINGO_REPLAY_"):
+        _buffer = None
+
+
+_buffer = None
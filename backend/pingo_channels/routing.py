@@ -9,4 +9,6 @@ websocket_urlpatterns = [
     path(
         "chat/direct/<uuid:conversation_id>/", consumers.DirectMessageConsumer.as_asgi()
     ),
+    # Single multiplexed socket for all of a client's channels and DMs
+    path("gateway/", consumers.GatewayConsumer.as_asgi()),
 ]
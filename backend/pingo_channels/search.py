@@ -0,0 +1,216 @@
+"""
+Full-text search over channel and direct messages.
+
+On PostgreSQL, message content is matched with ``to_tsvector`` against a
+``websearch_to_tsquery`` and served by the GIN expression indexes created in
+migration 0007; highlights come from ``ts_headline``. On SQLite (local runs
+and tests) each model has an FTS5 table kept in sync by triggers, and
+highlights come from FTS5's ``snippet``. Either way a search only reads the
+matching rows instead of scanning every message with ``icontains``.
+
+The FTS5 tables store each message's id next to its content rather than
+pointing at the message table's implicit rowid, which VACUUM and Django's
+SQLite table rebuilds are free to renumber. A rebuild also drops the
+table's triggers, so after every migrate ``repair_sqlite_search_indexes``
+recreates any that are missing and reindexes that table.
+"""
+
+import re
+import uuid
+from django.db import connections
+from django.db.models import BooleanField, CharField, F, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.response import Response
+from rest_framework import status
+from common.pagination import get_page_limit
+
+SEARCH_CONFIG = "english"
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+# Roughly ts_headline's default MaxWords
+SNIPPET_TOKENS = 32
+SEARCH_PAGE_SIZE = 25
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_QUERY_LENGTH = 200
+
+
+def search_index_table(model):
+    """Name of the SQLite FTS5 table indexing the model's content"""
+    return f"{model._meta.db_table}_fts"
+
+
+def sqlite_search_triggers(table):
+    """``{name: CREATE TRIGGER statement}`` keeping ``table``'s index in sync"""
+    index = f"{table}_fts"
+    return {
+        f"{index}_insert": (
+            f'CREATE TRIGGER IF NOT EXISTS "{index}_insert" AFTER INSERT ON "{table}" '
+            f'BEGIN INSERT INTO "{index}"(message_id, content) '
+            f"VALUES (new.id, new.content); END"
+        ),
+        f"{index}_delete": (
+            f'CREATE TRIGGER IF NOT EXISTS "{index}_delete" AFTER DELETE ON "{table}" '
+            f'BEGIN DELETE FROM "{index}" WHERE message_id = old.id; END'
+        ),
+        f"{index}_update": (
+            f'CREATE TRIGGER IF NOT EXISTS "{index}_update" '
+            f'AFTER UPDATE OF content ON "{table}" '
+            f'BEGIN UPDATE "{index}" SET content = new.content '
+            f"WHERE message_id = old.id; END"
+        ),
+    }
+
+
+def install_sqlite_search_index(execute, table):
+    """
+    Create ``table``'s FTS5 index and triggers if missing and fill the index
+    from the table. ``execute`` runs one SQL statement.
+    """
+    index = f"{table}_fts"
+    execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{index}" USING fts5('
+        f"message_id UNINDEXED, content, tokenize='porter unicode61')"
+    )
+    for statement in sqlite_search_triggers(table).values():
+        execute(statement)
+    execute(f'DELETE FROM "{index}"')
+    execute(
+        f'INSERT INTO "{index}"(message_id, content) SELECT id, content FROM "{table}"'
+    )
+
+
+def repair_sqlite_search_indexes(connection, models):
+    """
+    Reinstall the FTS5 triggers of any of ``models`` whose table was rebuilt
+    by a migration, reindexing it. Returns the tables repaired.
+    """
+    repaired = []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master")
+        existing = {row[0] for row in cursor.fetchall()}
+        for model in models:
+            table = model._meta.db_table
+            if search_index_table(model) not in existing:
+                continue  # Not installed yet; its migration has not run
+            if set(sqlite_search_triggers(table)) <= existing:
+                continue
+            install_sqlite_search_index(cursor.execute, table)
+            repaired.append(table)
+    return repaired
+
+
+def search_messages(queryset, query):
+    """
+    Narrow a Message or DirectMessage queryset to rows whose content matches
+    ``query`` and annotate each with a ``highlight`` excerpt, in which the
+    matching words are wrapped in <mark> tags.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == "postgresql":
+        return _postgresql_search(queryset, query)
+    if vendor == "sqlite":
+        return _sqlite_search(queryset, query)
+    # No index on other backends; correct but a full scan
+    return queryset.filter(content__icontains=query).annotate(highlight=F("content"))
+
+
+def _postgresql_search(queryset, query):
+    # Imported here so the module loads without a PostgreSQL driver
+    from django.contrib.postgres.search import (
+        SearchHeadline,
+        SearchQuery,
+        SearchVector,
+    )
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+    # Must stay identical to the indexed expression in migration 0007
+    return (
+        queryset.alias(search=SearchVector("content", config=SEARCH_CONFIG))
+        .filter(search=search_query)
+        .annotate(
+            highlight=SearchHeadline(
+                "content",
+                search_query,
+                config=SEARCH_CONFIG,
+                start_sel=HIGHLIGHT_START,
+                stop_sel=HIGHLIGHT_STOP,
+            )
+        )
+    )
+
+
+def _sqlite_search(queryset, query):
+    # Quote every word so that user input is never parsed as FTS5 syntax
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return queryset.none().annotate(highlight=Value("", output_field=CharField()))
+    match = " ".join(f'"{term}"' for term in terms)
+
+    table = queryset.model._meta.db_table
+    index = search_index_table(queryset.model)
+    return queryset.filter(
+        RawSQL(
+            f'"{table}".id IN '
+            f'(SELECT message_id FROM "{index}" WHERE "{index}" MATCH %s)',
+            [match],
+            output_field=BooleanField(),
+        )
+    ).annotate(
+        highlight=RawSQL(
+            f'SELECT snippet("{index}", 1, %s, %s, %s, %s) FROM "{index}" '
+            f'WHERE "{index}" MATCH %s AND "{index}".message_id = "{table}".id',
+            [HIGHLIGHT_START, HIGHLIGHT_STOP, "…", SNIPPET_TOKENS, match],
+            output_field=CharField(),
+        )
+    )
+
+
+def get_search_page(request, queryset):
+    """
+    Search ``queryset`` for the ``q`` query parameter and return one page of
+    matches, newest first, as ``(messages, error_response)``.
+
+    ``limit`` bounds the page size and ``before`` takes the id of the last
+    message of the previous page; as with message history, pages are keyed
+    on (created_at, id).
+    """
+    query = request.query_params.get("q", "").strip()
+    if not query:
+        return None, Response(
+            {"error": "Search query is required."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(query) > MAX_QUERY_LENGTH:
+        return None, Response(
+            {"error": f"Search query must be at most {MAX_QUERY_LENGTH} characters."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    limit, error_response = get_page_limit(
+        request, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
+    )
+    if error_response:
+        return None, error_response
+
+    results = search_messages(queryset, query).order_by("-created_at", "id")
+
+    before = request.query_params.get("before")
+    if before:
+        try:
+            cursor_id = uuid.UUID(before)
+        except ValueError:
+            return None, Response(
+                {"error": "before must be a message id."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        cursor = queryset.filter(pk=cursor_id).values("created_at", "id").first()
+        if not cursor:
+            return None, Response(
+                {"error": "Message not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        results = results.filter(
+            Q(created_at__lt=cursor["created_at"])
+            | Q(created_at=cursor["created_at"], id__gt=cursor["id"])
+        )
+
+    return list(results[:limit]), None
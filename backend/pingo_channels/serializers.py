@@ -1,9 +1,16 @@
 from rest_framework import serializers
-from .models import Channel, Message, DirectMessage, DirectMessageConversation
+from .models import (
+    PERMISSION_FIELDS,
+    Channel,
+    Message,
+    DirectMessage,
+    DirectMessageConversation,
+)
 from accounts.serializers import UserProfileSerializer
 from servers.serializers import ServerSerializer
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
 
 
 class ChannelCreateSerializer(serializers.ModelSerializer):
@@ -12,6 +19,18 @@ class ChannelCreateSerializer(serializers.ModelSerializer):
         fields = ["name", "description"]
 
 
+class ChannelUpdateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Channel
+        fields = [
+            "name",
+            "description",
+            "min_view_role",
+            "min_read_role",
+            "min_message_role",
+        ]
+
+
 class ChannelSerializer(serializers.ModelSerializer):
     server = ServerSerializer(read_only=True)
     created_by = UserProfileSerializer(read_only=True)
@@ -36,6 +55,11 @@ class ChannelSerializer(serializers.ModelSerializer):
 
     def get_user_permissions(self, obj):
         """Get current user's permissions for this channel"""
+        # Channels from with_role_permissions() carry their flags already
+        if hasattr(obj, "can_view"):
+            return {
+                permission: getattr(obj, permission) for permission in PERMISSION_FIELDS
+            }
         request = self.context.get("request")
         if request and request.user:
             return obj.get_user_permissions(request.user)
@@ -70,6 +94,14 @@ class MessageSerializer(serializers.ModelSerializer):
         return data
 
 
+class MessageSearchResultSerializer(MessageSerializer):
+    channel_id = serializers.UUIDField(read_only=True)
+    highlight = serializers.CharField(read_only=True)
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ["channel_id", "highlight"]
+
+
 class DirectMessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = DirectMessage
@@ -79,6 +111,7 @@ class DirectMessageCreateSerializer(serializers.ModelSerializer):
 class DirectMessageSerializer(serializers.ModelSerializer):
     sender = UserProfileSerializer(read_only=True)
     conversation_id = serializers.UUIDField(source="conversation.id", read_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = DirectMessage
@@ -99,6 +132,17 @@ class DirectMessageSerializer(serializers.ModelSerializer):
         # data["content"] = "[Message deleted]"
         return data
 
+    def get_is_read(self, obj):
+        # Read state comes from the recipient's watermark on the conversation
+        return obj.conversation.is_read(obj)
+
+
+class DirectMessageSearchResultSerializer(DirectMessageSerializer):
+    highlight = serializers.CharField(read_only=True)
+
+    class Meta(DirectMessageSerializer.Meta):
+        fields = DirectMessageSerializer.Meta.fields + ["highlight"]
+
 
 User = get_user_model()
 
@@ -142,6 +186,7 @@ class DirectMessageConversationSerializer(serializers.ModelSerializer):
     participant2 = UserProfileSerializer(read_only=True)
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
+    last_read_at = serializers.SerializerMethodField()
 
     class Meta:
         model = DirectMessageConversation
@@ -151,6 +196,7 @@ class DirectMessageConversationSerializer(serializers.ModelSerializer):
             "participant2",
             "last_message",
             "unread_count",
+            "last_read_at",
             "created_at",
             "updated_at",
         ]
@@ -158,15 +204,30 @@ class DirectMessageConversationSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "created_at", "updated_at"]
 
     def get_last_message(self, obj):
-        last_message = obj.messages.first()  # Due to ordering = ['-created_at']
+        # Conversations from with_inbox_data() have the latest message prefetched
+        if hasattr(obj, "latest_messages"):
+            last_message = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_message = obj.messages.first()  # Due to ordering = ['-created_at']
         if last_message:
-            return DirectMessageSerializer(last_message).data
+            return self.last_message_serializer.to_representation(last_message)
         return None
 
+    @cached_property
+    def last_message_serializer(self):
+        # One for the whole inbox; building a serializer's fields costs more
+        # than serializing a message
+        return DirectMessageSerializer()
+
     def get_unread_count(self, obj):
         request = self.context.get("request")
-        if request and request.user.is_authenticated:
-            return (
-                obj.messages.filter(is_read=False).exclude(sender=request.user).count()
-            )
+        if request and obj.is_participant(request.user):
+            return obj.get_unread_count(request.user)
         return 0
+
+    def get_last_read_at(self, obj):
+        request = self.context.get("request")
+        if request and obj.is_participant(request.user):
+            last_read_at = obj.get_last_read_at(request.user)
+            return serializers.DateTimeField().to_representation(last_read_at)
+        return None
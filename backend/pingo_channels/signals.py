@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db import connections
+from django.db.models.signals import post_migrate, post_save
 from django.dispatch import receiver
 from servers.models import Server
-from .models import Channel
+from .models import Channel, DirectMessage, Message
+from .search import repair_sqlite_search_indexes
 
 
 @receiver(post_save, sender=Server)
@@ -16,3 +18,15 @@ def create_default_channel(sender, instance, created, **kwargs):
             server=instance,
             created_by=instance.owner,
         )
+
+
+@receiver(post_migrate)
+def repair_search_indexes(sender, using, **kwargs):
+    """
+    Put back the SQLite search triggers that a migration rebuilding the
+    message tables dropped, and reindex those tables
+    """
+    connection = connections[using]
+    if sender.name != "pingo_channels" or connection.vendor != "sqlite":
+        return
+    repair_sqlite_search_indexes(connection, [Message, DirectMessage])
@@ -0,0 +1,17 @@
+import os
+import redis
+
+# Tests that broadcast over the channel layer run on the in-memory layer
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+}
+
+# Tests that need a real Redis server are skipped unless one is reachable here
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5).ping()
+    except redis.RedisError:
+        return False
@@ -0,0 +1,240 @@
+# pingo_channels/tests/test_access.py
+
+from unittest import mock
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from servers.models import Server, ServerMembership
+from pingo_channels.access import (
+    ACCESS_REVOKED_CLOSE_CODE,
+    channel_roles_event,
+    membership_event,
+)
+from pingo_channels.encoding import chat_message_event
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
+from pingo_project.asgi import application
+
+User = get_user_model()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AccessChangeTests(TransactionTestCase):
+    """Test that open sockets follow role and channel permission changes"""
+
+    def setUp(self):
+        """Set up a server with a moderator and an announcements channel"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.moderator = User.objects.create_user(
+            email="moderator@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.moderator, server=self.server, role="moderator"
+        )
+        self.channel = self.server.channels.create(
+            name="announcements", min_message_role="moderator"
+        )
+
+    async def connect_chat(self):
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/"
+            f"?token={AccessToken.for_user(self.moderator)}",
+        )
+        await communicator.connect()
+        frame = await communicator.receive_json_from()
+        self.assertTrue(frame["permissions"]["can_post"])
+        return communicator
+
+    async def send_event(self, event):
+        await get_channel_layer().group_send(event["group"], event)
+
+    async def test_role_change_updates_permissions(self):
+        """Test that a demoted member loses posting rights without reconnecting"""
+        communicator = await self.connect_chat()
+
+        await self.send_event(
+            membership_event(self.server.id, self.moderator.id, "member")
+        )
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "permissions_updated")
+        self.assertEqual(frame["role"], "member")
+        self.assertFalse(frame["permissions"]["can_post"])
+
+        await communicator.send_json_to({"type": "chat_message", "content": "Hi"})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "error")
+        self.assertIn("permission", frame["message"])
+        await communicator.disconnect()
+
+    async def test_removed_member_is_evicted(self):
+        """Test that a removed member's socket is closed"""
+        communicator = await self.connect_chat()
+
+        await self.send_event(membership_event(self.server.id, self.moderator.id, None))
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "access_revoked")
+        self.assertEqual(frame["channel_id"], str(self.channel.id))
+        output = await communicator.receive_output()
+        self.assertEqual(output["type"], "websocket.close")
+        self.assertEqual(output["code"], ACCESS_REVOKED_CLOSE_CODE)
+
+    async def test_channel_roles_change_updates_permissions(self):
+        """Test that raising a channel's minimum roles is applied to open sockets"""
+        communicator = await self.connect_chat()
+        self.channel.min_view_role = "admin"
+
+        await self.send_event(channel_roles_event(self.channel))
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "access_revoked")
+        output = await communicator.receive_output()
+        self.assertEqual(output["code"], ACCESS_REVOKED_CLOSE_CODE)
+
+    async def test_gateway_drops_only_revoked_channel(self):
+        """Test that the gateway unsubscribes a channel it can no longer view"""
+        general = await self.server.channels.aget(name="general")
+        gateway = WebsocketCommunicator(
+            application, f"/ws/gateway/?token={AccessToken.for_user(self.moderator)}"
+        )
+        await gateway.connect()
+        await gateway.receive_json_from()
+        for channel in [general, self.channel]:
+            await gateway.send_json_to(
+                {
+                    "type": "subscribe",
+                    "server_id": str(self.server.id),
+                    "channel_id": str(channel.id),
+                }
+            )
+            await gateway.receive_json_from()
+
+        self.channel.min_view_role = "admin"
+        await self.send_event(channel_roles_event(self.channel))
+
+        frame = await gateway.receive_json_from()
+        self.assertEqual(frame["type"], "access_revoked")
+        self.assertEqual(frame["channel_id"], str(self.channel.id))
+
+        # Still subscribed to the channel it can view
+        await self.send_event(
+            membership_event(self.server.id, self.moderator.id, "admin")
+        )
+        frame = await gateway.receive_json_from()
+        self.assertEqual(frame["type"], "permissions_updated")
+        self.assertEqual(frame["channel_id"], str(general.id))
+        self.assertTrue(await gateway.receive_nothing())
+        await gateway.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, PINGO_ACCESS_RECHECK_SECONDS=0.05
+)
+class LostAccessEventTests(TransactionTestCase):
+    """Test that sockets re-read access changes whose events were lost"""
+
+    def setUp(self):
+        """Set up a server with a moderator and an announcements channel"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.moderator = User.objects.create_user(
+            email="moderator@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.membership = ServerMembership.objects.create(
+            user=self.moderator, server=self.server, role="moderator"
+        )
+        self.channel = self.server.channels.create(
+            name="announcements", min_message_role="moderator"
+        )
+        self.group = f"chat_{self.server.id}_{self.channel.id}"
+
+    async def connect_chat(self):
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/"
+            f"?token={AccessToken.for_user(self.moderator)}",
+        )
+        await communicator.connect()
+        frame = await communicator.receive_json_from()
+        self.assertTrue(frame["permissions"]["can_post"])
+        return communicator
+
+    async def test_unchanged_access_sends_nothing(self):
+        """Test that a re-check finding nothing new stays silent"""
+        communicator = await self.connect_chat()
+
+        self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+        await communicator.disconnect()
+
+    async def test_demotion_applied_without_event(self):
+        """Test that a demoted member cannot post though no event arrived"""
+        communicator = await self.connect_chat()
+        self.membership.role = "member"
+        await self.membership.asave()
+
+        frame = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(frame["type"], "permissions_updated")
+        self.assertFalse(frame["permissions"]["can_post"])
+        await communicator.send_json_to({"type": "chat_message", "content": "Hi"})
+        frame = await communicator.receive_json_from()
+        self.assertIn("permission", frame["message"])
+        await communicator.disconnect()
+
+    async def test_removed_member_evicted_without_event(self):
+        """Test that a removed member's socket is closed"""
+        communicator = await self.connect_chat()
+        await self.membership.adelete()
+
+        frame = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(frame["type"], "access_revoked")
+        output = await communicator.receive_output()
+        self.assertEqual(output["code"], ACCESS_REVOKED_CLOSE_CODE)
+
+    async def test_gateway_drops_channel_without_event(self):
+        """Test that the gateway drops a channel whose roles were raised"""
+        gateway = WebsocketCommunicator(
+            application, f"/ws/gateway/?token={AccessToken.for_user(self.moderator)}"
+        )
+        await gateway.connect()
+        await gateway.receive_json_from()
+        await gateway.send_json_to(
+            {
+                "type": "subscribe",
+                "server_id": str(self.server.id),
+                "channel_id": str(self.channel.id),
+            }
+        )
+        await gateway.receive_json_from()
+        self.channel.min_view_role = "admin"
+        await self.channel.asave()
+
+        frame = await gateway.receive_json_from(timeout=1)
+        self.assertEqual(frame["type"], "access_revoked")
+        self.assertEqual(frame["channel_id"], str(self.channel.id))
+        self.assertTrue(await gateway.receive_nothing(timeout=0.3))
+        await gateway.disconnect()
+
+    @override_settings(PINGO_ACCESS_RECHECK_SECONDS=60)
+    async def test_broadcast_does_not_query(self):
+        """Test that a broadcast is queued without re-reading access"""
+        communicator = await self.connect_chat()
+
+        with mock.patch(
+            "pingo_channels.consumers.reload_channel_access"
+        ) as reload_channel_access:
+            await get_channel_layer().group_send(
+                self.group,
+                chat_message_event(self.server.id, self.channel.id, {"content": "Hi"}),
+            )
+            frame = await communicator.receive_json_from()
+        self.assertEqual(frame["message"]["content"], "Hi")
+        reload_channel_access.assert_not_called()
+        await communicator.disconnect()
@@ -0,0 +1,108 @@
+# pingo_channels/tests/test_channel_layers.py
+
+import os
+import runpy
+from unittest import mock, skipUnless
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from servers.models import Server, ServerMembership
+from pingo_channels.access import ACCESS_REVOKED_CLOSE_CODE, membership_event
+from pingo_channels.tests import REDIS_URL, redis_available
+from pingo_project.asgi import application
+
+User = get_user_model()
+
+PUBSUB_CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+        "CONFIG": {"hosts": [REDIS_URL]},
+    }
+}
+
+
+class ChannelLayerSettingTests(SimpleTestCase):
+    """Test the choice of channel layer in settings"""
+
+    def load_settings(self, fanout):
+        with mock.patch.dict(os.environ, {"PINGO_CHANNEL_LAYER_FANOUT": fanout}):
+            return runpy.run_path(settings.BASE_DIR / "pingo_project" / "settings.py")
+
+    def test_fanout_selects_layer(self):
+        """Test that each fan-out mode picks its Redis layer"""
+        self.assertEqual(
+            self.load_settings("socket")["CHANNEL_LAYERS"]["default"]["BACKEND"],
+            "channels_redis.core.RedisChannelLayer",
+        )
+        self.assertEqual(
+            self.load_settings("worker")["CHANNEL_LAYERS"]["default"]["BACKEND"],
+            "channels_redis.pubsub.RedisPubSubChannelLayer",
+        )
+
+    def test_unknown_fanout_is_rejected(self):
+        """Test that a misspelt fan-out mode fails instead of falling back"""
+        with self.assertRaisesMessage(ImproperlyConfigured, "'workers'"):
+            self.load_settings("workers")
+
+
+@skipUnless(redis_available(), f"Redis is not reachable at {REDIS_URL}")
+@override_settings(CHANNEL_LAYERS=PUBSUB_CHANNEL_LAYERS)
+class PubSubConsumerTests(TransactionTestCase):
+    """Test the consumers over the Redis pub/sub channel layer"""
+
+    def setUp(self):
+        """Set up a server with a member"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.channel = self.server.channels.get(name="general")
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/"
+            f"?token={AccessToken.for_user(user)}",
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+        return communicator
+
+    async def test_message_reaches_other_socket(self):
+        """Test that a posted message is broadcast with its sequence number"""
+        owner = await self.connect(self.owner)
+        member = await self.connect(self.member)
+
+        await owner.send_json_to({"type": "chat_message", "content": "Hello"})
+
+        for communicator in [owner, member]:
+            frame = await communicator.receive_json_from(timeout=5)
+            self.assertEqual(frame["type"], "chat_message")
+            self.assertEqual(frame["message"]["content"], "Hello")
+            self.assertEqual(frame["seq"], 1)
+        await owner.disconnect()
+        await member.disconnect()
+
+    async def test_access_event_reaches_socket(self):
+        """Test that a removed member's socket is closed"""
+        member = await self.connect(self.member)
+        event = membership_event(self.server.id, self.member.id, None)
+
+        await get_channel_layer().group_send(event["group"], event)
+
+        frame = await member.receive_json_from(timeout=5)
+        self.assertEqual(frame["type"], "access_revoked")
+        output = await member.receive_output(timeout=5)
+        self.assertEqual(output["code"], ACCESS_REVOKED_CLOSE_CODE)
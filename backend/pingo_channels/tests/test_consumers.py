@@ -0,0 +1,407 @@
+# pingo_channels/tests/test_consumers.py
+
+from unittest.mock import patch
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from common import metrics
+from rest_framework_simplejwt.tokens import AccessToken
+from servers.models import Server, ServerMembership
+from pingo_channels.consumers import GatewayConsumer
+from pingo_channels.models import Channel, DirectMessageConversation
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
+from pingo_project.asgi import application
+
+User = get_user_model()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerAuthTests(TransactionTestCase):
+    """Test handshake and first-frame authentication for ChatConsumer"""
+
+    def setUp(self):
+        """Set up a server with a member and an outsider"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.outsider = User.objects.create_user(
+            email="outsider@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.channel = self.server.channels.get(name="general")
+        self.path = f"/ws/chat/{self.server.id}/{self.channel.id}/"
+
+    def token_for(self, user):
+        return str(AccessToken.for_user(user))
+
+    async def test_query_string_token_authenticates_at_handshake(self):
+        """Test that a token in the query string skips the auth frame"""
+        communicator = WebsocketCommunicator(
+            application, f"{self.path}?token={self.token_for(self.member)}"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+        self.assertEqual(response["membership"]["role"], "member")
+        self.assertTrue(response["permissions"]["can_post"])
+
+        await communicator.disconnect()
+
+    async def test_subprotocol_token_authenticates_at_handshake(self):
+        """Test that the access_token subprotocol pair authenticates"""
+        communicator = WebsocketCommunicator(
+            application,
+            self.path,
+            subprotocols=["access_token", self.token_for(self.member)],
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "access_token")
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+
+        await communicator.disconnect()
+
+    async def test_invalid_handshake_token_falls_back_to_auth_frame(self):
+        """Test that a bad handshake token still allows first-frame auth"""
+        communicator = WebsocketCommunicator(application, f"{self.path}?token=bad")
+        await communicator.connect()
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_required")
+
+        await communicator.send_json_to(
+            {"type": "auth", "token": self.token_for(self.member)}
+        )
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+
+        await communicator.disconnect()
+
+    async def test_first_frame_invalid_token(self):
+        """Test that an invalid first-frame token is rejected"""
+        communicator = WebsocketCommunicator(application, self.path)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({"type": "auth", "token": "bad"})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_error")
+        self.assertIn("Invalid or expired token", response["message"])
+
+        await communicator.disconnect()
+
+    async def test_handshake_token_non_member_rejected(self):
+        """Test that authentication still requires server membership"""
+        communicator = WebsocketCommunicator(
+            application, f"{self.path}?token={self.token_for(self.outsider)}"
+        )
+        await communicator.connect()
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_error")
+        self.assertEqual(response["message"], "You are not a member of this server")
+
+        await communicator.disconnect()
+
+    async def test_unknown_channel_rejected(self):
+        """Test that a channel from the wrong server is rejected"""
+        path = f"/ws/chat/{self.server.id}/12345678-1234-5678-9012-123456789012/"
+        communicator = WebsocketCommunicator(
+            application, f"{path}?token={self.token_for(self.member)}"
+        )
+        await communicator.connect()
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_error")
+        self.assertEqual(response["message"], "Channel not found in this server")
+
+        await communicator.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    PINGO_METRICS_BACKEND="common.metrics.InMemoryMetrics",
+)
+class ChatConsumerMetricsTests(TransactionTestCase):
+    """Test that ChatConsumer records per-stage, per-channel timings"""
+
+    def setUp(self):
+        """Set up a channel owner"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.channel = self.server.channels.get(name="general")
+
+    async def test_message_stages_are_timed(self):
+        """Test the stages of posting and delivering a message"""
+        token = str(AccessToken.for_user(self.owner))
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/?token={token}",
+        )
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({"type": "chat_message", "content": "Hi"})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        output = metrics.get_metrics().render()
+        label = f'channel="{self.channel.id}"'
+        for stage in [
+            "channel_access_check",
+            "chat_authorize",
+            "chat_db_write",
+            "chat_serialize",
+            "chat_group_send",
+            "chat_handle_message",
+            "chat_send",
+        ]:
+            self.assertIn(f"pingo_{stage}_seconds_count{{{label}}} 1", output)
+        self.assertIn(f"pingo_chat_frames_sent_total{{{label}}} 1", output)
+        self.assertIn("pingo_ws_authenticate_seconds_count 1", output)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DirectMessageConsumerAuthTests(TransactionTestCase):
+    """Test handshake authentication for DirectMessageConsumer"""
+
+    def setUp(self):
+        """Set up a conversation and an outsider"""
+        self.user1 = User.objects.create_user(
+            email="user1@test.com", password="testpass123", display_name="User One"
+        )
+        self.user2 = User.objects.create_user(
+            email="user2@test.com", password="testpass123", display_name="User Two"
+        )
+        self.outsider = User.objects.create_user(
+            email="outsider@test.com", password="testpass123"
+        )
+        self.conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            self.user1, self.user2
+        )
+        self.path = f"/ws/chat/direct/{self.conversation.id}/"
+
+    async def test_query_string_token_authenticates_at_handshake(self):
+        """Test that a participant is authenticated from the handshake token"""
+        token = str(AccessToken.for_user(self.user1))
+        communicator = WebsocketCommunicator(application, f"{self.path}?token={token}")
+        await communicator.connect()
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+        self.assertEqual(response["other_participant"]["display_name"], "User Two")
+
+        await communicator.disconnect()
+
+    async def test_non_participant_rejected(self):
+        """Test that only participants can join the conversation"""
+        token = str(AccessToken.for_user(self.outsider))
+        communicator = WebsocketCommunicator(application, f"{self.path}?token={token}")
+        await communicator.connect()
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_error")
+
+        await communicator.disconnect()
+
+    async def test_mark_read_sends_read_receipt(self):
+        """Test that marking read tells both participants"""
+        sockets = []
+        for user in [self.user1, self.user2]:
+            token = str(AccessToken.for_user(user))
+            communicator = WebsocketCommunicator(
+                application, f"{self.path}?token={token}"
+            )
+            await communicator.connect()
+            await communicator.receive_json_from()
+            sockets.append(communicator)
+        user1, user2 = sockets
+
+        await user1.send_json_to({"type": "direct_message", "content": "Hi"})
+        message = (await user2.receive_json_from())["message"]
+        await user1.receive_json_from()
+
+        await user2.send_json_to({"type": "mark_read", "message_id": message["id"]})
+        response = await user1.receive_json_from()
+        self.assertEqual(response["type"], "read_receipt")
+        self.assertEqual(response["user_id"], str(self.user2.id))
+        conversation = await database_sync_to_async(
+            DirectMessageConversation.objects.get
+        )(pk=self.conversation.pk)
+        self.assertEqual(conversation.get_unread_count(self.user2), 0)
+
+        for communicator in sockets:
+            await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class GatewayConsumerTests(TransactionTestCase):
+    """Test subscribing to many channels and conversations over one socket"""
+
+    def setUp(self):
+        """Set up two channels, an admin-only channel and a conversation"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123", display_name="Owner"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123", display_name="Member"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.general = self.server.channels.get(name="general")
+        self.random = Channel.objects.create(name="random", server=self.server)
+        self.admin_only = Channel.objects.create(
+            name="admins", server=self.server, min_view_role="admin"
+        )
+        self.conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            self.owner, self.member
+        )
+
+    def channel_target(self, channel):
+        return {"server_id": str(self.server.id), "channel_id": str(channel.id)}
+
+    async def connect(self, user):
+        token = str(AccessToken.for_user(user))
+        communicator = WebsocketCommunicator(application, f"/ws/gateway/?token={token}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+        return communicator
+
+    async def subscribe(self, communicator, target):
+        await communicator.send_json_to({"type": "subscribe", **target})
+        return await communicator.receive_json_from()
+
+    async def test_receives_broadcasts_from_many_targets(self):
+        """Test that one socket receives messages from every subscription"""
+        member = await self.connect(self.member)
+        owner = await self.connect(self.owner)
+        dm_target = {"conversation_id": str(self.conversation.id)}
+
+        for target in [
+            self.channel_target(self.general),
+            self.channel_target(self.random),
+            dm_target,
+        ]:
+            response = await self.subscribe(member, target)
+            self.assertEqual(response["type"], "subscribed")
+            await self.subscribe(owner, target)
+
+        await owner.send_json_to(
+            {
+                "type": "chat_message",
+                **self.channel_target(self.random),
+                "content": "Hello random",
+            }
+        )
+        response = await member.receive_json_from()
+        self.assertEqual(response["type"], "chat_message")
+        self.assertEqual(response["channel_id"], str(self.random.id))
+        self.assertEqual(response["message"]["content"], "Hello random")
+
+        await owner.send_json_to(
+            {"type": "direct_message", **dm_target, "content": "Hello DM"}
+        )
+        response = await member.receive_json_from()
+        self.assertEqual(response["type"], "direct_message")
+        self.assertEqual(response["conversation_id"], str(self.conversation.id))
+        self.assertEqual(response["message"]["content"], "Hello DM")
+
+        await member.disconnect()
+        await owner.disconnect()
+
+    async def test_receives_broadcasts_from_channel_consumer(self):
+        """Test that gateway sockets share groups with per-channel sockets"""
+        member = await self.connect(self.member)
+        await self.subscribe(member, self.channel_target(self.general))
+
+        token = str(AccessToken.for_user(self.owner))
+        owner = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.general.id}/?token={token}",
+        )
+        await owner.connect()
+        await owner.receive_json_from()
+        await owner.send_json_to({"type": "chat_message", "content": "Hi"})
+
+        response = await member.receive_json_from()
+        self.assertEqual(response["type"], "chat_message")
+        self.assertEqual(response["server_id"], str(self.server.id))
+        self.assertEqual(response["channel_id"], str(self.general.id))
+
+        await member.disconnect()
+        await owner.disconnect()
+
+    async def test_subscribe_requires_view_permission(self):
+        """Test that channel permissions are checked on subscribe"""
+        member = await self.connect(self.member)
+
+        response = await self.subscribe(member, self.channel_target(self.admin_only))
+        self.assertEqual(response["type"], "error")
+        self.assertEqual(response["channel_id"], str(self.admin_only.id))
+
+        await member.disconnect()
+
+    async def test_unsubscribe_stops_delivery(self):
+        """Test that unsubscribed targets no longer deliver messages"""
+        member = await self.connect(self.member)
+        owner = await self.connect(self.owner)
+        target = self.channel_target(self.general)
+        await self.subscribe(member, target)
+        await self.subscribe(owner, target)
+
+        await member.send_json_to({"type": "unsubscribe", **target})
+        response = await member.receive_json_from()
+        self.assertEqual(response["type"], "unsubscribed")
+
+        await owner.send_json_to(
+            {"type": "chat_message", **target, "content": "Anyone there?"}
+        )
+        await owner.receive_json_from()
+        self.assertTrue(await member.receive_nothing())
+
+        await member.disconnect()
+        await owner.disconnect()
+
+    async def test_post_requires_subscription(self):
+        """Test that messages can only be sent to subscribed targets"""
+        member = await self.connect(self.member)
+
+        await member.send_json_to(
+            {
+                "type": "chat_message",
+                **self.channel_target(self.general),
+                "content": "Hello",
+            }
+        )
+        response = await member.receive_json_from()
+        self.assertEqual(response["type"], "error")
+
+        await member.disconnect()
+
+    async def test_subscription_limit(self):
+        """Test that a socket cannot subscribe to unlimited targets"""
+        member = await self.connect(self.member)
+
+        with patch.object(GatewayConsumer, "MAX_SUBSCRIPTIONS", 1):
+            await self.subscribe(member, self.channel_target(self.general))
+            response = await self.subscribe(member, self.channel_target(self.random))
+
+        self.assertEqual(response["type"], "error")
+
+        await member.disconnect()
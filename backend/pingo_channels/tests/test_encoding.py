@@ -0,0 +1,116 @@
+# pingo_channels/tests/test_encoding.py
+
+import json
+import uuid
+from datetime import date
+from types import SimpleNamespace
+from unittest import skipIf
+from unittest.mock import patch
+from django.utils import timezone
+from django.test import SimpleTestCase
+from pingo_channels import encoding
+
+
+class EncodeFrameTests(SimpleTestCase):
+    """Test JSON encoding of outbound frames"""
+
+    def test_json_fallback_matches_orjson(self):
+        """Test that both backends produce equivalent JSON"""
+        payload = {"type": "chat_message", "message": {"id": "1", "content": "hé"}}
+
+        with patch.object(encoding, "orjson", None):
+            fallback = encoding.encode_frame(payload)
+
+        self.assertIsInstance(fallback, str)
+        self.assertEqual(json.loads(fallback), payload)
+        if encoding.orjson is not None:
+            self.assertEqual(json.loads(encoding.encode_frame(payload)), payload)
+
+    @skipIf(encoding.orjson is None, "orjson is not installed")
+    def test_json_fallback_writes_same_text_as_orjson(self):
+        """Test that both backends encode non-ASCII, dates and UUIDs alike"""
+        payload = {
+            "seq": 1,
+            "message": {
+                "id": uuid.uuid4(),
+                "content": "hé \u2603 \x00",
+                "created_at": timezone.now(),
+                "day": date(2024, 2, 29),
+                "is_deleted": False,
+                "edited_at": None,
+                "reactions": [1, 2.5],
+            },
+        }
+
+        with patch.object(encoding, "orjson", None):
+            fallback = encoding.encode_frame(payload)
+
+        self.assertEqual(fallback, encoding.encode_frame(payload))
+
+    def test_non_json_types_are_stringified(self):
+        """Test that UUIDs and similar values do not break encoding"""
+        value = uuid.uuid4()
+
+        self.assertEqual(
+            json.loads(encoding.encode_frame({"id": value})), {"id": str(value)}
+        )
+
+    def test_chat_message_event(self):
+        """Test that the event carries the ready-to-send frame"""
+        server_id, channel_id = uuid.uuid4(), uuid.uuid4()
+
+        event = encoding.chat_message_event(server_id, channel_id, {"id": "1"})
+
+        self.assertEqual(event["type"], "chat_message_broadcast")
+        self.assertEqual(
+            json.loads(event["text"]),
+            {
+                "type": "chat_message",
+                "server_id": str(server_id),
+                "channel_id": str(channel_id),
+                "message": {"id": "1"},
+            },
+        )
+
+    def test_chat_message_event_sequence(self):
+        """Test that a sequence number is carried in the frame when given"""
+        event = encoding.chat_message_event(uuid.uuid4(), uuid.uuid4(), {}, seq=7)
+
+        self.assertEqual(json.loads(event["text"])["seq"], 7)
+
+    def test_message_update_event_hides_deleted_content(self):
+        """Test that a deletion delta does not carry the old content"""
+        message = SimpleNamespace(
+            id=uuid.uuid4(),
+            content="secret",
+            updated_at=timezone.now(),
+            is_deleted=True,
+        )
+
+        event = encoding.message_update_event(
+            uuid.uuid4(), uuid.uuid4(), message, seq=3
+        )
+
+        self.assertEqual(event["type"], "message_update_broadcast")
+        frame = json.loads(event["text"])
+        self.assertEqual(
+            frame["message"],
+            {
+                "id": str(message.id),
+                "content": None,
+                "edited_at": message.updated_at.isoformat(),
+                "is_deleted": True,
+            },
+        )
+        self.assertEqual(frame["seq"], 3)
+
+    def test_direct_message_event(self):
+        """Test the direct message event frame"""
+        conversation_id = uuid.uuid4()
+
+        event = encoding.direct_message_event(conversation_id, {"id": "1"})
+
+        self.assertEqual(event["type"], "direct_message_broadcast")
+        self.assertEqual(
+            json.loads(event["text"])["conversation_id"], str(conversation_id)
+        )
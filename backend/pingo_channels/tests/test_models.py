@@ -1,11 +1,19 @@
 # pingo_channels/tests/test_models.py
 
+from datetime import timedelta
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.utils import timezone
 from servers.models import Server, ServerMembership
-from pingo_channels.models import Channel, Message
+from pingo_channels.models import (
+    Channel,
+    Message,
+    DirectMessage,
+    DirectMessageConversation,
+)
 from django.db.models.signals import post_save
 
 User = get_user_model()
@@ -295,6 +303,50 @@ class ChannelPermissionTests(TestCase):
         self.assertTrue(admin_perms["can_read"])
         self.assertTrue(admin_perms["can_post"])
 
+    def test_with_role_permissions_matches_get_user_permissions(self):
+        """Test that the annotated evaluator agrees with the per-channel check"""
+        roles = ["member", "moderator", "admin", "owner"]
+        for view_role in roles:
+            for message_role in roles:
+                Channel.objects.create(
+                    name=f"{view_role}-{message_role}",
+                    server=self.server,
+                    min_view_role=view_role,
+                    min_read_role=view_role,
+                    min_message_role=message_role,
+                )
+
+        for user in [
+            self.owner,
+            self.admin,
+            self.moderator,
+            self.member,
+            self.outsider,
+        ]:
+            role = ServerMembership.get_role(user, self.server.id)
+            with self.subTest(role=role):
+                for channel in self.server.channels.with_role_permissions(role):
+                    self.assertEqual(
+                        {
+                            "can_view": channel.can_view,
+                            "can_read": channel.can_read,
+                            "can_post": channel.can_post,
+                        },
+                        channel.get_user_permissions(user),
+                    )
+
+    def test_with_role_permissions_single_query(self):
+        """Test that one query evaluates permissions for every channel"""
+        for i in range(5):
+            Channel.objects.create(name=f"channel-{i}", server=self.server)
+
+        with self.assertNumQueries(1):
+            flags = [
+                channel.can_view
+                for channel in self.server.channels.with_role_permissions("member")
+            ]
+        self.assertTrue(all(flags))
+
 
 class MessageModelTests(TestCase):
     """Test Message model functionality"""
@@ -463,3 +515,166 @@ class ChannelSignalTests(TestCase):
         # Each server should have a general channel
         self.assertTrue(Channel.objects.filter(server=server1, name="general").exists())
         self.assertTrue(Channel.objects.filter(server=server2, name="general").exists())
+
+
+class DirectMessageReadWatermarkTests(TestCase):
+    """Test per-participant read watermarks on DirectMessageConversation"""
+
+    def setUp(self):
+        """Set up a conversation between two users"""
+        self.alice = User.objects.create_user(
+            email="alice@test.com", password="testpass123"
+        )
+        self.bob = User.objects.create_user(
+            email="bob@test.com", password="testpass123"
+        )
+        self.conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            self.alice, self.bob
+        )
+
+    def send(self, sender, content="Hello"):
+        return DirectMessage.objects.create(
+            conversation=self.conversation, sender=sender, content=content
+        )
+
+    def test_new_message_counts_as_unread_for_recipient_only(self):
+        """Test that sending bumps the recipient's unread count"""
+        self.send(self.alice)
+        self.send(self.alice)
+        self.send(self.bob)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.get_unread_count(self.bob), 2)
+        self.assertEqual(self.conversation.get_unread_count(self.alice), 1)
+
+    def test_mark_read_up_to_message(self):
+        """Test that messages after the watermark stay unread"""
+        first = self.send(self.alice, "First")
+        second = self.send(self.alice, "Second")
+
+        self.assertTrue(self.conversation.mark_read(self.bob, up_to=first))
+
+        self.assertEqual(self.conversation.get_last_read_at(self.bob), first.created_at)
+        self.assertEqual(self.conversation.get_unread_count(self.bob), 1)
+        self.assertTrue(self.conversation.is_read(first))
+        self.assertFalse(self.conversation.is_read(second))
+
+    def test_mark_read_never_moves_backwards(self):
+        """Test that an older watermark does not unread messages"""
+        first = self.send(self.alice, "First")
+        self.send(self.alice, "Second")
+        self.conversation.mark_read(self.bob)
+
+        self.assertFalse(self.conversation.mark_read(self.bob, up_to=first))
+        self.assertEqual(self.conversation.get_unread_count(self.bob), 0)
+
+    def test_mark_large_backlog_read_in_one_update(self):
+        """Test that marking read costs the same however many messages it covers"""
+        DirectMessage.objects.bulk_create(
+            DirectMessage(
+                conversation=self.conversation, sender=self.alice, content="x"
+            )
+            for _ in range(500)
+        )
+
+        with self.assertNumQueries(2):  # UPDATE, then reload the two fields
+            self.conversation.mark_read(self.bob)
+
+        self.assertEqual(self.conversation.get_unread_count(self.bob), 0)
+
+    def test_non_participant(self):
+        """Test that outsiders have no watermark"""
+        outsider = User.objects.create_user(
+            email="outsider@test.com", password="testpass123"
+        )
+
+        with self.assertRaises(ValueError):
+            self.conversation.get_unread_count(outsider)
+
+
+class DirectMessageConversationBumpTests(TestCase):
+    """Test how new direct messages update their conversation"""
+
+    def setUp(self):
+        """Set up two conversations sharing a participant"""
+        self.alice = User.objects.create_user(
+            email="alice@test.com", password="testpass123"
+        )
+        self.bob = User.objects.create_user(
+            email="bob@test.com", password="testpass123"
+        )
+        self.carol = User.objects.create_user(
+            email="carol@test.com", password="testpass123"
+        )
+        self.with_bob, _ = DirectMessageConversation.get_or_create_conversation(
+            self.alice, self.bob
+        )
+        self.with_carol, _ = DirectMessageConversation.get_or_create_conversation(
+            self.alice, self.carol
+        )
+
+    def test_send_costs_one_conversation_update(self):
+        """Test that a new message is an INSERT plus a single UPDATE"""
+        with self.assertNumQueries(2):
+            message = DirectMessage.objects.create(
+                conversation=self.with_bob, sender=self.alice, content="Hi"
+            )
+
+        self.assertEqual(self.with_bob.updated_at, message.created_at)
+        self.assertEqual(self.with_bob.get_unread_count(self.bob), 1)
+        self.with_bob.refresh_from_db()
+        self.assertEqual(self.with_bob.updated_at, message.created_at)
+        self.assertEqual(self.with_bob.get_unread_count(self.bob), 1)
+
+    def test_updated_at_never_moves_backwards(self):
+        """Test that a late write cannot make a conversation look older"""
+        future = timezone.now() + timedelta(hours=1)
+        DirectMessageConversation.objects.filter(pk=self.with_bob.pk).update(
+            updated_at=future
+        )
+
+        DirectMessage.objects.create(
+            conversation_id=self.with_bob.pk, sender=self.alice, content="Hi"
+        )
+
+        self.with_bob.refresh_from_db()
+        self.assertEqual(self.with_bob.updated_at, future)
+        self.assertEqual(self.with_bob.get_unread_count(self.bob), 1)
+
+    def test_editing_does_not_bump_conversation(self):
+        """Test that only new messages count as activity"""
+        message = DirectMessage.objects.create(
+            conversation=self.with_bob, sender=self.bob, content="Hi"
+        )
+
+        message.content = "Edited"
+        with self.assertNumQueries(1):
+            message.save()
+
+        self.with_bob.refresh_from_db()
+        self.assertEqual(self.with_bob.get_unread_count(self.alice), 1)
+
+    def test_bulk_create_updates_each_conversation_once(self):
+        """Test that a batch costs one UPDATE per conversation"""
+        messages = [
+            DirectMessage(conversation=self.with_bob, sender=self.bob, content="1"),
+            DirectMessage(conversation=self.with_bob, sender=self.alice, content="2"),
+            DirectMessage(conversation=self.with_bob, sender=self.bob, content="3"),
+            DirectMessage(conversation=self.with_carol, sender=self.carol, content="4"),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            DirectMessage.objects.bulk_create(messages)
+
+        updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+
+        self.with_bob.refresh_from_db()
+        self.with_carol.refresh_from_db()
+        self.assertEqual(self.with_bob.get_unread_count(self.alice), 2)
+        self.assertEqual(self.with_bob.get_unread_count(self.bob), 1)
+        self.assertEqual(self.with_carol.get_unread_count(self.alice), 1)
+        self.assertEqual(self.with_carol.get_unread_count(self.carol), 0)
+        self.assertEqual(
+            self.with_bob.updated_at, max(m.created_at for m in messages[:3])
+        )
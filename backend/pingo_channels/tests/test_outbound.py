@@ -0,0 +1,110 @@
+# pingo_channels/tests/test_outbound.py
+
+import asyncio
+import json
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from common import metrics
+from pingo_channels.encoding import (
+    chat_message_event,
+    presence_event,
+    read_receipt_event,
+)
+from pingo_channels.outbound import OutboundQueue, SLOW_CONSUMER_CLOSE_CODE
+
+SEND_QUEUES = {
+    "chat_*": {"capacity": 2, "policy": "disconnect"},
+    "direct_message_conversation_*": {"capacity": 2, "policy": "drop_oldest"},
+    "presence_*": {"capacity": 2, "policy": "coalesce"},
+}
+
+
+class SlowSocket:
+    """Records frames, sending none until released"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.released = asyncio.Event()
+
+    async def send(self, text_data):
+        await self.released.wait()
+        self.sent.append(json.loads(text_data))
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+@override_settings(
+    PINGO_SEND_QUEUES=SEND_QUEUES,
+    PINGO_METRICS_BACKEND="common.metrics.InMemoryMetrics",
+)
+class OutboundQueueTests(SimpleTestCase):
+    """Test the per-socket queue policies for slow clients"""
+
+    def setUp(self):
+        self.socket = SlowSocket()
+        self.queue = OutboundQueue(self.socket.send, self.socket.close)
+
+    async def flush(self):
+        self.socket.released.set()
+        await self.queue.drain()
+
+    async def test_frames_are_sent_in_order(self):
+        """Test that queued frames go out in the order they were put"""
+        for seq in [1, 2]:
+            self.queue.put(chat_message_event("s", "c", {}, seq))
+        await self.flush()
+
+        self.assertEqual([frame["seq"] for frame in self.socket.sent], [1, 2])
+        self.assertIn("pingo_ws_frames_delayed_total", metrics.get_metrics().render())
+
+    async def test_drop_oldest(self):
+        """Test that a full group drops its oldest frame"""
+        self.queue.put(read_receipt_event("conv", "a", timezone.now()))
+        # The writer takes the first frame and blocks on the socket
+        await asyncio.sleep(0)
+        for user in ["b", "c", "d"]:
+            self.queue.put(read_receipt_event("conv", user, timezone.now()))
+        await self.flush()
+
+        self.assertEqual(
+            [frame["user_id"] for frame in self.socket.sent], ["a", "c", "d"]
+        )
+        self.assertIn(
+            'pingo_ws_frames_dropped_total{group="direct_message_conversation_*"} 1',
+            metrics.get_metrics().render(),
+        )
+
+    async def test_coalesce_merges_queued_frames(self):
+        """Test that presence changes for a server merge while queued"""
+        self.queue.put(presence_event("s", {"a": True}))
+        await asyncio.sleep(0)
+        self.queue.put(presence_event("s", {"b": True}))
+        self.queue.put(presence_event("s", {"a": False}))
+        await self.flush()
+
+        self.assertEqual(len(self.socket.sent), 2)
+        self.assertEqual(self.socket.sent[1]["online"], ["b"])
+        self.assertEqual(self.socket.sent[1]["offline"], ["a"])
+
+    async def test_disconnect_with_resume_hint(self):
+        """Test that a full chat group closes the socket with where to resume"""
+        self.socket.released.set()
+        self.queue.put(chat_message_event("s", "c", {}, 1))
+        await self.queue.drain()
+        self.socket.released.clear()
+
+        for seq in [2, 3, 4, 5]:
+            self.queue.put(chat_message_event("s", "c", {}, seq))
+        await self.flush()
+
+        self.assertEqual(self.socket.closed, SLOW_CONSUMER_CLOSE_CODE)
+        self.assertEqual(self.socket.sent[-1]["type"], "slow_consumer")
+        self.assertEqual(
+            self.socket.sent[-1]["resume"],
+            [{"server_id": "s", "channel_id": "c", "last_seq": 1}],
+        )
+        # Nothing more is queued once the socket is closing
+        self.queue.put(chat_message_event("s", "c", {}, 6))
+        self.assertEqual(len(self.queue), 0)
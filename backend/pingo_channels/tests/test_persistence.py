@@ -0,0 +1,262 @@
+# pingo_channels/tests/test_persistence.py
+
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from django.test import TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from servers.models import Server
+from pingo_channels.models import Channel, Message
+from pingo_channels.persistence import MessageWriter
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
+from pingo_project.asgi import application
+
+User = get_user_model()
+
+
+class MessageWriterTests(TransactionTestCase):
+    """Test the write-behind message queue"""
+
+    def setUp(self):
+        """Set up a channel to post into"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.channel = self.server.channels.get(name="general")
+        self.writer = MessageWriter(batch_size=10, flush_interval=0.01)
+
+    def enqueue(self, content, channel=None):
+        return self.writer.enqueue(
+            Message(content=content, channel=channel or self.channel, author=self.owner)
+        )
+
+    def stored(self):
+        return list(
+            Message.objects.order_by("created_at", "id").values_list(
+                "id", "content", "created_at"
+            )
+        )
+
+    async def test_enqueue_assigns_id_and_timestamp(self):
+        """Test that queued messages are broadcastable before they are stored"""
+        message = self.enqueue("Hello")
+
+        self.assertIsNotNone(message.id)
+        self.assertIsNotNone(message.created_at)
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 0)
+
+        await self.writer.flush()
+        self.assertEqual(len(self.writer), 0)
+
+    async def test_flush_stores_in_order_with_assigned_timestamps(self):
+        """Test that stored rows keep the queued order, ids and timestamps"""
+        messages = [self.enqueue(f"Message {i}") for i in range(25)]
+
+        await self.writer.flush()
+
+        self.assertEqual(
+            await database_sync_to_async(self.stored)(),
+            [(m.id, m.content, m.created_at) for m in messages],
+        )
+
+    async def test_full_batches_are_written_together(self):
+        """Test that rows are stored with one bulk_create per batch"""
+        with patch.object(
+            Message.objects, "bulk_create", wraps=Message.objects.bulk_create
+        ) as bulk_create:
+            for i in range(20):
+                self.enqueue(f"Message {i}")
+            await self.writer.flush()
+
+        self.assertEqual(bulk_create.call_count, 2)
+
+    async def test_failed_batch_is_retried(self):
+        """Test that a transient database error does not lose messages"""
+        bulk_create = Message.objects.bulk_create
+        calls = []
+
+        def flaky_bulk_create(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return bulk_create(objs, *args, **kwargs)
+
+        with patch.object(Message.objects, "bulk_create", flaky_bulk_create):
+            with self.assertLogs("pingo_channels.persistence", level="WARNING"):
+                self.enqueue("First")
+                self.enqueue("Second")
+                await self.writer.flush()
+
+        self.assertEqual(calls, [2, 2])
+        contents = [row[1] for row in await database_sync_to_async(self.stored)()]
+        self.assertEqual(contents, ["First", "Second"])
+
+    async def test_retry_after_committed_failure(self):
+        """Test that a batch stored by an attempt that seemed to fail is kept"""
+        write_batch = self.writer._write_batch
+        calls = []
+
+        def lost_reply_write_batch(batch):
+            calls.append(len(batch))
+            write_batch(batch)
+            if len(calls) == 1:
+                raise OperationalError("server closed the connection unexpectedly")
+
+        with patch.object(self.writer, "_write_batch", lost_reply_write_batch):
+            with self.assertLogs("pingo_channels.persistence", level="WARNING") as logs:
+                self.enqueue("First")
+                self.enqueue("Second")
+                await self.writer.flush()
+
+        self.assertEqual(calls, [2, 2])
+        self.assertFalse(any(record.levelname == "ERROR" for record in logs.records))
+        contents = [row[1] for row in await database_sync_to_async(self.stored)()]
+        self.assertEqual(contents, ["First", "Second"])
+
+    async def test_long_outage_does_not_lose_messages(self):
+        """Test that a batch is retried for as long as the database is down"""
+        writer = MessageWriter(batch_size=10, flush_interval=0.001, max_backoff=0.005)
+        bulk_create = Message.objects.bulk_create
+        failures = []
+
+        def down_bulk_create(objs, *args, **kwargs):
+            if len(failures) < 20:
+                failures.append(len(objs))
+                raise OperationalError("could not connect to server")
+            return bulk_create(objs, *args, **kwargs)
+
+        with patch.object(Message.objects, "bulk_create", down_bulk_create):
+            with self.assertLogs("pingo_channels.persistence", level="WARNING") as logs:
+                writer.enqueue(Message(content="First", channel=self.channel))
+                writer.enqueue(Message(content="Second", channel=self.channel))
+                await writer.flush()
+
+        self.assertEqual(len(failures), 20)
+        self.assertFalse(any(record.levelname == "ERROR" for record in logs.records))
+        contents = [row[1] for row in await database_sync_to_async(self.stored)()]
+        self.assertEqual(contents, ["First", "Second"])
+
+    async def test_unsavable_message_does_not_block_batch(self):
+        """Test that a message for a deleted channel is dropped on its own"""
+        doomed = await database_sync_to_async(Channel.objects.create)(
+            name="doomed", server=self.server
+        )
+        self.enqueue("Before")
+        self.enqueue("Lost", channel=doomed)
+        self.enqueue("After")
+        await database_sync_to_async(Channel.objects.filter(id=doomed.id).delete)()
+
+        with self.assertLogs("pingo_channels.persistence", level="ERROR"):
+            await self.writer.flush()
+
+        contents = [row[1] for row in await database_sync_to_async(self.stored)()]
+        self.assertEqual(contents, ["Before", "After"])
+
+    def test_flush_sync(self):
+        """Test that queued messages can be stored without an event loop"""
+        self.writer._pending.append(
+            Message(content="Shutdown", channel=self.channel, author=self.owner)
+        )
+
+        self.writer.flush_sync()
+
+        self.assertEqual(len(self.writer), 0)
+        self.assertTrue(Message.objects.filter(content="Shutdown").exists())
+
+    def test_flush_sync_spills_and_restores(self):
+        """Test that messages unsaved at shutdown are stored by the next writer"""
+        spill_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        writer = MessageWriter(flush_interval=0.001, spill_dir=spill_dir)
+        message = Message(content="Outage", channel=self.channel, author=self.owner)
+        writer._pending.append(message)
+
+        with patch.object(
+            Message.objects, "bulk_create", side_effect=OperationalError("down")
+        ):
+            with self.assertLogs("pingo_channels.persistence", level="WARNING"):
+                writer.flush_sync()
+
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(len(list(spill_dir.iterdir())), 1)
+        self.assertFalse(Message.objects.exists())
+
+        restarted = MessageWriter(spill_dir=spill_dir)
+        with self.assertLogs("pingo_channels.persistence", level="INFO"):
+            restarted.restore()
+        restarted.flush_sync()
+
+        self.assertEqual(list(spill_dir.iterdir()), [])
+        stored = Message.objects.get()
+        self.assertEqual(
+            (stored.id, stored.content, stored.created_at, stored.author_id),
+            (message.id, "Outage", message.created_at, self.owner.id),
+        )
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    PINGO_WRITE_BEHIND_MESSAGES=True,
+)
+class WriteBehindConsumerTests(TransactionTestCase):
+    """Test chat messages posted with write-behind enabled"""
+
+    def setUp(self):
+        """Set up a channel and a dedicated writer"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.channel = self.server.channels.get(name="general")
+        self.writer = MessageWriter(flush_interval=60)
+        patcher = patch("pingo_channels.persistence._message_writer", self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_message_is_broadcast_before_it_is_stored(self):
+        """Test that the broadcast does not wait for the insert"""
+        token = str(AccessToken.for_user(self.owner))
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/?token={token}",
+        )
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({"type": "chat_message", "content": "Hi"})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "chat_message")
+        message_id = response["message"]["id"]
+
+        exists = database_sync_to_async(Message.objects.filter(id=message_id).exists)
+        self.assertFalse(await exists())
+        await self.writer.flush()
+        self.assertTrue(await exists())
+
+        await communicator.disconnect()
+
+    async def test_full_queue_stores_before_broadcast(self):
+        """Test that senders are held back while the queue is full"""
+        self.writer.max_pending = 0
+        token = str(AccessToken.for_user(self.owner))
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/?token={token}",
+        )
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({"type": "chat_message", "content": "Hi"})
+        response = await communicator.receive_json_from()
+
+        self.assertEqual(len(self.writer), 0)
+        exists = database_sync_to_async(
+            Message.objects.filter(id=response["message"]["id"]).exists
+        )
+        self.assertTrue(await exists())
+
+        await communicator.disconnect()
@@ -0,0 +1,255 @@
+# pingo_channels/tests/test_presence.py
+
+import asyncio
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test import override_settings
+from rest_framework.test import APIClient
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+from servers.models import Server, ServerMembership
+from pingo_channels.presence import InMemoryPresence, PresenceTracker, get_presence
+from pingo_channels.utils import presence_group_name
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
+from pingo_project.asgi import application
+
+User = get_user_model()
+
+
+class InMemoryPresenceTests(SimpleTestCase):
+    """Test online/offline transitions in the in-memory presence store"""
+
+    def setUp(self):
+        self.store = InMemoryPresence()
+
+    async def test_first_socket_comes_online(self):
+        """Test that only a user's first socket in a server is a change"""
+        self.assertTrue(await self.store.add("u1", "s1", "c1", 60))
+        self.assertFalse(await self.store.add("u1", "s1", "c2", 60))
+        self.assertTrue(await self.store.add("u1", "s2", "c3", 60))
+
+        self.assertEqual(self.store.online_in_server("s1"), ["u1"])
+        self.assertEqual(self.store.online_users(["u1", "u2"]), {"u1"})
+
+    async def test_last_socket_goes_offline(self):
+        """Test that a user stays online in a server until their last socket closes"""
+        await self.store.add("u1", "s1", "c1", 60)
+        await self.store.add("u1", "s1", "c2", 60)
+        await self.store.add("u1", None, "c3", 60)
+
+        self.assertFalse(await self.store.remove("u1", "s1", "c1"))
+        self.assertTrue(await self.store.remove("u1", "s1", "c2"))
+        self.assertEqual(self.store.online_in_server("s1"), [])
+        # Still connected outside the server
+        self.assertEqual(self.store.online_users(["u1"]), {"u1"})
+
+        await self.store.remove("u1", None, "c3")
+        self.assertEqual(self.store.online_users(["u1"]), set())
+
+    async def test_entries_expire_without_heartbeats(self):
+        """Test that sockets not refreshed within the TTL drop off"""
+        with patch("pingo_channels.presence.time.time", return_value=1000):
+            await self.store.add("u1", "s1", "c1", 60)
+            await self.store.add("u2", "s1", "c2", 60)
+        with patch("pingo_channels.presence.time.time", return_value=1050):
+            await self.store.refresh([("u2", "s1", "c2")], 60)
+        with patch("pingo_channels.presence.time.time", return_value=1070):
+            self.assertEqual(self.store.online_in_server("s1"), ["u2"])
+            # An expired entry counts as offline, so reconnecting is a change
+            self.assertTrue(await self.store.add("u1", "s1", "c3", 60))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PresenceTrackerTests(SimpleTestCase):
+    """Test reference counting and coalesced broadcasts in PresenceTracker"""
+
+    def setUp(self):
+        self.tracker = PresenceTracker(InMemoryPresence(), broadcast_interval=60)
+
+    async def test_changes_are_coalesced_per_server(self):
+        """Test that changes queued between flushes go out as one frame"""
+        channel_layer = get_channel_layer()
+        listener = await channel_layer.new_channel()
+        await channel_layer.group_add(presence_group_name("s1"), listener)
+
+        await self.tracker.connect("u1", "s1", "c1")
+        await self.tracker.connect("u2", "s1", "c2")
+        await self.tracker.connect("u3", "s1", "c3")
+        await self.tracker.disconnect("u3", "s1", "c3")
+        await self.tracker.flush()
+
+        event = await channel_layer.receive(listener)
+        self.assertEqual(event["type"], "presence_broadcast")
+        self.assertJSONEqual(
+            event["text"],
+            {
+                "type": "presence",
+                "server_id": "s1",
+                "online": ["u1", "u2"],
+                "offline": ["u3"],
+            },
+        )
+
+        # Nothing changed since, so nothing is sent
+        await self.tracker.flush()
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(channel_layer.receive(listener), timeout=0.1)
+
+    async def test_repeated_registrations_are_counted(self):
+        """Test that a socket registered twice stays online until released twice"""
+        await self.tracker.connect("u1", "s1", "c1")
+        await self.tracker.connect("u1", "s1", "c1")
+
+        await self.tracker.disconnect("u1", "s1", "c1")
+        self.assertEqual(self.tracker.store.online_in_server("s1"), ["u1"])
+        await self.tracker.disconnect("u1", "s1", "c1")
+        self.assertEqual(self.tracker.store.online_in_server("s1"), [])
+
+    async def test_heartbeat_refreshes_local_sockets(self):
+        """Test that one heartbeat refreshes every socket in the process"""
+        await self.tracker.connect("u1", "s1", "c1")
+        await self.tracker.connect("u2", None, "c2")
+
+        with patch.object(self.tracker.store, "refresh") as refresh:
+            await self.tracker.heartbeat()
+
+        refresh.assert_called_once_with(
+            [("u1", "s1", "c1"), ("u2", None, "c2")], self.tracker.ttl
+        )
+
+    async def test_store_errors_do_not_propagate(self):
+        """Test that a failing store does not break sockets"""
+        with self.assertLogs("pingo_channels.presence", "WARNING"):
+            with patch.object(self.tracker.store, "add", side_effect=ConnectionError):
+                await self.tracker.connect("u1", "s1", "c1")
+            with patch.object(
+                self.tracker.store, "online_users", side_effect=ConnectionError
+            ):
+                self.assertEqual(await self.tracker.online_users(["u1"]), set())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConsumerPresenceTests(TransactionTestCase):
+    """Test that sockets feed presence and receive presence changes"""
+
+    def setUp(self):
+        """Set up a server with two members"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.channel = self.server.channels.get(name="general")
+
+    def chat_path(self, user):
+        return (
+            f"/ws/chat/{self.server.id}/{self.channel.id}/"
+            f"?token={AccessToken.for_user(user)}"
+        )
+
+    async def test_chat_sockets_broadcast_presence(self):
+        """Test that connecting and disconnecting is broadcast to the server"""
+        presence = get_presence()
+        owner = WebsocketCommunicator(application, self.chat_path(self.owner))
+        await owner.connect()
+        await owner.receive_json_from()
+        self.assertEqual(
+            presence.store.online_in_server(self.server.id), [str(self.owner.id)]
+        )
+
+        member = WebsocketCommunicator(application, self.chat_path(self.member))
+        await member.connect()
+        await member.receive_json_from()
+        await presence.flush()
+
+        frame = await owner.receive_json_from()
+        self.assertEqual(frame["type"], "presence")
+        self.assertEqual(frame["server_id"], str(self.server.id))
+        self.assertIn(str(self.member.id), frame["online"])
+
+        await member.disconnect()
+        await presence.flush()
+        frame = await owner.receive_json_from()
+        self.assertEqual(frame["offline"], [str(self.member.id)])
+
+        await owner.disconnect()
+        self.assertEqual(presence.store.online_in_server(self.server.id), [])
+
+    async def test_gateway_stays_online_across_channel_subscriptions(self):
+        """Test that a gateway is online in a server while subscribed to any channel"""
+        presence = get_presence()
+        second = await self.server.channels.acreate(name="second")
+        gateway = WebsocketCommunicator(
+            application, f"/ws/gateway/?token={AccessToken.for_user(self.member)}"
+        )
+        await gateway.connect()
+        await gateway.receive_json_from()
+
+        for channel in [self.channel, second]:
+            await gateway.send_json_to(
+                {
+                    "type": "subscribe",
+                    "server_id": str(self.server.id),
+                    "channel_id": str(channel.id),
+                }
+            )
+            await gateway.receive_json_from()
+
+        await gateway.send_json_to(
+            {
+                "type": "unsubscribe",
+                "server_id": str(self.server.id),
+                "channel_id": str(self.channel.id),
+            }
+        )
+        await gateway.receive_json_from()
+        self.assertEqual(
+            presence.store.online_in_server(self.server.id), [str(self.member.id)]
+        )
+
+        await gateway.disconnect()
+        self.assertEqual(presence.store.online_in_server(self.server.id), [])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ServerPresenceViewTests(TestCase):
+    """Test listing who is online in a server"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.outsider = User.objects.create_user(
+            email="outsider@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.url = f"/api/servers/{self.server.id}/presence/"
+
+    def test_lists_online_users(self):
+        """Test that members get the ids of the users online in the server"""
+        async_to_sync(get_presence().store.add)(
+            str(self.owner.id), str(self.server.id), "c1", 60
+        )
+        self.client.force_authenticate(user=self.owner)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["online"], [str(self.owner.id)])
+
+    def test_non_member_forbidden(self):
+        """Test that only members can see who is online"""
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,200 @@
+# pingo_channels/tests/test_query_counts.py
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework import status
+from servers.models import Server, ServerMembership
+from pingo_channels.models import (
+    Channel,
+    Message,
+    DirectMessage,
+    DirectMessageConversation,
+)
+from pingo_channels.consumers import create_channel_message, create_direct_message
+
+User = get_user_model()
+
+
+class MessageQueryCountTests(TestCase):
+    """
+    Pin the number of queries per message endpoint so that per-row author
+    lookups cannot creep back into message serialization.
+    """
+
+    def setUp(self):
+        """Set up a channel with messages from many different authors"""
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.channel = self.server.channels.get(name="general")
+        self.url = f"/api/servers/{self.server.id}/channels/{self.channel.id}/messages/"
+
+        for i in range(20):
+            author = User.objects.create_user(
+                email=f"author{i}@test.com", password="testpass123"
+            )
+            ServerMembership.objects.create(
+                user=author, server=self.server, role="member"
+            )
+            self.message = Message.objects.create(
+                content=f"Message {i}", channel=self.channel, author=author
+            )
+
+        self.client.force_authenticate(user=self.owner)
+
+    def test_message_list_query_count(self):
+        """Test that listing messages does not query once per author"""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 20)
+
+    def test_message_list_with_cursor_query_count(self):
+        """Test that resolving a cursor costs a single extra query"""
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {"before": self.message.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 19)
+
+    def test_message_detail_query_count(self):
+        """Test that a single message loads its author with the message"""
+        with self.assertNumQueries(2):
+            response = self.client.get(f"{self.url}{self.message.id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_message_post_query_count(self):
+        """Test that the created message reuses the requesting user as author"""
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {"content": "Hello"})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_broadcast_serialization_query_count(self):
+        """Test that serializing a new message for broadcast only inserts it"""
+        with self.assertNumQueries(1):
+            message_data = create_channel_message(self.channel, self.owner, "Hello")
+
+        self.assertEqual(message_data["author"]["id"], str(self.owner.id))
+
+
+class ChannelQueryCountTests(TestCase):
+    """Pin the number of queries for listing channels"""
+
+    def setUp(self):
+        """Set up a server with many channels"""
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        for i in range(10):
+            Channel.objects.create(
+                name=f"channel-{i}",
+                server=self.server,
+                created_by=self.owner,
+                min_view_role="admin" if i % 2 else "member",
+            )
+
+        self.client.force_authenticate(user=self.member)
+
+    def test_channel_list_permission_query_count(self):
+        """Test that channel permissions come from a single role lookup"""
+        url = f"/api/servers/{self.server.id}/channels/"
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 6)
+        membership_queries = [
+            query
+            for query in queries.captured_queries
+            if 'FROM "servers_servermembership"' in query["sql"]
+            and "COUNT" not in query["sql"]
+        ]
+        self.assertEqual(len(membership_queries), 1)
+
+    def test_channel_list_query_count(self):
+        """Test that channel creators are loaded with the channels"""
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/servers/{self.server.id}/channels/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 6)
+
+
+class DirectMessageQueryCountTests(TestCase):
+    """Pin the number of queries for listing direct messages"""
+
+    def setUp(self):
+        """Set up a conversation with messages from both participants"""
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(
+            email="user1@test.com", password="testpass123"
+        )
+        self.user2 = User.objects.create_user(
+            email="user2@test.com", password="testpass123"
+        )
+        self.conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            self.user1, self.user2
+        )
+        for i in range(10):
+            DirectMessage.objects.create(
+                conversation=self.conversation,
+                sender=self.user1 if i % 2 else self.user2,
+                content=f"Message {i}",
+            )
+
+        self.client.force_authenticate(user=self.user1)
+
+    def test_direct_message_list_query_count(self):
+        """Test that listing direct messages does not query once per sender"""
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"/api/dm/conversations/{self.conversation.id}/messages/"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 10)
+
+    def test_conversation_list_query_count(self):
+        """Test that the inbox costs the same number of queries at any size"""
+        for i in range(10):
+            friend = User.objects.create_user(
+                email=f"friend{i}@test.com", password="testpass123"
+            )
+            conversation, _ = DirectMessageConversation.get_or_create_conversation(
+                self.user1, friend
+            )
+            DirectMessage.objects.create(
+                conversation=conversation, sender=friend, content="Hello"
+            )
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/dm/conversations/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 11)
+
+    def test_direct_message_broadcast_query_count(self):
+        """Test that creating and serializing a direct message loads nothing extra"""
+        with CaptureQueriesContext(connection) as queries:
+            message_data = create_direct_message(self.conversation, self.user1, "Hi")
+
+        self.assertFalse(
+            [q for q in queries.captured_queries if q["sql"].startswith("SELECT")]
+        )
+        self.assertEqual(message_data["sender"]["id"], str(self.user1.id))
@@ -0,0 +1,299 @@
+# pingo_channels/tests/test_replay.py
+
+import asyncio
+import json
+import uuid
+from unittest import mock, skipUnless
+import redis.asyncio
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from servers.models import Server, ServerMembership
+from pingo_channels.encoding import chat_message_event
+from pingo_channels.replay import (
+    InMemoryReplay,
+    RedisReplay,
+    broadcast_sequenced,
+    replayable,
+    ring_key,
+    sequence_key,
+)
+from pingo_channels.tests import (
+    IN_MEMORY_CHANNEL_LAYERS,
+    REDIS_URL,
+    redis_available,
+)
+from pingo_project.asgi import application
+
+User = get_user_model()
+
+
+class InMemoryReplayTests(SimpleTestCase):
+    """Test sequencing and replay in the in-memory ring"""
+
+    def setUp(self):
+        self.replay = InMemoryReplay(size=3)
+
+    async def record(self, count):
+        for _ in range(count):
+            await self.replay.record(
+                "chat_s_c", lambda seq: chat_message_event("s", "c", {}, seq)
+            )
+
+    async def test_events_are_numbered_per_stream(self):
+        """Test that each stream counts from one"""
+        event = await self.replay.record(
+            "chat_s_c", lambda seq: chat_message_event("s", "c", {}, seq)
+        )
+        other = await self.replay.record(
+            "chat_s_d", lambda seq: chat_message_event("s", "d", {}, seq)
+        )
+
+        self.assertEqual(json.loads(event["text"])["seq"], 1)
+        self.assertEqual(json.loads(other["text"])["seq"], 1)
+
+    async def test_since_returns_missed_frames_in_order(self):
+        """Test that only frames after the last seen sequence are replayed"""
+        await self.record(3)
+
+        latest, frames = await self.replay.since("chat_s_c", 1)
+
+        self.assertEqual(latest, 3)
+        self.assertEqual([json.loads(frame)["seq"] for frame in frames], [2, 3])
+        self.assertEqual(await self.replay.since("chat_s_c", 3), (3, []))
+
+    async def test_since_detects_gaps(self):
+        """Test that a resume from beyond the ring, or ahead of it, fails"""
+        await self.record(5)
+
+        self.assertEqual(await self.replay.since("chat_s_c", 1), (5, None))
+        self.assertEqual(await self.replay.since("chat_s_c", 9), (5, None))
+        _, frames = await self.replay.since("chat_s_c", 2)
+        self.assertEqual(len(frames), 3)
+
+    def test_replayable_requires_contiguous_frames(self):
+        """Test that a ring with a hole, or missing the latest frames, fails"""
+        self.assertEqual(replayable(2, 4, [("c", 3), ("d", 4)]), ["c", "d"])
+        self.assertIsNone(replayable(2, 5, [("c", 3), ("e", 5)]))
+        self.assertIsNone(replayable(2, 5, [("c", 3), ("d", 4)]))
+        self.assertEqual(replayable(5, 5, []), [])
+
+
+class RedisReplayTests(SimpleTestCase):
+    """Test how RedisReplay numbers frames in its Lua script"""
+
+    async def test_script_numbers_the_encoded_frame(self):
+        """Test that the frame the script stores carries the number it took"""
+        script = mock.AsyncMock(return_value=7)
+        client = mock.Mock(register_script=mock.Mock(return_value=script))
+        replay = RedisReplay("redis://unused")
+        message = {"content": '"seq": "\x00seq"'}
+
+        with mock.patch.object(replay, "_client", return_value=client):
+            event = await replay.record(
+                "chat_s_c", lambda seq: chat_message_event("s", "c", message, seq)
+            )
+
+        expected = chat_message_event("s", "c", message, 7)
+        self.assertEqual(event, expected)
+        head, tail = script.call_args.kwargs["args"][:2]
+        self.assertEqual(f"{head}7{tail}", expected["text"])
+
+
+@skipUnless(redis_available(), f"Redis is not reachable at {REDIS_URL}")
+class RedisReplayExpiryTests(SimpleTestCase):
+    """Test that a quiet stream's keys expire in Redis"""
+
+    async def test_counter_expires_with_ring(self):
+        """Test that the counter is given the ring's time to live"""
+        stream = f"chat_test_{uuid.uuid4()}"
+        client = redis.asyncio.Redis.from_url(REDIS_URL)
+        try:
+            await RedisReplay(REDIS_URL, ttl=60).record(
+                stream, lambda seq: chat_message_event("s", "c", {}, seq)
+            )
+
+            for key in [sequence_key(stream), ring_key(stream)]:
+                with self.subTest(key=key):
+                    self.assertTrue(0 < await client.ttl(key) <= 60)
+        finally:
+            await client.delete(sequence_key(stream), ring_key(stream))
+            await client.aclose()
+
+
+class SlowFirstReplay(InMemoryReplay):
+    """Ring whose first append is slow, like a delayed round trip to Redis"""
+
+    async def record(self, stream, build_event):
+        event = await super().record(stream, build_event)
+        if event["seq"] == 1:
+            await asyncio.sleep(0.05)
+        return event
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BroadcastSequencedTests(SimpleTestCase):
+    """Test that a process sends a stream's events in sequence order"""
+
+    async def test_later_number_waits_for_earlier_send(self):
+        """Test that an event numbered second is not sent before the first"""
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add("chat_s_c", channel)
+
+        with mock.patch(
+            "pingo_channels.replay.get_replay_buffer", return_value=SlowFirstReplay()
+        ):
+            await asyncio.gather(
+                *[
+                    broadcast_sequenced(
+                        "chat_s_c",
+                        lambda seq: chat_message_event("s", "c", {}, seq),
+                    )
+                    for _ in range(2)
+                ]
+            )
+
+        received = [await layer.receive(channel) for _ in range(2)]
+        self.assertEqual([event["seq"] for event in received], [1, 2])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, PINGO_REPLAY_BUFFER_SIZE=3)
+class ConsumerResumeTests(TransactionTestCase):
+    """Test resuming channel sockets from a sequence number"""
+
+    def setUp(self):
+        """Set up a server with a member"""
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.channel = self.server.channels.get(name="general")
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{self.server.id}/{self.channel.id}/"
+            f"?token={AccessToken.for_user(user)}",
+        )
+        await communicator.connect()
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "auth_success")
+        return communicator, response
+
+    async def post(self, communicator, contents):
+        for content in contents:
+            await communicator.send_json_to(
+                {"type": "chat_message", "content": content}
+            )
+            await communicator.receive_json_from()
+
+    async def test_resume_replays_missed_messages(self):
+        """Test that a reconnecting socket gets only what it missed"""
+        owner, response = await self.connect(self.owner)
+        self.assertEqual(response["seq"], 0)
+        await self.post(owner, ["one", "two", "three"])
+
+        member, response = await self.connect(self.member)
+        self.assertEqual(response["seq"], 3)
+        await member.send_json_to({"type": "resume", "last_seq": 1})
+
+        replayed = [await member.receive_json_from() for _ in range(2)]
+        self.assertEqual(
+            [(frame["seq"], frame["message"]["content"]) for frame in replayed],
+            [(2, "two"), (3, "three")],
+        )
+        self.assertEqual(
+            await member.receive_json_from(),
+            {"type": "resumed", "seq": 3, "replayed": 2},
+        )
+
+        await owner.disconnect()
+        await member.disconnect()
+
+    async def test_out_of_order_frames_are_recovered_by_resume(self):
+        """Test that a client seeing a gap resumes instead of dropping frames"""
+        member, response = await self.connect(self.member)
+        group = f"chat_{self.server.id}_{self.channel.id}"
+        replay = InMemoryReplay()
+        events = [
+            await replay.record(
+                group,
+                lambda seq: chat_message_event(
+                    self.server.id, self.channel.id, {"content": content}, seq
+                ),
+            )
+            for content in ["one", "two"]
+        ]
+
+        # Numbered by two workers, the second send overtakes the first
+        with mock.patch("pingo_channels.replay.get_replay_buffer", return_value=replay):
+            for event in reversed(events):
+                await get_channel_layer().group_send(group, event)
+            received = [await member.receive_json_from() for _ in range(2)]
+            self.assertEqual([frame["seq"] for frame in received], [2, 1])
+
+            # Frame 2 left a gap after 0; resuming from the last applied
+            # frame returns both in order
+            await member.send_json_to({"type": "resume", "last_seq": 0})
+            replayed = [await member.receive_json_from() for _ in range(3)]
+
+        self.assertEqual([frame.get("seq") for frame in replayed[:2]], [1, 2])
+        self.assertEqual(replayed[2], {"type": "resumed", "seq": 2, "replayed": 2})
+        await member.disconnect()
+
+    async def test_resume_beyond_buffer_fails(self):
+        """Test that the client is told to reload when frames were evicted"""
+        owner, _ = await self.connect(self.owner)
+        await self.post(owner, ["one", "two", "three", "four", "five"])
+
+        await owner.send_json_to({"type": "resume", "last_seq": 1})
+        response = await owner.receive_json_from()
+        self.assertEqual(response["type"], "resume_failed")
+        self.assertEqual(response["seq"], 5)
+
+        await owner.disconnect()
+
+    async def test_resume_requires_sequence(self):
+        """Test that last_seq must be a non-negative integer"""
+        owner, _ = await self.connect(self.owner)
+
+        await owner.send_json_to({"type": "resume", "last_seq": "1"})
+        response = await owner.receive_json_from()
+        self.assertEqual(response["type"], "error")
+
+        await owner.disconnect()
+
+    async def test_gateway_resume(self):
+        """Test resuming one channel of a gateway socket"""
+        owner, _ = await self.connect(self.owner)
+        await self.post(owner, ["one", "two"])
+
+        gateway = WebsocketCommunicator(
+            application, f"/ws/gateway/?token={AccessToken.for_user(self.member)}"
+        )
+        await gateway.connect()
+        await gateway.receive_json_from()
+        target = {"server_id": str(self.server.id), "channel_id": str(self.channel.id)}
+        await gateway.send_json_to({"type": "subscribe", **target})
+        response = await gateway.receive_json_from()
+        self.assertEqual(response["seq"], 2)
+
+        await gateway.send_json_to({"type": "resume", "last_seq": 1, **target})
+        frame = await gateway.receive_json_from()
+        self.assertEqual(frame["message"]["content"], "two")
+        self.assertEqual(
+            await gateway.receive_json_from(),
+            {"type": "resumed", "seq": 2, "replayed": 1, **target},
+        )
+
+        await owner.disconnect()
+        await gateway.disconnect()
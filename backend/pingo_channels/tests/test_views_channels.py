@@ -286,6 +286,43 @@ class ChannelDetailViewTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_channel_server_not_found(self):
+        """Test that a missing server is reported before the channel"""
+        self.client.force_authenticate(user=self.owner)
+        fake_uuid = "12345678-1234-5678-9012-123456789012"
+
+        response = self.client.get(
+            f"/api/servers/{fake_uuid}/channels/{self.channel.id}/"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data["error"], "Server not found.")
+
+    def test_get_channel_not_found_non_member_forbidden(self):
+        """Test that non-members cannot probe for channel ids"""
+        self.client.force_authenticate(user=self.outsider)
+        fake_uuid = "12345678-1234-5678-9012-123456789012"
+
+        response = self.client.get(
+            f"/api/servers/{self.server.id}/channels/{fake_uuid}/"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data["error"], "You are not a member of this server.")
+
+    def test_get_channel_from_other_server_not_found(self):
+        """Test that a channel id is only resolved within its own server"""
+        other_server = Server.objects.create(name="Other Server", owner=self.owner)
+        other_channel = other_server.channels.get(name="general")
+        self.client.force_authenticate(user=self.member)
+
+        response = self.client.get(
+            f"/api/servers/{self.server.id}/channels/{other_channel.id}/"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data["error"], "Channel not found.")
+
     # PATCH Tests
     def test_update_channel_success_owner(self):
         """Test that owner can update channel"""
@@ -349,6 +386,47 @@ class ChannelDetailViewTests(TestCase):
             response.data["error"], "Another channel with the same name already exists."
         )
 
+    def test_update_channel_roles(self):
+        """Test that owners can change a channel's minimum roles"""
+        self.client.force_authenticate(user=self.owner)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(
+                f"/api/servers/{self.server.id}/channels/{self.channel.id}/",
+                {"min_view_role": "moderator", "min_message_role": "admin"},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["min_view_role"], "moderator")
+        self.assertEqual(response.data["min_message_role"], "admin")
+        self.assertTrue(response.data["user_permissions"]["can_post"])
+        # Sockets in the channel are told to recompute their permissions
+        self.assertEqual(len(callbacks), 1)
+
+    def test_update_channel_name_not_broadcast(self):
+        """Test that edits which leave the roles alone do not reach sockets"""
+        self.client.force_authenticate(user=self.owner)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.patch(
+                f"/api/servers/{self.server.id}/channels/{self.channel.id}/",
+                {"name": "renamed", "min_view_role": "member"},
+            )
+
+        self.assertEqual(callbacks, [])
+
+    def test_update_channel_invalid_role(self):
+        """Test that unknown roles are rejected"""
+        self.client.force_authenticate(user=self.owner)
+
+        response = self.client.patch(
+            f"/api/servers/{self.server.id}/channels/{self.channel.id}/",
+            {"min_view_role": "superuser"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("min_view_role", response.data)
+
     # DELETE Tests
     def test_delete_channel_success_owner(self):
         """Test that owner can delete channel"""
@@ -0,0 +1,265 @@
+# pingo_channels/tests/test_views_direct_messages.py
+
+import json
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from pingo_channels.models import DirectMessage, DirectMessageConversation
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
+
+User = get_user_model()
+
+
+class DirectMessageConversationListViewTests(TestCase):
+    """Test the DM inbox returned by DirectMessageConversationListView GET"""
+
+    def setUp(self):
+        """Set up a user with several conversations"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="user@test.com", password="testpass123", display_name="User"
+        )
+        self.url = "/api/dm/conversations/"
+
+        # Oldest activity first, one minute apart so the ordering is deterministic
+        start = timezone.now() - timedelta(days=1)
+        self.conversations = []
+        for i in range(5):
+            friend = User.objects.create_user(
+                email=f"friend{i}@test.com",
+                password="testpass123",
+                display_name=f"Friend {i}",
+            )
+            conversation, _ = DirectMessageConversation.get_or_create_conversation(
+                self.user, friend
+            )
+            DirectMessageConversation.objects.filter(pk=conversation.pk).update(
+                updated_at=start + timedelta(minutes=i)
+            )
+            self.conversations.append(conversation)
+
+        self.client.force_authenticate(user=self.user)
+
+    def other_display_names(self, response):
+        names = []
+        for conversation in response.data:
+            participants = [conversation["participant1"], conversation["participant2"]]
+            names.extend(
+                p["display_name"] for p in participants if p["display_name"] != "User"
+            )
+        return names
+
+    def test_list_conversations_most_recent_first(self):
+        """Test that the inbox is ordered by latest activity"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.other_display_names(response),
+            ["Friend 4", "Friend 3", "Friend 2", "Friend 1", "Friend 0"],
+        )
+
+    def test_list_conversations_excludes_others(self):
+        """Test that conversations between other users are not listed"""
+        outsider1 = User.objects.create_user(
+            email="outsider1@test.com", password="testpass123"
+        )
+        outsider2 = User.objects.create_user(
+            email="outsider2@test.com", password="testpass123"
+        )
+        DirectMessageConversation.get_or_create_conversation(outsider1, outsider2)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data), 5)
+
+    def test_last_message_and_unread_count(self):
+        """Test the prefetched last message and stored unread count"""
+        conversation = self.conversations[0]
+        friend = conversation.get_other_participant(self.user)
+        read = DirectMessage.objects.create(
+            conversation=conversation, sender=friend, content="Read"
+        )
+        conversation.mark_read(self.user, up_to=read)
+        DirectMessage.objects.create(
+            conversation=conversation, sender=friend, content="Unread 1"
+        )
+        DirectMessage.objects.create(
+            conversation=conversation, sender=self.user, content="Own message"
+        )
+        DirectMessage.objects.create(
+            conversation=conversation, sender=friend, content="Latest"
+        )
+
+        response = self.client.get(self.url)
+
+        data = response.data[0]
+        self.assertEqual(data["id"], str(conversation.id))
+        self.assertEqual(data["last_message"]["content"], "Latest")
+        self.assertEqual(data["last_message"]["sender"]["id"], str(friend.id))
+        self.assertEqual(data["unread_count"], 2)
+
+    def test_empty_conversation(self):
+        """Test a conversation without messages"""
+        response = self.client.get(self.url)
+
+        self.assertIsNone(response.data[0]["last_message"])
+        self.assertEqual(response.data[0]["unread_count"], 0)
+
+    def test_pagination(self):
+        """Test paging through the inbox with before and limit"""
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(self.other_display_names(response), ["Friend 4", "Friend 3"])
+
+        response = self.client.get(
+            self.url, {"limit": 2, "before": response.data[-1]["id"]}
+        )
+        self.assertEqual(self.other_display_names(response), ["Friend 2", "Friend 1"])
+
+        response = self.client.get(
+            self.url, {"limit": 2, "before": response.data[-1]["id"]}
+        )
+        self.assertEqual(self.other_display_names(response), ["Friend 0"])
+
+    def test_pagination_cursor_survives_new_messages(self):
+        """Test that the boundary conversation moving to the top skips nothing"""
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(self.other_display_names(response), ["Friend 4", "Friend 3"])
+        cursor = response["X-Next-Cursor"]
+
+        # Friend 3 writes again before the next page is fetched
+        friend = self.conversations[3].get_other_participant(self.user)
+        DirectMessage.objects.create(
+            conversation=self.conversations[3], sender=friend, content="Still there?"
+        )
+
+        response = self.client.get(self.url, {"limit": 2, "before": cursor})
+        self.assertEqual(self.other_display_names(response), ["Friend 2", "Friend 1"])
+        response = self.client.get(
+            self.url, {"limit": 2, "before": response["X-Next-Cursor"]}
+        )
+        self.assertEqual(self.other_display_names(response), ["Friend 0"])
+        self.assertNotIn("X-Next-Cursor", response)
+
+    def test_foreign_conversation_is_not_a_cursor(self):
+        """Test that someone else's conversation id cannot be used as a cursor"""
+        first = User.objects.create_user(email="a@test.com", password="testpass123")
+        second = User.objects.create_user(email="b@test.com", password="testpass123")
+        foreign, _ = DirectMessageConversation.get_or_create_conversation(first, second)
+
+        response = self.client.get(self.url, {"before": str(foreign.id)})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_pagination_parameters(self):
+        """Test that a bad limit or cursor is rejected"""
+        response = self.client.get(self.url, {"limit": "0"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(self.url, {"before": "not-a-uuid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(self.url, {"before": "soon:not-a-uuid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conversation_detail_uses_inbox_data(self):
+        """Test that the detail view returns the same summary fields"""
+        conversation = self.conversations[0]
+        friend = conversation.get_other_participant(self.user)
+        DirectMessage.objects.create(
+            conversation=conversation, sender=friend, content="Hello"
+        )
+
+        response = self.client.get(f"{self.url}{conversation.id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["last_message"]["content"], "Hello")
+        self.assertEqual(response.data["unread_count"], 1)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DirectMessageReadViewTests(TestCase):
+    """Test marking a conversation read with DirectMessageReadView POST"""
+
+    def setUp(self):
+        """Set up a conversation with unread messages"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="user@test.com", password="testpass123"
+        )
+        self.friend = User.objects.create_user(
+            email="friend@test.com", password="testpass123"
+        )
+        self.conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            self.user, self.friend
+        )
+        self.messages = [
+            DirectMessage.objects.create(
+                conversation=self.conversation, sender=self.friend, content=f"{i}"
+            )
+            for i in range(3)
+        ]
+        self.url = f"/api/dm/conversations/{self.conversation.id}/read/"
+        self.client.force_authenticate(user=self.user)
+
+    def test_mark_all_read(self):
+        """Test that everything is read without a message_id"""
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["unread_count"], 0)
+        self.assertIsNotNone(response.data["last_read_at"])
+
+    def test_mark_read_up_to_message(self):
+        """Test that later messages stay unread"""
+        response = self.client.post(self.url, {"message_id": self.messages[0].id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["unread_count"], 2)
+
+        response = self.client.get(f"/api/dm/conversations/{self.conversation.id}/")
+        self.assertEqual(response.data["unread_count"], 2)
+
+        response = self.client.get(
+            f"/api/dm/conversations/{self.conversation.id}/messages/"
+        )
+        read = {m["content"]: m["is_read"] for m in response.data}
+        self.assertEqual(read, {"0": True, "1": False, "2": False})
+
+    def test_unknown_message(self):
+        """Test that a message from another conversation is rejected"""
+        response = self.client.post(self.url, {"message_id": "not-a-uuid"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_non_participant_forbidden(self):
+        """Test that outsiders cannot move a watermark"""
+        outsider = User.objects.create_user(
+            email="outsider@test.com", password="testpass123"
+        )
+        self.client.force_authenticate(user=outsider)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_read_receipt_broadcast_after_commit(self):
+        """Test that the other participant is told once the update commits"""
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(
+            f"direct_message_conversation_{self.conversation.id}", channel_name
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+
+        event = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(event["type"], "read_receipt_broadcast")
+        frame = json.loads(event["text"])
+        self.assertEqual(frame["user_id"], str(self.user.id))
+        self.assertEqual(frame["conversation_id"], str(self.conversation.id))
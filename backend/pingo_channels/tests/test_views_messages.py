@@ -1,11 +1,19 @@
 # pingo_channels/tests/test_message_views.py
 
-from django.test import TestCase
+import json
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from unittest.mock import patch
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 from servers.models import Server, ServerMembership
 from pingo_channels.models import Channel, Message
+from pingo_channels.utils import chat_group_name
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
 
 User = get_user_model()
 
@@ -471,6 +479,91 @@ class MessageDetailViewTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MessageBroadcastTests(TestCase):
+    """Test that messages posted, edited or deleted over REST reach sockets"""
+
+    def setUp(self):
+        """Set up a channel with a message and a socket listening to it"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="user@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.user)
+        self.channel = self.server.channels.get(name="general")
+        self.message = Message.objects.create(
+            content="Original", channel=self.channel, author=self.user
+        )
+        self.url = f"/api/servers/{self.server.id}/channels/{self.channel.id}/messages/"
+        self.client.force_authenticate(user=self.user)
+
+        self.channel_layer = get_channel_layer()
+        self.listener = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(
+            chat_group_name(self.server.id, self.channel.id), self.listener
+        )
+
+    def receive_frame(self):
+        event = async_to_sync(self.channel_layer.receive)(self.listener)
+        return event, json.loads(event["text"])
+
+    def test_post_broadcasts_message(self):
+        """Test that a posted message is broadcast like one sent over a socket"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"content": "Hello"})
+
+        event, frame = self.receive_frame()
+        self.assertEqual(event["type"], "chat_message_broadcast")
+        self.assertEqual(frame["message"]["id"], str(response.data["id"]))
+        self.assertEqual(frame["message"]["content"], "Hello")
+        self.assertIn("seq", frame)
+
+    def test_edit_broadcasts_delta(self):
+        """Test that an edit is broadcast as the changed fields only"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"{self.url}{self.message.id}/", {"content": "Edited"})
+
+        self.message.refresh_from_db()
+        event, frame = self.receive_frame()
+        self.assertEqual(event["type"], "message_update_broadcast")
+        self.assertEqual(frame["type"], "message_update")
+        self.assertEqual(
+            frame["message"],
+            {
+                "id": str(self.message.id),
+                "content": "Edited",
+                "edited_at": self.message.updated_at.isoformat(),
+                "is_deleted": False,
+            },
+        )
+
+    def test_delete_broadcasts_delta(self):
+        """Test that a deletion is broadcast without the message content"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"{self.url}{self.message.id}/")
+
+        _, frame = self.receive_frame()
+        self.assertTrue(frame["message"]["is_deleted"])
+        self.assertIsNone(frame["message"]["content"])
+
+    def test_updates_are_sequenced(self):
+        """Test that REST changes share the channel's sequence numbers"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"{self.url}{self.message.id}/", {"content": "Edited"})
+            self.client.delete(f"{self.url}{self.message.id}/")
+
+        _, edit = self.receive_frame()
+        _, deletion = self.receive_frame()
+        self.assertEqual(deletion["seq"], edit["seq"] + 1)
+
+    def test_rejected_edit_not_broadcast(self):
+        """Test that nothing is sent for a change that was not made"""
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.patch(f"{self.url}{self.message.id}/", {"content": ""})
+
+        self.assertEqual(callbacks, [])
+
+
 class MessageViewIntegrationTests(TestCase):
     """Integration tests for message operations"""
 
@@ -538,3 +631,151 @@ class MessageViewIntegrationTests(TestCase):
         )
         self.assertEqual(final_list_response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(final_list_response.data), 0)
+
+
+class MessageListPaginationTests(TestCase):
+    """Test keyset pagination of MessageListView GET"""
+
+    def setUp(self):
+        """Set up a channel with a known message history"""
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.channel = self.server.channels.get(name="general")
+        self.url = f"/api/servers/{self.server.id}/channels/{self.channel.id}/messages/"
+
+        # Oldest first, one minute apart so the ordering is deterministic
+        start = timezone.now() - timedelta(days=1)
+        self.messages = []
+        for i in range(10):
+            message = Message.objects.create(
+                content=f"Message {i}", channel=self.channel, author=self.owner
+            )
+            Message.objects.filter(pk=message.pk).update(
+                created_at=start + timedelta(minutes=i)
+            )
+            self.messages.append(message)
+
+        self.client.force_authenticate(user=self.owner)
+
+    def contents(self, response):
+        return [msg["content"] for msg in response.data]
+
+    def test_default_page_is_newest_first(self):
+        """Test that the first page holds the newest messages"""
+        response = self.client.get(self.url, {"limit": 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.contents(response), ["Message 9", "Message 8", "Message 7"]
+        )
+
+    def test_default_limit_bounds_page(self):
+        """Test that pages are bounded without an explicit limit"""
+        with patch("pingo_channels.utils.MESSAGE_PAGE_SIZE", 4):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data), 4)
+
+    def test_before_cursor(self):
+        """Test paging back through history with before"""
+        response = self.client.get(
+            self.url, {"before": self.messages[5].id, "limit": 3}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.contents(response), ["Message 4", "Message 3", "Message 2"]
+        )
+
+    def test_before_cursor_at_start_of_history(self):
+        """Test that paging past the oldest message returns an empty page"""
+        response = self.client.get(self.url, {"before": self.messages[0].id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+
+    def test_after_cursor(self):
+        """Test paging forward with after returns the closest newer messages"""
+        response = self.client.get(self.url, {"after": self.messages[2].id, "limit": 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.contents(response), ["Message 5", "Message 4", "Message 3"]
+        )
+
+    def test_around_cursor(self):
+        """Test that around centres the page on the cursor message"""
+        response = self.client.get(
+            self.url, {"around": self.messages[5].id, "limit": 5}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.contents(response),
+            ["Message 7", "Message 6", "Message 5", "Message 4", "Message 3"],
+        )
+
+    def test_deleted_cursor_message(self):
+        """Test that a deleted message is a valid cursor but is not returned"""
+        Message.objects.filter(pk=self.messages[5].pk).update(is_deleted=True)
+
+        response = self.client.get(
+            self.url, {"around": self.messages[5].id, "limit": 4}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.contents(response),
+            ["Message 7", "Message 6", "Message 4", "Message 3"],
+        )
+
+    def test_same_timestamp_tiebreak(self):
+        """Test that messages sharing a timestamp are not skipped or repeated"""
+        Message.objects.filter(channel=self.channel).update(created_at=timezone.now())
+
+        seen = []
+        response = self.client.get(self.url, {"limit": 3})
+        while response.data:
+            seen.extend(msg["id"] for msg in response.data)
+            response = self.client.get(
+                self.url, {"before": response.data[-1]["id"], "limit": 3}
+            )
+
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(len(set(seen)), 10)
+
+    def test_multiple_cursors_rejected(self):
+        """Test that before, after and around are mutually exclusive"""
+        response = self.client.get(
+            self.url, {"before": self.messages[5].id, "after": self.messages[2].id}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_limit_rejected(self):
+        """Test that limit must be a number within bounds"""
+        for limit in ["0", "101", "abc"]:
+            response = self.client.get(self.url, {"limit": limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_cursor_rejected(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get(self.url, {"before": "not-a-uuid"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_from_other_channel_not_found(self):
+        """Test that a cursor must belong to the requested channel"""
+        other_channel = Channel.objects.create(
+            name="other", server=self.server, created_by=self.owner
+        )
+        other_message = Message.objects.create(
+            content="Elsewhere", channel=other_channel, author=self.owner
+        )
+
+        response = self.client.get(self.url, {"before": other_message.id})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,267 @@
+# pingo_channels/tests/test_views_search.py
+
+from datetime import timedelta
+from unittest import skipUnless
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from servers.models import Server, ServerMembership
+from pingo_channels.models import (
+    Channel,
+    Message,
+    DirectMessage,
+    DirectMessageConversation,
+)
+
+User = get_user_model()
+
+
+class MessageSearchViewTests(TestCase):
+    """Test full-text search over a server's channel messages"""
+
+    def setUp(self):
+        """Set up a server with a public and an admin-only channel"""
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.outsider = User.objects.create_user(
+            email="outsider@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.general = self.server.channels.get(name="general")
+        self.staff = Channel.objects.create(
+            name="staff", server=self.server, min_read_role="admin"
+        )
+        self.url = f"/api/servers/{self.server.id}/channels/search/"
+
+        start = timezone.now() - timedelta(hours=1)
+        self.deploy_messages = []
+        for i, content in enumerate(
+            [
+                "Deploying the new release tonight",
+                "Lunch anyone?",
+                "The deploy went fine",
+                "Who deployed on Friday?",
+            ]
+        ):
+            message = Message.objects.create(
+                content=content,
+                channel=self.general,
+                author=self.owner,
+                created_at=start + timedelta(minutes=i),
+            )
+            if "eploy" in content:
+                self.deploy_messages.append(message)
+        self.staff_message = Message.objects.create(
+            content="Deploy credentials rotated",
+            channel=self.staff,
+            author=self.owner,
+            created_at=start + timedelta(minutes=10),
+        )
+
+        self.client.force_authenticate(user=self.member)
+
+    def test_search_matches_word_forms_newest_first(self):
+        """Test that stemmed matches come back newest first with highlights"""
+        response = self.client.get(self.url, {"q": "deploy"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["id"] for result in response.data],
+            [str(message.id) for message in reversed(self.deploy_messages)],
+        )
+        for result in response.data:
+            self.assertIn("<mark>", result["highlight"])
+            self.assertEqual(result["channel_id"], str(self.general.id))
+
+    def test_search_skips_unreadable_channels(self):
+        """Test that members do not find messages in channels they cannot read"""
+        response = self.client.get(self.url, {"q": "credentials"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(self.url, {"q": "credentials"})
+        self.assertEqual(
+            [result["id"] for result in response.data], [str(self.staff_message.id)]
+        )
+
+    def test_search_one_channel(self):
+        """Test scoping the search to a single channel"""
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(
+            self.url, {"q": "deploy", "channel": str(self.staff.id)}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["id"] for result in response.data], [str(self.staff_message.id)]
+        )
+
+    def test_search_unreadable_channel_forbidden(self):
+        """Test that scoping to an unreadable channel is refused"""
+        response = self.client.get(
+            self.url, {"q": "deploy", "channel": str(self.staff.id)}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_search_pagination(self):
+        """Test paging through results with limit and before"""
+        first = self.client.get(self.url, {"q": "deploy", "limit": 2})
+        self.assertEqual(len(first.data), 2)
+
+        second = self.client.get(
+            self.url, {"q": "deploy", "limit": 2, "before": first.data[-1]["id"]}
+        )
+        self.assertEqual(
+            [result["id"] for result in first.data + second.data],
+            [str(message.id) for message in reversed(self.deploy_messages)],
+        )
+
+    def test_search_reflects_edits_and_deletes(self):
+        """Test that edited content is reindexed and deleted messages are hidden"""
+        edited, deleted = self.deploy_messages[0], self.deploy_messages[1]
+        edited.content = "Rolling out the new release tonight"
+        edited.save()
+        deleted.is_deleted = True
+        deleted.save()
+
+        response = self.client.get(self.url, {"q": "deploy"})
+        self.assertEqual(
+            [result["id"] for result in response.data],
+            [str(self.deploy_messages[2].id)],
+        )
+        response = self.client.get(self.url, {"q": "rolling"})
+        self.assertEqual([result["id"] for result in response.data], [str(edited.id)])
+
+    def test_search_query_syntax_is_literal(self):
+        """Test that search operators in the query are treated as words"""
+        response = self.client.get(self.url, {"q": 'deploy* OR "lunch'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_search_requires_query(self):
+        """Test that an empty query is rejected"""
+        response = self.client.get(self.url, {"q": "  "})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_non_member_forbidden(self):
+        """Test that only server members can search it"""
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(self.url, {"q": "deploy"})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DirectMessageSearchViewTests(TestCase):
+    """Test full-text search over a user's direct messages"""
+
+    def setUp(self):
+        """Set up conversations with and without the searching user"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="user@test.com", password="testpass123"
+        )
+        self.friend = User.objects.create_user(
+            email="friend@test.com", password="testpass123"
+        )
+        self.other = User.objects.create_user(
+            email="other@test.com", password="testpass123"
+        )
+        self.conversation, _ = DirectMessageConversation.get_or_create_conversation(
+            self.user, self.friend
+        )
+        self.foreign, _ = DirectMessageConversation.get_or_create_conversation(
+            self.friend, self.other
+        )
+        self.message = DirectMessage.objects.create(
+            conversation=self.conversation, sender=self.friend, content="Meet at noon"
+        )
+        DirectMessage.objects.create(
+            conversation=self.foreign, sender=self.other, content="Meeting moved"
+        )
+        self.url = "/api/dm/conversations/search/"
+
+        self.client.force_authenticate(user=self.user)
+
+    def test_search_own_conversations(self):
+        """Test that only the user's conversations are searched"""
+        response = self.client.get(self.url, {"q": "meet"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["id"] for result in response.data], [str(self.message.id)]
+        )
+        self.assertIn("<mark>", response.data[0]["highlight"])
+
+    def test_search_foreign_conversation_forbidden(self):
+        """Test that scoping to someone else's conversation is refused"""
+        response = self.client.get(
+            self.url, {"q": "meet", "conversation": str(self.foreign.id)}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite FTS5 index")
+class SearchIndexTableRebuildTests(TransactionTestCase):
+    """Test that the SQLite search index survives rebuilds of the message table"""
+
+    def setUp(self):
+        """Set up a channel with messages, one of them deleted"""
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        self.general = self.server.channels.get(name="general")
+        deleted, self.lunch, self.deploy = [
+            Message.objects.create(
+                content=content, channel=self.general, author=self.owner
+            )
+            for content in ["Old news", "Lunch anyone?", "The deploy went fine"]
+        ]
+        deleted.delete()
+        self.url = f"/api/servers/{self.server.id}/channels/search/"
+        self.client.force_authenticate(user=self.owner)
+
+    def search(self, query):
+        response = self.client.get(self.url, {"q": query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result["id"] for result in response.data]
+
+    def test_search_after_table_remake_and_vacuum(self):
+        """Test that search finds the right messages after rowids are renumbered"""
+        with connection.schema_editor() as schema_editor:
+            schema_editor._remake_table(Message)
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM")
+        emit_post_migrate_signal(0, False, connection.alias)
+
+        self.assertEqual(self.search("deploy"), [str(self.deploy.id)])
+        self.assertEqual(self.search("lunch"), [str(self.lunch.id)])
+
+        # The triggers are back: new and edited messages are indexed
+        added = Message.objects.create(
+            content="Deploying again", channel=self.general, author=self.owner
+        )
+        self.lunch.content = "Deploy after lunch"
+        self.lunch.save()
+        self.assertCountEqual(
+            self.search("deploy"),
+            [str(message.id) for message in [self.deploy, self.lunch, added]],
+        )
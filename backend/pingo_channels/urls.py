@@ -4,10 +4,12 @@ from .views import (
     ChannelDetailView,
     MessageListView,
     MessageDetailView,
+    MessageSearchView,
 )
 
 urlpatterns = [
     path("", ChannelListView.as_view(), name="channel-list"),
+    path("search/", MessageSearchView.as_view(), name="message-search"),
     path("<uuid:channel_id>/", ChannelDetailView.as_view(), name="channel-detail"),
     path("<uuid:channel_id>/messages/", MessageListView.as_view(), name="message-list"),
     path(
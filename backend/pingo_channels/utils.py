@@ -1,23 +1,93 @@
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
 from rest_framework.response import Response
 from rest_framework import status
-from servers.models import Server
-from pingo_channels.models import Channel, Message
+from common.metrics import timer
+from common.pagination import get_page_limit
+from servers.models import Server, ServerMembership
+from pingo_channels.models import (
+    Channel,
+    Message,
+    DirectMessage,
+    DirectMessageConversation,
+)
+from pingo_channels.encoding import (
+    chat_group_name,
+    direct_message_group_name,
+    member_group_name,
+    presence_group_name,
+    read_receipt_event,
+)
+
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 100
+MESSAGE_CURSOR_PARAMS = ("before", "after", "around")
+CONVERSATION_PAGE_SIZE = 50
+MAX_CONVERSATION_PAGE_SIZE = 100
+CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def channel_layer_redis_url():
+    """URL of the Redis server behind the default channel layer, if it has one"""
+    layer = settings.CHANNEL_LAYERS["default"]
+    if "redis" not in layer["BACKEND"].lower():
+        return None
+    host = layer["CONFIG"]["hosts"][0]
+    return host["address"] if isinstance(host, dict) else host
 
 
 def get_channel_and_check_access(
     request, server_id, channel_id, required_permission="can_view"
 ):
-    try:
-        server = Server.objects.get(pk=server_id)
-    except Server.DoesNotExist:
+    """
+    Resolve the channel, its server and the requesting user's role in a single
+    query and check the required permission.
+
+    Returns ``(channel, role, error_response)``. The channel comes with its
+    server loaded and with ``can_view``, ``can_read`` and ``can_post`` set for
+    the user, so serializers do not need to look the permissions up again.
+    """
+    with timer("channel.access_check", channel=channel_id):
+        channel = (
+            Channel.objects.with_user_role(request.user)
+            .filter(server_id=server_id, pk=channel_id)
+            .first()
+        )
+
+    if not channel:
+        # Work out which lookup failed only on the error path
+        if not Server.objects.filter(pk=server_id).exists():
+            return (
+                None,
+                None,
+                Response(
+                    {"error": "Server not found."}, status=status.HTTP_404_NOT_FOUND
+                ),
+            )
+        role = ServerMembership.get_role(request.user, server_id, request)
+        if not role:
+            return (
+                None,
+                None,
+                Response(
+                    {"error": "You are not a member of this server."},
+                    status=status.HTTP_403_FORBIDDEN,
+                ),
+            )
         return (
             None,
-            None,
-            Response({"error": "Server not found."}, status=status.HTTP_404_NOT_FOUND),
+            role,
+            Response({"error": "Channel not found."}, status=status.HTTP_404_NOT_FOUND),
         )
 
-    membership = server.membership.filter(user=request.user).first()
-    if not membership:
+    role = channel.user_role
+    if not role:
         return (
             None,
             None,
@@ -27,20 +97,14 @@ def get_channel_and_check_access(
             ),
         )
 
-    try:
-        channel = server.channels.get(pk=channel_id)
-    except Channel.DoesNotExist:
-        return (
-            None,
-            membership,
-            Response({"error": "Channel not found."}, status=status.HTTP_404_NOT_FOUND),
-        )
     # Check channel permissions
-    permissions = channel.get_user_permissions(request.user)
+    permissions = channel.get_role_permissions(role)
+    for permission, allowed in permissions.items():
+        setattr(channel, permission, allowed)
     if not permissions[required_permission]:
         return (
             None,
-            membership,
+            role,
             Response(
                 {
                     "error": f'You do not have permission to {required_permission.replace("can_", "")} this channel'
@@ -49,7 +113,7 @@ def get_channel_and_check_access(
             ),
         )
 
-    return channel, membership, None
+    return channel, role, None
 
 
 def get_message_and_check_access(
@@ -60,14 +124,14 @@ def get_message_and_check_access(
     required_permission="can_read",
     require_author=False,
 ):
-    channel, membership, error_response = get_channel_and_check_access(
+    channel, role, error_response = get_channel_and_check_access(
         request, server_id, channel_id, required_permission
     )
     if error_response:
         return None, None, None, error_response
 
     try:
-        message = channel.messages.get(pk=message_id)
+        message = channel.messages.select_related("author").get(pk=message_id)
     except Message.DoesNotExist:
         return (
             None,
@@ -79,7 +143,7 @@ def get_message_and_check_access(
     # Check author permission if required
     if require_author and message.author != request.user:
         # Allow admins/owners/moderators to modify any message
-        if membership.role not in ["owner", "admin", "moderators"]:
+        if role not in ["owner", "admin", "moderators"]:
             return (
                 None,
                 None,
@@ -90,4 +154,190 @@ def get_message_and_check_access(
                 ),
             )
 
-    return channel, membership, message, None
+    return channel, role, message, None
+
+
+def get_message_page(request, channel):
+    """
+    Return one page of the channel's visible messages, newest first.
+
+    Pages are keyed on (created_at, id): at most one of ``before``, ``after``
+    or ``around`` may be given as a message id, and ``limit`` bounds the page
+    size. Every page is a range scan on the (channel, -created_at, id) index,
+    so its cost does not depend on how deep in the history the cursor is.
+    """
+    cursors = [name for name in MESSAGE_CURSOR_PARAMS if request.query_params.get(name)]
+    if len(cursors) > 1:
+        return None, Response(
+            {"error": "Only one of before, after or around can be used."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    limit, error_response = get_page_limit(
+        request, MESSAGE_PAGE_SIZE, MAX_MESSAGE_PAGE_SIZE
+    )
+    if error_response:
+        return None, error_response
+
+    messages = channel.messages.filter(is_deleted=False).select_related("author")
+    newest_first = messages.order_by("-created_at", "id")
+    if not cursors:
+        return list(newest_first[:limit]), None
+
+    direction = cursors[0]
+    try:
+        cursor_id = uuid.UUID(request.query_params[direction])
+    except ValueError:
+        return None, Response(
+            {"error": f"{direction} must be a message id."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # Deleted messages are still valid cursors, so look them up unfiltered
+    cursor = channel.messages.filter(pk=cursor_id).values("created_at", "id").first()
+    if not cursor:
+        return None, Response(
+            {"error": "Message not found."}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    older = Q(created_at__lt=cursor["created_at"]) | Q(
+        created_at=cursor["created_at"], id__gt=cursor["id"]
+    )
+    newer = Q(created_at__gt=cursor["created_at"]) | Q(
+        created_at=cursor["created_at"], id__lt=cursor["id"]
+    )
+
+    if direction == "before":
+        return list(newest_first.filter(older)[:limit]), None
+
+    newer_page = list(
+        messages.filter(newer).order_by("created_at", "-id")[
+            : limit if direction == "after" else limit // 2
+        ]
+    )
+    newer_page.reverse()
+    if direction == "after":
+        return newer_page, None
+
+    # around: the cursor message sits between the newer and older halves
+    page = newer_page + list(messages.filter(pk=cursor["id"]))
+    return page + list(newest_first.filter(older)[: limit - len(page)]), None
+
+
+def conversation_cursor(conversation):
+    """
+    The ``before`` cursor of the page that follows ``conversation``:
+    ``<updated_at in microseconds since the epoch>:<id>``
+    """
+    micros = (conversation.updated_at - CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"{micros}:{conversation.id}"
+
+
+def parse_conversation_cursor(cursor):
+    """``(updated_at, id)`` from a conversation_cursor, None if malformed"""
+    micros, _, conversation_id = cursor.partition(":")
+    try:
+        return (
+            CURSOR_EPOCH + timedelta(microseconds=int(micros)),
+            uuid.UUID(conversation_id),
+        )
+    except (ValueError, OverflowError):
+        return None
+
+
+def get_conversation_page(request, conversations):
+    """
+    Return one page of conversations, most recently active first, and the
+    cursor of the next page (None on the last page).
+
+    Pages are keyed on (updated_at, id); ``limit`` bounds the page size and
+    ``before`` takes the cursor returned with the previous page. The cursor
+    records when the last conversation of the page was active, so a new
+    message moving it to the top does not restart the paging. A bare
+    conversation id is still accepted as ``before`` and pages from the
+    conversation's current activity.
+    """
+    limit, error_response = get_page_limit(
+        request, CONVERSATION_PAGE_SIZE, MAX_CONVERSATION_PAGE_SIZE
+    )
+    if error_response:
+        return None, None, error_response
+
+    conversations = conversations.order_by("-updated_at", "id")
+    before = request.query_params.get("before")
+    if before:
+        cursor = parse_conversation_cursor(before) if ":" in before else None
+        if ":" not in before:
+            try:
+                conversation_id = uuid.UUID(before)
+            except ValueError:
+                conversation_id = None
+            if conversation_id:
+                # Only the requesting user's conversations can be cursors
+                cursor = (
+                    conversations.filter(pk=conversation_id)
+                    .values_list("updated_at", "id")
+                    .first()
+                )
+                if cursor is None:
+                    return (
+                        None,
+                        None,
+                        Response(
+                            {"error": "Conversation not found."},
+                            status=status.HTTP_404_NOT_FOUND,
+                        ),
+                    )
+        if cursor is None:
+            return (
+                None,
+                None,
+                Response(
+                    {"error": "before must be a conversation cursor."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                ),
+            )
+        updated_at, conversation_id = cursor
+        conversations = conversations.filter(
+            Q(updated_at__lt=updated_at)
+            | Q(updated_at=updated_at, id__gt=conversation_id)
+        )
+
+    page = list(conversations[:limit])
+    next_cursor = conversation_cursor(page[-1]) if len(page) == limit else None
+    return page, next_cursor, None
+
+
+def broadcast_on_commit(group_name, event):
+    """
+    Send an event to a channel layer group once the current transaction
+    commits, so sockets never hear about changes that were rolled back.
+    """
+    channel_layer = get_channel_layer()
+    transaction.on_commit(
+        lambda: async_to_sync(channel_layer.group_send)(group_name, event)
+    )
+
+
+def mark_conversation_read(conversation, user, message_id=None):
+    """
+    Move the user's read watermark up to ``message_id``, or to the latest
+    message, and broadcast a read receipt if it moved.
+
+    Returns False if ``message_id`` is not a message in the conversation.
+    """
+    up_to = None
+    if message_id:
+        try:
+            up_to = conversation.messages.only("created_at").get(pk=message_id)
+        except (DirectMessage.DoesNotExist, ValidationError):
+            return False
+
+    if conversation.mark_read(user, up_to):
+        broadcast_on_commit(
+            direct_message_group_name(conversation.id),
+            read_receipt_event(
+                conversation.id, user.id, conversation.get_last_read_at(user)
+            ),
+        )
+    return True
@@ -1,21 +1,45 @@
+import uuid
+from redis import RedisError
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
-from django.db.models import Q
 from .models import Channel, Message, DirectMessageConversation, DirectMessage
 from rest_framework.permissions import IsAuthenticated
 from .serializers import (
     ChannelSerializer,
     ChannelCreateSerializer,
+    ChannelUpdateSerializer,
     MessageCreateSerializer,
     MessageSerializer,
     DirectMessageConversationCreateSerializer,
     DirectMessageConversationSerializer,
     DirectMessageCreateSerializer,
     DirectMessageSerializer,
+    DirectMessageSearchResultSerializer,
+    MessageSearchResultSerializer,
 )
-from servers.models import Server
-from .utils import get_channel_and_check_access, get_message_and_check_access
+from .access import CHANNEL_ROLE_FIELDS, broadcast_channel_roles
+from .encoding import chat_message_event, message_update_event
+from .presence import get_presence
+from .replay import broadcast_sequenced_on_commit
+from .search import get_search_page
+from servers.models import Server, ServerMembership
+from .utils import (
+    chat_group_name,
+    get_channel_and_check_access,
+    get_conversation_page,
+    get_message_and_check_access,
+    get_message_page,
+    mark_conversation_read,
+)
+
+
+def broadcast_message_update(server_id, channel_id, message):
+    """Tell the channel's sockets about an edited or deleted message"""
+    broadcast_sequenced_on_commit(
+        chat_group_name(server_id, channel_id),
+        lambda seq: message_update_event(server_id, channel_id, message, seq),
+    )
 
 
 class ChannelListView(APIView):
@@ -24,25 +48,25 @@ class ChannelListView(APIView):
     def get(self, request, server_id):
         # server must exist
         try:
-            server = Server.objects.get(pk=server_id)
+            server = Server.objects.select_related("owner").get(pk=server_id)
         except Server.DoesNotExist:
             return Response(
                 {"error": "Server not found."}, status=status.HTTP_404_NOT_FOUND
             )
         # user must be a server member
-        membership = server.membership.filter(user=request.user).first()
-        if not membership:
+        role = ServerMembership.get_role(request.user, server.id, request)
+        if not role:
             return Response(
                 {"error": "You are not a member of this server."},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
         # user must only see channels they have permissions for
-        permitted_channels = []
-        for channel in server.channels.all():
-            permissions = channel.get_user_permissions(request.user)
-            if permissions["can_view"]:
-                permitted_channels.append(channel)
+        permitted_channels = (
+            server.channels.with_role_permissions(role)
+            .filter(can_view=True)
+            .select_related("created_by")
+        )
 
         serializer = ChannelSerializer(
             permitted_channels, many=True, context={"request": request}
@@ -122,18 +146,18 @@ class ChannelDetailView(APIView):
         return Response(channel_serializer.data, status=status.HTTP_200_OK)
 
     def patch(self, request, server_id, channel_id):
-        channel, membership, error_response = get_channel_and_check_access(
+        channel, role, error_response = get_channel_and_check_access(
             request, server_id, channel_id, "can_view"
         )
         if error_response:
             return error_response
 
-        if membership.role not in ["owner", "admin"]:
+        if role not in ["owner", "admin"]:
             return Response(
                 {"error": "You do not have permission to update this channel."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        channel_serializer = ChannelCreateSerializer(
+        channel_serializer = ChannelUpdateSerializer(
             channel, data=request.data, partial=True
         )
 
@@ -151,21 +175,29 @@ class ChannelDetailView(APIView):
                         {"error": "Another channel with the same name already exists."},
                         status=status.HTTP_400_BAD_REQUEST,
                     )
+            roles = [getattr(channel, field) for field in CHANNEL_ROLE_FIELDS]
             updated_channel = channel_serializer.save()
+            if roles != [getattr(channel, field) for field in CHANNEL_ROLE_FIELDS]:
+                broadcast_channel_roles(updated_channel)
+                # The permission flags loaded with the channel predate the change
+                for permission, allowed in channel.get_role_permissions(role).items():
+                    setattr(updated_channel, permission, allowed)
             response_serializer = ChannelSerializer(
                 updated_channel, context={"request": request}
             )
             return Response(response_serializer.data, status=status.HTTP_200_OK)
 
+        return Response(channel_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     def delete(self, request, server_id, channel_id):
-        channel, membership, error_response = get_channel_and_check_access(
+        channel, role, error_response = get_channel_and_check_access(
             request, server_id, channel_id, "can_view"
         )
 
         if error_response:
             return error_response
 
-        if membership.role != "owner":
+        if role != "owner":
             return Response(
                 {"error": "Only server owner can delete channels"},
                 status=status.HTTP_403_FORBIDDEN,
@@ -192,14 +224,17 @@ class MessageListView(APIView):
         if error_response:
             return error_response
 
-        messages = channel.messages.filter(is_deleted=False)
+        messages, error_response = get_message_page(request, channel)
+        if error_response:
+            return error_response
+
         message_serializer = MessageSerializer(
             messages, many=True, context={"request": request}
         )
         return Response(message_serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, server_id, channel_id):
-        channel, membership, error_response = get_channel_and_check_access(
+        channel, role, error_response = get_channel_and_check_access(
             request, server_id, channel_id, "can_post"
         )
         if error_response:
@@ -212,6 +247,12 @@ class MessageListView(APIView):
             )
 
         new_message = message_serializer.save(author=request.user, channel=channel)
+        # The same frame as a message sent over the socket
+        message_data = MessageSerializer(new_message).data
+        broadcast_sequenced_on_commit(
+            chat_group_name(server_id, channel_id),
+            lambda seq: chat_message_event(server_id, channel_id, message_data, seq),
+        )
         response_serializer = MessageSerializer(
             new_message, context={"request": request}
         )
@@ -254,6 +295,7 @@ class MessageDetailView(APIView):
         )
         if message_serializer.is_valid():
             updated_message = message_serializer.save()
+            broadcast_message_update(server_id, channel_id, updated_message)
             response_serializer = MessageSerializer(
                 updated_message, context={"request": request}
             )
@@ -275,21 +317,110 @@ class MessageDetailView(APIView):
             )
         message.is_deleted = True
         message.save()
+        broadcast_message_update(server_id, channel_id, message)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class MessageSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, server_id):
+        """
+        Search the server's messages, or one channel's with ``channel``.
+        Only channels the user can read are searched.
+        """
+        channel_id = request.query_params.get("channel")
+        if channel_id:
+            try:
+                channel_id = uuid.UUID(channel_id)
+            except ValueError:
+                return Response(
+                    {"error": "channel must be a channel id."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            channel, _, error_response = get_channel_and_check_access(
+                request, server_id, channel_id, "can_read"
+            )
+            if error_response:
+                return error_response
+            messages = channel.messages.all()
+        else:
+            if not Server.objects.filter(pk=server_id).exists():
+                return Response(
+                    {"error": "Server not found."}, status=status.HTTP_404_NOT_FOUND
+                )
+            role = ServerMembership.get_role(request.user, server_id, request)
+            if not role:
+                return Response(
+                    {"error": "You are not a member of this server."},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+            messages = Message.objects.filter(
+                channel__server_id=server_id,
+                channel__min_read_role__in=ServerMembership.roles_at_or_below(role),
+            )
+
+        results, error_response = get_search_page(
+            request, messages.filter(is_deleted=False).select_related("author")
+        )
+        if error_response:
+            return error_response
+
+        serializer = MessageSearchResultSerializer(
+            results, many=True, context={"request": request}
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ServerPresenceView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, server_id):
+        """List the ids of the server's users who are online right now"""
+        if not Server.objects.filter(pk=server_id).exists():
+            return Response(
+                {"error": "Server not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        if not ServerMembership.get_role(request.user, server_id, request):
+            return Response(
+                {"error": "You are not a member of this server."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        try:
+            online = get_presence().store.online_in_server(server_id)
+        except RedisError:
+            return Response(
+                {"error": "Presence is temporarily unavailable."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        return Response(
+            {"server_id": str(server_id), "online": sorted(online)},
+            status=status.HTTP_200_OK,
+        )
+
+
 class DirectMessageConversationListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        conversations = DirectMessageConversation.objects.filter(
-            Q(participant1=request.user) | Q(participant2=request.user)
-        ).order_by("-updated_at")
+        conversations = DirectMessageConversation.objects.for_participant(
+            request.user
+        ).with_inbox_data(request.user)
+        conversations, next_cursor, error_response = get_conversation_page(
+            request, conversations
+        )
+        if error_response:
+            return error_response
 
         serializer = DirectMessageConversationSerializer(
             conversations, many=True, context={"request": request}
         )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            # The body stays a plain list; pass this back as ``before``
+            response["X-Next-Cursor"] = next_cursor
+        return response
 
     def post(self, request):
         conversation_serializer = DirectMessageConversationCreateSerializer(
@@ -316,7 +447,9 @@ class DirectMessageConversationDetailView(APIView):
 
     def get(self, request, conversation_id):
         try:
-            conversation = DirectMessageConversation.objects.get(pk=conversation_id)
+            conversation = DirectMessageConversation.objects.with_inbox_data(
+                request.user
+            ).get(pk=conversation_id)
         except DirectMessageConversation.DoesNotExist:
             return Response(
                 {"error": "Conversation not found."}, status=status.HTTP_404_NOT_FOUND
@@ -350,7 +483,7 @@ class DirectMessageListView(APIView):
                 {"error": "You are not a participant in this conversation."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        messages = conversation.messages.all()
+        messages = conversation.messages.select_related("sender")
         serializer = DirectMessageSerializer(
             messages, many=True, context={"request": request}
         )
@@ -387,3 +520,89 @@ class DirectMessageListView(APIView):
             message, context={"request": request}
         )
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
+class DirectMessageReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, conversation_id):
+        """
+        Mark the conversation read up to ``message_id`` (default: the latest
+        message). Moves the user's read watermark in a single UPDATE however
+        many messages it covers.
+        """
+        try:
+            conversation = DirectMessageConversation.objects.get(pk=conversation_id)
+        except DirectMessageConversation.DoesNotExist:
+            return Response(
+                {"error": "Conversation not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        if not conversation.is_participant(request.user):
+            return Response(
+                {"error": "You are not a participant in this conversation."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        if not mark_conversation_read(
+            conversation, request.user, request.data.get("message_id")
+        ):
+            return Response(
+                {"error": "Message not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response(
+            {
+                "conversation_id": conversation.id,
+                "last_read_at": conversation.get_last_read_at(request.user),
+                "unread_count": conversation.get_unread_count(request.user),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class DirectMessageSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Search the user's direct messages, or one conversation's with
+        ``conversation``.
+        """
+        conversations = DirectMessageConversation.objects.for_participant(request.user)
+        conversation_id = request.query_params.get("conversation")
+        if conversation_id:
+            try:
+                conversation_id = uuid.UUID(conversation_id)
+            except ValueError:
+                return Response(
+                    {"error": "conversation must be a conversation id."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            try:
+                conversation = DirectMessageConversation.objects.get(pk=conversation_id)
+            except DirectMessageConversation.DoesNotExist:
+                return Response(
+                    {"error": "Conversation not found."},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+            if not conversation.is_participant(request.user):
+                return Response(
+                    {"error": "You are not a participant in this conversation."},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+            conversations = conversations.filter(pk=conversation_id)
+
+        results, error_response = get_search_page(
+            request,
+            DirectMessage.objects.filter(
+                conversation__in=conversations.values("pk")
+            ).select_related("sender", "conversation"),
+        )
+        if error_response:
+            return error_response
+
+        serializer = DirectMessageSearchResultSerializer(
+            results, many=True, context={"request": request}
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
@@ -20,6 +20,7 @@ django_asgi_app = get_asgi_application()
 
 # Now import WebSocket routing (after Django is initialized)
 from pingo_channels.routing import websocket_urlpatterns
+from accounts.middleware import JWTAuthMiddleware
 
 # ASGI application that handles both HTTP and WebSocket
 application = ProtocolTypeRouter(
@@ -27,12 +28,15 @@ application = ProtocolTypeRouter(
         # Handle traditional HTTP requests (REST API)
         "http": django_asgi_app,
         # Handle WebSocket connections (real-time chat)
+        # JWT auth runs inside the session stack so a valid token wins
         "websocket": AuthMiddlewareStack(
-            URLRouter(
-                [
-                    # Route WebSocket connections to pingo_channels app
-                    path("ws/", URLRouter(websocket_urlpatterns)),
-                ]
+            JWTAuthMiddleware(
+                URLRouter(
+                    [
+                        # Route WebSocket connections to pingo_channels app
+                        path("ws/", URLRouter(websocket_urlpatterns)),
+                    ]
+                )
             )
         ),
     }
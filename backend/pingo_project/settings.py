@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 
@@ -53,8 +54,19 @@ INSTALLED_APPS = [
 ASGI_APPLICATION = "pingo_project.asgi.application"
 
 # Channel Layers - Redis Configuration
-CHANNEL_LAYERS = {
-    "default": {
+# PINGO_CHANNEL_LAYER_FANOUT picks how a group message reaches its sockets:
+#   "socket": a Redis list per socket, so a broadcast is one write per
+#             subscriber, buffered for up to `expiry` seconds
+#   "worker": Redis pub/sub. Each worker subscribes once per group it has
+#             sockets in and hands every message to them in memory, so a
+#             broadcast is one PUBLISH and one delivery per worker. The layer
+#             is beta and delivers at most once; sequence replay only covers
+#             channel messages and edits, so direct messages, read receipts,
+#             presence and access changes can be lost. Not the default until
+#             those are sequenced too.
+PINGO_CHANNEL_LAYER_FANOUT = env("PINGO_CHANNEL_LAYER_FANOUT", default="socket")
+CHANNEL_LAYER_BACKENDS = {
+    "socket": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
             "hosts": [env("REDIS_URL", default="redis://redis:6379")],
@@ -62,8 +74,63 @@ CHANNEL_LAYERS = {
             "expiry": 60,  # Message expiry in seconds
         },
     },
+    "worker": {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+        "CONFIG": {
+            "hosts": [env("REDIS_URL", default="redis://redis:6379")],
+        },
+    },
+}
+if PINGO_CHANNEL_LAYER_FANOUT not in CHANNEL_LAYER_BACKENDS:
+    raise ImproperlyConfigured(
+        f"PINGO_CHANNEL_LAYER_FANOUT must be one of "
+        f"{', '.join(CHANNEL_LAYER_BACKENDS)}, not {PINGO_CHANNEL_LAYER_FANOUT!r}"
+    )
+CHANNEL_LAYERS = {"default": CHANNEL_LAYER_BACKENDS[PINGO_CHANNEL_LAYER_FANOUT]}
+
+# Write-behind persistence for chat messages sent over WebSockets: messages
+# are broadcast at once and stored in batches (see pingo_channels.persistence)
+PINGO_WRITE_BEHIND_MESSAGES = env.bool("PINGO_WRITE_BEHIND_MESSAGES", default=False)
+PINGO_WRITE_BEHIND_BATCH_SIZE = 100  # Rows per bulk_create
+PINGO_WRITE_BEHIND_FLUSH_MS = 50  # Longest a message waits before it is stored
+# Queued rows beyond which senders store their messages synchronously
+PINGO_WRITE_BEHIND_MAX_PENDING = 10000
+PINGO_WRITE_BEHIND_MAX_BACKOFF_SECONDS = 5  # Longest wait between retries
+# Where messages still unsaved at shutdown are kept until a worker restarts
+PINGO_WRITE_BEHIND_SPILL_DIR = env(
+    "PINGO_WRITE_BEHIND_SPILL_DIR", default=str(BASE_DIR / "write_behind_spill")
+)
+
+# Online presence (see pingo_channels.presence), stored next to the channel
+# layer. Each worker refreshes its sockets once per heartbeat and broadcasts
+# presence changes at most once per interval per server.
+PINGO_PRESENCE_HEARTBEAT_SECONDS = 30
+PINGO_PRESENCE_BROADCAST_MS = 1000
+
+# Reconnect replay (see pingo_channels.replay): the last frames broadcast to
+# each channel, kept for sockets that resume from a sequence number
+PINGO_REPLAY_BUFFER_SIZE = 500
+PINGO_REPLAY_BUFFER_TTL_SECONDS = 3600
+
+# Live access changes (see pingo_channels.access): about how often, with
+# random jitter, each socket re-reads its user's role and its channels'
+# permissions in case an access event was lost
+PINGO_ACCESS_RECHECK_SECONDS = 60
+
+# Per-socket outbound queues (see pingo_channels.outbound): how many frames
+# a socket may fall behind per group, by group name pattern, and what
+# happens to a socket that falls further behind
+PINGO_SEND_QUEUES = {
+    "chat_*": {"capacity": 500, "policy": "disconnect"},
+    "direct_message_conversation_*": {"capacity": 200, "policy": "disconnect"},
+    "presence_*": {"capacity": 50, "policy": "coalesce"},
 }
 
+# Hot-path instrumentation (see common.metrics). Set PINGO_METRICS_TOKEN to
+# expose /metrics/ to a Prometheus scraper.
+PINGO_METRICS_BACKEND = "common.metrics.InMemoryMetrics"
+PINGO_METRICS_TOKEN = env("PINGO_METRICS_TOKEN", default="")
+
 
 AUTH_USER_MODEL = "accounts.CustomUser"
 MIDDLEWARE = [
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from servers.models import Server
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount members for every server and fix any stored member_count that "
+        "has drifted. Safe to run periodically, e.g. from cron."
+    )
+
+    def handle(self, *args, **options):
+        fixed = Server.reconcile_member_counts()
+        self.stdout.write(
+            self.style.SUCCESS(f"Reconciled member counts for {fixed} server(s).")
+        )
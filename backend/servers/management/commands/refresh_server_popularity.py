@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from servers.models import Server
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount each active server's messages from the last week and update "
+        "the popularity ranking used by discovery. Only servers with recent "
+        "activity are touched, so it is cheap to run often, e.g. hourly from cron."
+    )
+
+    def handle(self, *args, **options):
+        refreshed = Server.refresh_popularity()
+        self.stdout.write(
+            self.style.SUCCESS(f"Refreshed popularity for {refreshed} server(s).")
+        )
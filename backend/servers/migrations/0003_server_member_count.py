@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_member_counts(apps, schema_editor):
+    Server = apps.get_model("servers", "Server")
+    ServerMembership = apps.get_model("servers", "ServerMembership")
+    Server.objects.update(
+        member_count=Coalesce(
+            Subquery(
+                ServerMembership.objects.filter(server=OuterRef("pk"))
+                .order_by()
+                .values("server")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("servers", "0002_rename_joined_at_servermembership_created_at_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="server",
+            name="member_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_member_counts, migrations.RunPython.noop),
+    ]
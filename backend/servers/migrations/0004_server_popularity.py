@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+# Copied from servers.models at the time of writing
+POPULARITY_MEMBER_WEIGHT = 10
+
+
+def backfill_popularity(apps, schema_editor):
+    """Rank by members until refresh_server_popularity counts activity"""
+    Server = apps.get_model("servers", "Server")
+    Server.objects.update(popularity=F("member_count") * POPULARITY_MEMBER_WEIGHT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("servers", "0003_server_member_count"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="server",
+            name="popularity",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="server",
+            name="recent_message_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="server",
+            index=models.Index(
+                fields=["visibility", "-popularity", "id"], name="server_discovery_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_popularity, migrations.RunPython.noop),
+    ]
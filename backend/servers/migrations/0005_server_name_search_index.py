@@ -0,0 +1,40 @@
+"""
+On PostgreSQL, index UPPER(name) with pg_trgm so that name__icontains
+searches in discovery do not scan every server. The index is built
+concurrently so that the server table stays writable. Other databases scan.
+"""
+
+from django.db import migrations
+from django.db.models.functions import Upper
+
+INDEX_NAME = "server_name_search"
+
+
+def create_name_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from django.contrib.postgres.indexes import GinIndex, OpClass
+
+    Server = apps.get_model("servers", "Server")
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    index = GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name=INDEX_NAME)
+    schema_editor.execute(index.create_sql(Server, schema_editor, concurrently=True))
+
+
+def drop_name_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{INDEX_NAME}"')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("servers", "0004_server_popularity"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_search_index, drop_name_search_index),
+    ]
@@ -1,7 +1,19 @@
-from django.db import models
+from datetime import timedelta
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from common.models import TimeStampedBaseModel
 from django.conf import settings
 
+# Discovery ranks public servers by popularity: each member is worth this many
+# messages posted in the last POPULARITY_WINDOW
+POPULARITY_MEMBER_WEIGHT = 10
+POPULARITY_WINDOW = timedelta(days=7)
+# Columns only ever changed with F() updates
+COUNTER_FIELDS = ("member_count", "recent_message_count", "popularity")
+
 
 class Server(TimeStampedBaseModel):
     VISIBILITY_CHOICES = (
@@ -24,11 +36,33 @@ class Server(TimeStampedBaseModel):
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="owned_servers"
     )
+    # Maintained by the ServerMembership signals, see servers/signals.py
+    member_count = models.PositiveIntegerField(default=0, editable=False)
+    # Refreshed by refresh_popularity()
+    recent_message_count = models.PositiveIntegerField(default=0, editable=False)
+    # member_count * POPULARITY_MEMBER_WEIGHT + recent_message_count
+    popularity = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["visibility", "-popularity", "id"],
+                name="server_discovery_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Counters are only ever changed with F() updates; writing them back
+            # from this instance could undo joins made since it was loaded
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
         # Ensure owner automatically becomes a member with role="owner"
         ServerMembership.objects.get_or_create(
@@ -37,7 +71,60 @@ class Server(TimeStampedBaseModel):
 
     @property
     def get_member_count(self):
-        return self.members.count()
+        return self.member_count
+
+    @classmethod
+    def reconcile_member_counts(cls):
+        """Recount every server's members, returning how many counts were wrong."""
+        actual_count = Coalesce(
+            Subquery(
+                ServerMembership.objects.filter(server=OuterRef("pk"))
+                .order_by()
+                .values("server")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+        return (
+            cls.objects.annotate(actual_count=actual_count)
+            .exclude(member_count=F("actual_count"))
+            .update(
+                member_count=actual_count,
+                popularity=actual_count * POPULARITY_MEMBER_WEIGHT
+                + F("recent_message_count"),
+            )
+        )
+
+    @classmethod
+    def refresh_popularity(cls, window=POPULARITY_WINDOW):
+        """
+        Recount messages posted in the last ``window`` and re-rank, touching
+        only servers with messages in the window or with a count to decay.
+        Each server costs index probes on (channel, created_at); servers
+        that have been quiet for a whole window are skipped. Returns the
+        number of servers updated.
+        """
+        Message = apps.get_model("pingo_channels", "Message")
+        recent = Message.objects.filter(
+            channel__server=OuterRef("pk"),
+            created_at__gte=timezone.now() - window,
+        )
+        recent_count = Coalesce(
+            Subquery(
+                recent.order_by()
+                .values("channel__server")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+        return cls.objects.filter(
+            Q(recent_message_count__gt=0) | Exists(recent)
+        ).update(
+            recent_message_count=recent_count,
+            popularity=F("member_count") * POPULARITY_MEMBER_WEIGHT + recent_count,
+        )
 
 
 class ServerMembership(TimeStampedBaseModel):
@@ -58,8 +145,53 @@ class ServerMembership(TimeStampedBaseModel):
     )
     role = models.CharField(max_length=10, choices=MEMBERSHIP_CHOICES, default="member")
 
+    ROLE_HIERARCHY = {"member": 0, "moderator": 1, "admin": 2, "owner": 3}
+
     def __str__(self):
         return f"{self.user.display_name} - {self.server.name}"
 
+    def save(self, *args, **kwargs):
+        # Keep the membership row and the server's member_count in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         unique_together = ["user", "server"]
+
+    @classmethod
+    def get_role(cls, user, server_id, request=None):
+        """
+        Return the user's role in the server, or None if not a member.
+
+        Given the ``request``, a member's role is remembered on it for the
+        rest of the request. Roles are never cached across requests, and a
+        non-member is never cached at all, since both decide access.
+        """
+        if user is None or user.pk is None:
+            return None
+
+        roles = getattr(request, "_server_roles", None)
+        if roles is None:
+            roles = {}
+            if request is not None:
+                request._server_roles = roles
+        key = str(server_id)
+        if key in roles:
+            return roles[key]
+
+        role = (
+            cls.objects.filter(user=user, server_id=server_id)
+            .values_list("role", flat=True)
+            .first()
+        )
+        if role:
+            roles[key] = role
+        return role
+
+    @classmethod
+    def roles_at_or_below(cls, role):
+        """Return every role whose level does not exceed the given role."""
+        if not role:
+            return []
+        level = cls.ROLE_HIERARCHY.get(role, 0)
+        return [name for name, rank in cls.ROLE_HIERARCHY.items() if rank <= level]
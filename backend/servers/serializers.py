@@ -10,7 +10,6 @@ class ServerCreateSerializer(serializers.ModelSerializer):
 
 
 class ServerSerializer(serializers.ModelSerializer):
-    member_count = serializers.ReadOnlyField(source="get_member_count")
     owner = UserProfileSerializer(read_only=True)
 
     class Meta:
@@ -26,6 +25,7 @@ class ServerSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
         ]
+        read_only_fields = ["member_count"]
 
 
 class ServerMembershipCreateSerializer(serializers.ModelSerializer):
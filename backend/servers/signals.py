@@ -0,0 +1,55 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import POPULARITY_MEMBER_WEIGHT, Server, ServerMembership
+
+
+@receiver(post_save, sender=ServerMembership)
+@receiver(post_delete, sender=ServerMembership)
+def update_member_count(sender, instance, created=False, **kwargs):
+    """
+    Keep Server.member_count, and the popularity derived from it, in step
+    with membership rows. The counters are changed with an F() update so
+    concurrent joins and leaves do not race.
+    """
+    if kwargs["signal"] is post_save:
+        if not created:
+            return
+        delta = 1
+    else:
+        delta = -1
+
+    Server.objects.filter(pk=instance.server_id).update(
+        member_count=F("member_count") + delta,
+        popularity=F("popularity") + delta * POPULARITY_MEMBER_WEIGHT,
+    )
+    # Keep an already loaded server (e.g. the one that was just created) in step
+    if ServerMembership.server.is_cached(instance):
+        instance.server.member_count += delta
+        instance.server.popularity += delta * POPULARITY_MEMBER_WEIGHT
+
+
+@receiver(m2m_changed, sender=Server.members.through)
+def track_members_added(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    ``server.members.add()`` bulk-creates memberships without post_save, so
+    handle it here. Removals and clears delete membership rows one by one and
+    are already covered by the post_delete receivers above.
+    """
+    if action != "post_add" or not pk_set:
+        return
+
+    if reverse:
+        # user.joined_servers.add(*servers)
+        Server.objects.filter(pk__in=pk_set).update(
+            member_count=F("member_count") + 1,
+            popularity=F("popularity") + POPULARITY_MEMBER_WEIGHT,
+        )
+    else:
+        # server.members.add(*users)
+        Server.objects.filter(pk=instance.pk).update(
+            member_count=F("member_count") + len(pk_set),
+            popularity=F("popularity") + len(pk_set) * POPULARITY_MEMBER_WEIGHT,
+        )
+        instance.member_count += len(pk_set)
+        instance.popularity += len(pk_set) * POPULARITY_MEMBER_WEIGHT
@@ -0,0 +1,52 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from servers.models import Server
+from pingo_channels.models import Message
+
+User = get_user_model()
+
+
+class ReconcileMemberCountsCommandTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Server001", owner=self.owner)
+        self.other_server = Server.objects.create(name="Server002", owner=self.owner)
+
+    def test_fixes_drifted_counts(self):
+        Server.objects.filter(pk=self.server.pk).update(member_count=0)
+        out = StringIO()
+
+        call_command("reconcile_member_counts", stdout=out)
+
+        self.assertIn("Reconciled member counts for 1 server(s).", out.getvalue())
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.member_count, 1)
+
+
+class RefreshServerPopularityCommandTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Server001", owner=self.owner)
+        Server.objects.create(name="Server002", owner=self.owner)
+
+    def test_refreshes_active_servers(self):
+        Message.objects.create(
+            content="Hello",
+            channel=self.server.channels.get(name="general"),
+            author=self.owner,
+        )
+        out = StringIO()
+
+        call_command("refresh_server_popularity", stdout=out)
+
+        self.assertIn("Refreshed popularity for 1 server(s).", out.getvalue())
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.recent_message_count, 1)
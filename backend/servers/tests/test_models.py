@@ -1,9 +1,17 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from datetime import timedelta
+from django.utils import timezone
 import uuid
-from servers.models import Server, ServerMembership
+from servers.models import (
+    POPULARITY_MEMBER_WEIGHT,
+    POPULARITY_WINDOW,
+    Server,
+    ServerMembership,
+)
+from pingo_channels.models import Message
 
 User = get_user_model()
 
@@ -97,3 +105,200 @@ class ServerMembershipModelTest(TestCase):
         )
         membership2 = ServerMembership.objects.create(user=user3, server=self.server)
         self.assertEqual(membership2.role, "member")
+
+
+class ServerMembershipRoleTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
+        )
+        self.user = User.objects.create_user(
+            email="member@example.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Server001", owner=self.owner)
+
+    def test_get_role(self):
+        ServerMembership.objects.create(
+            user=self.user, server=self.server, role="moderator"
+        )
+        self.assertEqual(
+            ServerMembership.get_role(self.user, self.server.id), "moderator"
+        )
+        self.assertEqual(ServerMembership.get_role(self.owner, self.server.id), "owner")
+
+    def test_get_role_non_member(self):
+        self.assertIsNone(ServerMembership.get_role(self.user, self.server.id))
+
+    def test_get_role_is_cached_on_request(self):
+        request = RequestFactory().get("/")
+        ServerMembership.get_role(self.owner, self.server.id, request)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ServerMembership.get_role(self.owner, self.server.id, request), "owner"
+            )
+        with self.assertNumQueries(1):
+            ServerMembership.get_role(
+                self.owner, self.server.id, RequestFactory().get("/")
+            )
+
+    def test_non_member_is_not_cached(self):
+        request = RequestFactory().get("/")
+        self.assertIsNone(ServerMembership.get_role(self.user, self.server.id, request))
+        ServerMembership.objects.create(user=self.user, server=self.server)
+        self.assertEqual(
+            ServerMembership.get_role(self.user, self.server.id, request), "member"
+        )
+
+    def test_role_follows_join(self):
+        self.assertIsNone(ServerMembership.get_role(self.user, self.server.id))
+        ServerMembership.objects.create(user=self.user, server=self.server)
+        self.assertEqual(ServerMembership.get_role(self.user, self.server.id), "member")
+
+    def test_role_follows_role_change(self):
+        membership = ServerMembership.objects.create(user=self.user, server=self.server)
+        self.assertEqual(ServerMembership.get_role(self.user, self.server.id), "member")
+
+        membership.role = "admin"
+        membership.save()
+        self.assertEqual(ServerMembership.get_role(self.user, self.server.id), "admin")
+
+    def test_role_follows_leave(self):
+        membership = ServerMembership.objects.create(user=self.user, server=self.server)
+        self.assertEqual(ServerMembership.get_role(self.user, self.server.id), "member")
+
+        membership.delete()
+        self.assertIsNone(ServerMembership.get_role(self.user, self.server.id))
+
+    def test_role_follows_server_delete(self):
+        server_id = self.server.id
+        self.assertEqual(ServerMembership.get_role(self.owner, server_id), "owner")
+
+        self.server.delete()
+        self.assertIsNone(ServerMembership.get_role(self.owner, server_id))
+
+    def test_roles_at_or_below(self):
+        self.assertEqual(ServerMembership.roles_at_or_below("member"), ["member"])
+        self.assertEqual(
+            ServerMembership.roles_at_or_below("admin"),
+            ["member", "moderator", "admin"],
+        )
+        self.assertEqual(ServerMembership.roles_at_or_below(None), [])
+
+
+class ServerMemberCountTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
+        )
+        self.user = User.objects.create_user(
+            email="member@example.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Server001", owner=self.owner)
+
+    def stored_count(self):
+        return Server.objects.values_list("member_count", flat=True).get(
+            pk=self.server.pk
+        )
+
+    def test_owner_counted_on_create(self):
+        self.assertEqual(self.server.member_count, 1)
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_count_follows_join_and_leave(self):
+        membership = ServerMembership.objects.create(user=self.user, server=self.server)
+        self.assertEqual(self.stored_count(), 2)
+
+        membership.role = "admin"
+        membership.save()
+        self.assertEqual(self.stored_count(), 2)
+
+        membership.delete()
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_count_follows_members_add_and_remove(self):
+        self.server.members.add(self.user)
+        self.assertEqual(self.server.member_count, 2)
+        self.assertEqual(self.stored_count(), 2)
+
+        self.server.members.remove(self.user)
+        self.assertEqual(self.stored_count(), 1)
+
+        self.user.joined_servers.add(self.server)
+        self.assertEqual(self.stored_count(), 2)
+
+        self.server.members.clear()
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_stale_instance_does_not_overwrite_count(self):
+        stale = Server.objects.get(pk=self.server.pk)
+        ServerMembership.objects.create(user=self.user, server=self.server)
+
+        stale.name = "Renamed"
+        stale.save()
+
+        self.assertEqual(self.stored_count(), 2)
+        self.assertEqual(Server.objects.get(pk=self.server.pk).name, "Renamed")
+
+    def test_reconcile_member_counts(self):
+        ServerMembership.objects.create(user=self.user, server=self.server)
+        Server.objects.filter(pk=self.server.pk).update(member_count=10)
+
+        self.assertEqual(Server.reconcile_member_counts(), 1)
+        self.assertEqual(self.stored_count(), 2)
+        self.assertEqual(Server.reconcile_member_counts(), 0)
+
+
+class ServerPopularityTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", password="testpass123"
+        )
+        self.user = User.objects.create_user(
+            email="member@example.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Server001", owner=self.owner)
+        self.channel = self.server.channels.get(name="general")
+
+    def stored(self):
+        return Server.objects.values_list("recent_message_count", "popularity").get(
+            pk=self.server.pk
+        )
+
+    def post(self, age):
+        Message.objects.create(
+            content="Hello",
+            channel=self.channel,
+            author=self.owner,
+            created_at=timezone.now() - age,
+        )
+
+    def test_popularity_follows_members(self):
+        self.assertEqual(self.stored(), (0, POPULARITY_MEMBER_WEIGHT))
+
+        membership = ServerMembership.objects.create(user=self.user, server=self.server)
+        self.assertEqual(self.stored(), (0, 2 * POPULARITY_MEMBER_WEIGHT))
+
+        membership.delete()
+        self.server.members.add(self.user)
+        self.assertEqual(self.server.popularity, 2 * POPULARITY_MEMBER_WEIGHT)
+        self.assertEqual(self.stored(), (0, 2 * POPULARITY_MEMBER_WEIGHT))
+
+    def test_refresh_counts_recent_messages(self):
+        self.post(timedelta(hours=1))
+        self.post(timedelta(days=1))
+        self.post(POPULARITY_WINDOW + timedelta(days=1))
+
+        self.assertEqual(Server.refresh_popularity(), 1)
+        self.assertEqual(self.stored(), (2, POPULARITY_MEMBER_WEIGHT + 2))
+
+    def test_refresh_decays_and_skips_quiet_servers(self):
+        Server.objects.create(name="Quiet", owner=self.owner)
+        self.post(timedelta(days=1))
+        Server.refresh_popularity()
+
+        self.assertEqual(Server.refresh_popularity(window=timedelta(hours=1)), 1)
+        self.assertEqual(self.stored(), (0, POPULARITY_MEMBER_WEIGHT))
+        self.assertEqual(Server.refresh_popularity(window=timedelta(hours=1)), 0)
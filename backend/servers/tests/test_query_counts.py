@@ -0,0 +1,65 @@
+# servers/tests/test_query_counts.py
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework import status
+from servers.models import Server, ServerMembership
+
+User = get_user_model()
+
+
+class ServerQueryCountTests(TestCase):
+    """
+    Pin the number of queries for the server list endpoints so that they stay
+    flat as the number of servers and members grows.
+    """
+
+    def setUp(self):
+        """Set up a user who owns and joins servers with many members"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="user@test.com", password="testpass123"
+        )
+        self.members = [
+            User.objects.create_user(email=f"member{i}@test.com", password="testpass")
+            for i in range(10)
+        ]
+        self.owned = Server.objects.create(name="Owned", owner=self.user)
+        for i in range(5):
+            server = Server.objects.create(
+                name=f"Joined {i}", owner=self.members[i], visibility="public"
+            )
+            ServerMembership.objects.create(user=self.user, server=server)
+        for i in range(5):
+            Server.objects.create(
+                name=f"Other {i}", owner=self.members[i], visibility="public"
+            )
+        for member in self.members[5:]:
+            ServerMembership.objects.create(user=member, server=self.owned)
+
+        self.client.force_authenticate(user=self.user)
+
+    def test_server_list_query_count(self):
+        """Test that listing my servers loads owners with the servers"""
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/servers/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["servers"]), 6)
+
+    def test_server_discovery_query_count(self):
+        """Test that discovery costs one query however many servers match"""
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/servers/", {"discovery": "true"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["servers"]), 5)
+
+    def test_membership_list_query_count(self):
+        """Test that members are prefetched instead of loaded one by one"""
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/servers/{self.owned.id}/memberships/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["memberships"]), 6)
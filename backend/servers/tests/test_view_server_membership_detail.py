@@ -1,9 +1,13 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from servers.models import Server, ServerMembership
+from pingo_channels.utils import member_group_name
+from pingo_channels.tests import IN_MEMORY_CHANNEL_LAYERS
 
 User = get_user_model()
 
@@ -394,3 +398,51 @@ class ServerMembershipDetailViewTests(TestCase):
             response.data["membership"]["server"]["id"], str(self.server.id)
         )
         self.assertEqual(response.data["membership"]["role"], "member")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MembershipChangeBroadcastTests(TestCase):
+    """Test that role changes and removals reach the member's sockets"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email="owner@test.com", password="testpass123"
+        )
+        self.member = User.objects.create_user(
+            email="member@test.com", password="testpass123"
+        )
+        self.server = Server.objects.create(name="Test Server", owner=self.owner)
+        ServerMembership.objects.create(
+            user=self.member, server=self.server, role="member"
+        )
+        self.url = reverse(
+            "server-membership-detail",
+            kwargs={"server_id": self.server.pk, "user_id": self.member.pk},
+        )
+        self.client.force_authenticate(user=self.owner)
+
+        self.channel_layer = get_channel_layer()
+        self.listener = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(
+            member_group_name(self.server.id, self.member.id), self.listener
+        )
+
+    def test_role_change_broadcast(self):
+        """Test that the new role is sent once the change commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, {"role": "moderator"})
+
+        event = async_to_sync(self.channel_layer.receive)(self.listener)
+        self.assertEqual(event["type"], "membership_changed")
+        self.assertEqual(event["server_id"], str(self.server.id))
+        self.assertEqual(event["role"], "moderator")
+
+    def test_removal_broadcast(self):
+        """Test that a removed member's sockets are told they have no role"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(self.url)
+
+        event = async_to_sync(self.channel_layer.receive)(self.listener)
+        self.assertEqual(event["type"], "membership_changed")
+        self.assertIsNone(event["role"])
@@ -76,6 +76,88 @@ class ServerListViewTests(TestCase):
         self.assertEqual(response.data["message"], "Success")
         self.assertEqual(len(response.data["servers"]), 3)
 
+    def test_discovery_member_counts_without_extra_queries(self):
+        """Test that discovery reads stored member counts in one query"""
+        self.client.force_authenticate(user=self.user3)
+        url = reverse("server-list")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"discovery": "true"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        counts = {
+            server["name"]: server["member_count"]
+            for server in response.data["servers"]
+        }
+        self.assertEqual(counts, {"Gaming Hub": 2})
+
+    def test_discovery_ranks_by_popularity(self):
+        """Test that discovery lists the most popular joinable servers first"""
+        quiet = Server.objects.create(
+            name="Quiet Server", visibility="public", owner=self.user2
+        )
+        Server.objects.filter(pk=quiet.pk).update(popularity=1000)
+        self.client.force_authenticate(user=self.user3)
+
+        response = self.client.get(reverse("server-list"), {"discovery": "true"})
+
+        names = [server["name"] for server in response.data["servers"]]
+        self.assertEqual(names, ["Quiet Server", "Gaming Hub"])
+
+    def test_discovery_pagination(self):
+        """Test paging through discovery with limit and after"""
+        for i in range(4):
+            server = Server.objects.create(
+                name=f"Server {i}", visibility="public", owner=self.user2
+            )
+            Server.objects.filter(pk=server.pk).update(popularity=100 - i)
+        self.client.force_authenticate(user=self.user3)
+        url = reverse("server-list")
+
+        first = self.client.get(url, {"discovery": "true", "limit": 3})
+        second = self.client.get(
+            url,
+            {"discovery": "true", "limit": 3, "after": first.data["servers"][-1]["id"]},
+        )
+
+        names = [s["name"] for s in first.data["servers"] + second.data["servers"]]
+        self.assertEqual(
+            names, ["Server 0", "Server 1", "Server 2", "Server 3", "Gaming Hub"]
+        )
+
+    def test_discovery_cursor_survives_reranking(self):
+        """Test that the next cursor pages from where the ranking was read"""
+        servers = []
+        for i in range(4):
+            server = Server.objects.create(
+                name=f"Server {i}", visibility="public", owner=self.user2
+            )
+            Server.objects.filter(pk=server.pk).update(popularity=100 - i)
+            servers.append(server)
+        self.client.force_authenticate(user=self.user3)
+        url = reverse("server-list")
+
+        first = self.client.get(url, {"discovery": "true", "limit": 2})
+        # The last server shown drops to the bottom before the next page
+        Server.objects.filter(pk=servers[1].pk).update(popularity=0)
+        second = self.client.get(
+            url, {"discovery": "true", "limit": 2, "after": first.data["next"]}
+        )
+
+        self.assertEqual(
+            [s["name"] for s in second.data["servers"]], ["Server 2", "Server 3"]
+        )
+        self.assertEqual(second.data["next"], f"97:{servers[3].id}")
+
+    def test_discovery_invalid_cursor(self):
+        """Test that discovery rejects a malformed after cursor"""
+        self.client.force_authenticate(user=self.user3)
+        response = self.client.get(
+            reverse("server-list"), {"discovery": "true", "after": "nope"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_filter_servers_by_owner(self):
         """Test filtering servers by member_type=owner"""
         self.client.force_authenticate(user=self.user1)
@@ -5,6 +5,7 @@ from .views import (
     ServerMembershipListView,
     ServerMembershipDetailView,
 )
+from pingo_channels.views import ServerPresenceView
 
 urlpatterns = [
     path("", ServerListView.as_view(), name="server-list"),
@@ -19,4 +20,9 @@ urlpatterns = [
         ServerMembershipDetailView.as_view(),
         name="server-membership-detail",
     ),
+    path(
+        "<uuid:server_id>/presence/",
+        ServerPresenceView.as_view(),
+        name="server-presence",
+    ),
 ]
@@ -1,3 +1,4 @@
+import uuid
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
@@ -9,14 +10,34 @@ from .serializers import (
     ServerMembershipSerializer,
 )
 from .models import Server, ServerMembership
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
+from common.pagination import get_page_limit
+from pingo_channels.access import broadcast_membership_change
+
+DISCOVERY_PAGE_SIZE = 50
+MAX_DISCOVERY_PAGE_SIZE = 100
+
+
+def parse_discovery_cursor(after):
+    """
+    Parse a discovery ``after`` value, either a ``<popularity>:<id>`` cursor
+    or a bare server id (popularity None). Returns None if malformed.
+    """
+    popularity, _, server_id = after.rpartition(":")
+    try:
+        return {
+            "popularity": int(popularity) if popularity else None,
+            "id": uuid.UUID(server_id),
+        }
+    except ValueError:
+        return None
 
 
 class ServerListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        servers = Server.objects.all()
+        servers = Server.objects.select_related("owner")
 
         # Handle different query modes
         discovery = request.query_params.get("discovery")
@@ -25,17 +46,9 @@ class ServerListView(APIView):
         visibility = request.query_params.get("visibility")
         search = request.query_params.get("search")
 
-        # Discovery mode - show public servers user can join
+        # Discovery mode - show public servers user can join, most popular first
         if discovery == "true":
-            servers = servers.filter(visibility="public")
-
-            # Get servers user is already in (as owner or member)
-            user_server_ids = ServerMembership.objects.filter(
-                user=request.user
-            ).values_list("server_id", flat=True)
-
-            # Exclude servers user already owns or is member of
-            servers = servers.exclude(Q(owner=request.user) | Q(id__in=user_server_ids))
+            return self.discover(request, servers, search)
 
         # My servers mode - show only user's joined servers
         elif my_servers == "true" or (
@@ -63,9 +76,7 @@ class ServerListView(APIView):
                 ).distinct()
 
         # Apply common filters (visibility, search)
-        if (
-            visibility and discovery != "true"
-        ):  # Don't override discovery visibility filter
+        if visibility:
             servers = servers.filter(visibility=visibility)
         if search:
             servers = servers.filter(name__icontains=search)
@@ -76,6 +87,74 @@ class ServerListView(APIView):
             status=status.HTTP_200_OK,
         )
 
+    def discover(self, request, servers, search):
+        """
+        Page through public servers the user has not joined, by descending
+        popularity. ``limit`` bounds the page size and ``after`` takes the
+        ``next`` cursor of the previous page, which records the popularity
+        the page ended at: refresh_popularity re-ranks servers between
+        requests, and paging from a server's current popularity would skip or
+        repeat servers. A bare server id is still accepted as ``after`` and
+        pages from its current popularity. Each page is a walk of the
+        (visibility, -popularity, id) index with a membership probe per row.
+        """
+        limit, error_response = get_page_limit(
+            request, DISCOVERY_PAGE_SIZE, MAX_DISCOVERY_PAGE_SIZE
+        )
+        if error_response:
+            return error_response
+
+        joined = ServerMembership.objects.filter(
+            user=request.user, server=OuterRef("pk")
+        )
+        servers = (
+            servers.filter(visibility="public")
+            .exclude(owner=request.user)
+            .exclude(Exists(joined))
+            .order_by("-popularity", "id")
+        )
+        if search:
+            servers = servers.filter(name__icontains=search)
+
+        after = request.query_params.get("after")
+        if after:
+            cursor = parse_discovery_cursor(after)
+            if cursor is None:
+                return Response(
+                    {"error": "after must be a next cursor or a server id."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if cursor["popularity"] is None:
+                cursor = (
+                    Server.objects.filter(pk=cursor["id"])
+                    .values("popularity", "id")
+                    .first()
+                )
+                if not cursor:
+                    return Response(
+                        {"error": "Server not found."},
+                        status=status.HTTP_404_NOT_FOUND,
+                    )
+            servers = servers.filter(
+                Q(popularity__lt=cursor["popularity"])
+                | Q(popularity=cursor["popularity"], id__gt=cursor["id"])
+            )
+
+        page = list(servers[:limit])
+        serializer = ServerSerializer(page, many=True)
+        return Response(
+            {
+                "message": "Success",
+                "servers": serializer.data,
+                "next": (
+                    f"{page[-1].popularity}:{page[-1].id}"
+                    if len(page) == limit
+                    else None
+                ),
+            },
+            status=status.HTTP_200_OK,
+        )
+
     def post(self, request):
         serializer = ServerCreateSerializer(data=request.data)
         if serializer.is_valid():
@@ -177,8 +256,10 @@ class ServerMembershipListView(APIView):
 
         if server_id:
             try:
-                server = Server.objects.prefetch_related("membership__user").get(
-                    pk=server_id
+                server = (
+                    Server.objects.select_related("owner")
+                    .prefetch_related("membership__user")
+                    .get(pk=server_id)
                 )
             except Server.DoesNotExist:
                 return Response(
@@ -367,6 +448,9 @@ class ServerMembershipDetailView(APIView):
         )
         if serializer.is_valid():
             updated_membership = serializer.save()
+            broadcast_membership_change(
+                server_id, updated_membership.user_id, updated_membership.role
+            )
             response_serializer = ServerMembershipSerializer(updated_membership)
             return Response(
                 {
@@ -416,6 +500,7 @@ class ServerMembershipDetailView(APIView):
             action_message = f"{membership.user.display_name} has been removed from {membership.server.name}."
 
         membership.delete()
+        broadcast_membership_change(server_id, user_id)
         return Response(
             {"message": action_message},
             status=status.HTTP_200_OK,